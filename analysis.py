@@ -0,0 +1,738 @@
+import hashlib
+import os
+import time
+from types import SimpleNamespace
+
+from google.genai import types
+
+from hedging import LatencyTracker, hedged_call
+from rate_limit import (
+    DEFAULT_RETRY_AFTER,
+    estimate_tokens,
+    is_rate_limited,
+    limiter,
+    retry_after,
+)
+from report import InspectionReport, parse_report, render_markdown
+from result_cache import prompt_hash, result_key
+from retry import EmptyResponseError, RetryPolicy, gave_up, run_with_retries
+from tracing import metrics, record_span
+
+# model_name = "gemini-2.0-flash-exp"
+MODEL_NAME = "gemini-2.5-pro"
+FALLBACK_MODEL = "gemini-2.5-flash"  # Fallback model for when primary fails
+HEDGE_MODEL = os.getenv("HEDGE_MODEL", FALLBACK_MODEL)  # raced against a slow primary
+MAX_RETRIES = 5
+# Config fields that make the model answer with a report.InspectionReport as JSON
+STRUCTURED_OUTPUT = {
+    "response_mime_type": "application/json",
+    "response_schema": InspectionReport,
+}
+
+
+# BACKUP PROMPTS (Original working prompts)
+BACKUP_USER_PROMPT = """Analyze the provided video(s) and/or image(s) to identify any household issues such as broken/leaking faucets, cracked doors, damp walls, damaged tiles, electrical issues, structural problems, etc. 
+
+If multiple files are provided, correlate information across all media to provide a comprehensive assessment. Generate a structured technical report using the following format:
+
+ISSUE TYPE:
+[Single line description of the primary issue(s) identified]
+
+LOCATION:
+[Specific location details based on visual evidence from videos/images]
+
+DETAILED ASSESSMENT:
+[Thorough description of the damage/issue based on analysis of all provided media]
+
+PHYSICAL CHARACTERISTICS:
+- [Bullet points describing measurable/observable features from videos and images]
+- [Include dimensions, patterns, extent of damage where visible]
+- [Note any progression or variation visible across different media]
+
+TECHNICAL IMPLICATIONS:
+- [List of structural/functional impacts]
+- [Safety concerns]
+- [Security implications]
+- [Environmental effects]
+
+REPAIR REQUIREMENTS:
+1. [Prioritized list of necessary repairs]
+2. [Include safety measures required]
+3. [Special considerations for repair work]
+
+DOCUMENTATION NOTES:
+- [Additional relevant observations from video/image analysis]
+- [Areas needing further inspection]
+- [Correlation between different media if multiple files provided]
+"""
+
+BACKUP_SYSTEM_PROMPT = """You are a professional property inspection assistant specializing in technical documentation. Your role is to analyze video and image content showing household issues and produce structured technical reports. You will receive one or more media files (videos and/or images) and must analyze all provided content comprehensively.
+
+Follow these key principles:
+
+1. MULTI-MEDIA ANALYSIS:
+- Analyze all provided videos and images thoroughly
+- Correlate information across different media types
+- Use static images for detailed visual assessment
+- Use video content for understanding motion, flow, or progressive damage
+- Synthesize findings from all sources into a unified report
+
+2. DOCUMENTATION STYLE:
+- Maintain strictly professional and technical language
+- Never use conversational phrases or first-person language
+- Exclude greetings, introductions, and concluding remarks
+- Avoid hedging words like "seems," "appears," or "might"
+
+3. REPORT STRUCTURE:
+- Use consistent hierarchical formatting
+- Present information in clearly defined sections
+- Employ bullet points for discrete observations
+- Use numbered lists only for sequential procedures
+
+4. TECHNICAL DETAILS:
+- Prioritize measurable and observable characteristics
+- Include specific measurements when visible
+- Document patterns and extent of damage precisely
+- Note spatial relationships and orientations
+- Reference specific media when making observations
+
+5. SAFETY AND COMPLIANCE:
+- Always highlight immediate safety concerns
+- Include relevant safety procedures for repairs
+- Note potential code violations or compliance issues
+- Document security implications
+
+6. COMMUNICATION STANDARDS:
+- Use industry-standard terminology
+- Maintain objective, fact-based descriptions
+- Exclude subjective assessments
+- Omit speculative content
+
+7. FOCUS AREAS:
+- Structural elements
+- Mechanical systems
+- Electrical components
+- Plumbing systems
+- Environmental conditions
+- Safety hazards
+- Security vulnerabilities
+
+FORMAT ALL OBSERVATIONS USING THE PRESCRIBED TEMPLATE STRUCTURE IN THE USER PROMPT."""
+
+
+def build_work_order_context(work_order_info=None):
+    """Describe the work order for the prompt; empty without a valid work order"""
+    if not (work_order_info and work_order_info.get("success")):
+        return ""
+    client_desc = work_order_info.get("client_description", "")
+    trades = work_order_info.get("trades", [])
+    work_order_num = work_order_info.get("work_order_number", "")
+
+    return f"""
+WORK ORDER CONTEXT:
+- Work Order Number: {work_order_num}
+- Client Description: {client_desc}
+- Relevant Trades: {', '.join(trades[:10])}{'...' if len(trades) > 10 else ''}
+"""
+
+
+def build_prompts(work_order_info=None):
+    """Build the system and user prompts for one analysis request"""
+
+    # Build context from work order if available
+    work_order_context = build_work_order_context(work_order_info)
+
+    USER_PROMPT = f"""Analyze the provided video(s) and/or image(s) to identify any household issues such as broken/leaking faucets, cracked doors, damp walls, damaged tiles, electrical issues, structural problems, etc. 
+
+{work_order_context}
+
+If multiple files are provided, correlate information across all media to provide a comprehensive assessment. When work order context is provided, validate your findings against the client description and focus on trades relevant to the identified issues.
+
+IMPORTANT: For technical measurements, only provide estimates when you can identify clear scale references in the media (such as standard doors ~80", electrical outlets ~4.5", floor tiles, fixtures, etc.). State your reference method and confidence level. Avoid speculative measurements without visual reference points.
+
+For the General Description section, use terminology that US service providers, contractors, and maintenance professionals would recognize on work orders and service tickets. Examples:
+- "Leaking faucet cartridge needs replacement" (not just "water leak")
+- "HVAC ductwork has loose joints requiring sealing" (not just "air loss")  
+- "Drywall patch and paint needed for wall damage" (not just "wall repair")
+- "Tile grout requires cleaning and resealing" (not just "tile maintenance")
+- "Electrical outlet replacement required" (not just "electrical issue")
+- "Roof shingle replacement needed for weather damage" (not just "roof damage")
+- "Caulk and weatherstrip door frame" (not just "door seal repair")
+- "Snake drain line to clear blockage" (not just "drainage problem")
+- "Replace wax ring and reseat toilet" (not just "toilet issue")
+
+Generate a structured technical report using the following format:
+
+WORK ORDER VALIDATION:
+[If work order context provided, assess alignment between visual findings and client description]
+
+ISSUE TYPE:
+[Single line description of the primary issue(s) identified]
+
+GENERAL DESCRIPTION:
+[Explanation of the issue using common terminology familiar to US service providers, contractors, and maintenance professionals. Use industry-standard language that would appear on work orders, service tickets, or contractor estimates.]
+
+LOCATION:
+[Specific location details based on visual evidence from videos/images]
+
+DETAILED ASSESSMENT:
+[Thorough description of the damage/issue based on analysis of all provided media]
+
+PHYSICAL CHARACTERISTICS:
+- [Bullet points describing measurable/observable features from videos and images]
+- [Include dimensions, patterns, extent of damage where visible]
+- [Note any progression or variation visible across different media]
+
+TECHNICAL MEASUREMENTS:
+- [Estimated dimensions where scale references are available (e.g., relative to standard fixtures, doors, tiles)]
+- [Area measurements for damage extent (approximate square footage/meters)]
+- [Linear measurements for cracks, gaps, or affected spans]
+- [Volume estimates for water damage, mold growth, or material loss]
+- [Depth assessments for cracks, holes, or deterioration]
+- [Angle measurements for structural misalignment or settling]
+- [Count of affected units (tiles, panels, fixtures, etc.)]
+- [Spacing measurements between structural elements]
+- [Height/clearance measurements where safety is concerned]
+- [Only include measurements that can be reasonably estimated from visual evidence with clear reference points]
+
+TECHNICAL IMPLICATIONS:
+- [List of structural/functional impacts]
+- [Safety concerns]
+- [Security implications]
+- [Environmental effects]
+
+RECOMMENDED TRADES:
+[List specific trades from the available trades list that are most relevant to the identified issues]
+
+REPAIR REQUIREMENTS:
+1. [Prioritized list of necessary repairs]
+2. [Include safety measures required]
+3. [Special considerations for repair work]
+
+DOCUMENTATION NOTES:
+- [Additional relevant observations from video/image analysis]
+- [Areas needing further inspection]
+- [Correlation between different media if multiple files provided]
+- [Alignment or discrepancies with client description if provided]
+"""
+
+    SYSTEM_PROMPT = f"""You are a professional property inspection assistant specializing in technical documentation. Your role is to analyze video and image content showing household issues and produce structured technical reports. You will receive one or more media files (videos and/or images) and must analyze all provided content comprehensively.
+
+When work order information is provided, use it to enhance your analysis by:
+- Validating visual findings against client descriptions
+- Focusing on trades most relevant to identified issues
+- Providing context-aware recommendations
+
+Follow these key principles:
+
+1. MULTI-MEDIA ANALYSIS:
+- Analyze all provided videos and images thoroughly
+- Correlate information across different media types
+- Use static images for detailed visual assessment
+- Use video content for understanding motion, flow, or progressive damage
+- Synthesize findings from all sources into a unified report
+
+2. WORK ORDER INTEGRATION:
+- When available, reference client description to validate findings
+- Prioritize trades relevant to identified issues
+- Note any discrepancies between reported and observed issues
+
+3. DOCUMENTATION STYLE:
+- Maintain strictly professional and technical language
+- Never use conversational phrases or first-person language
+- Exclude greetings, introductions, and concluding remarks
+- Avoid hedging words like "seems," "appears," or "might"
+
+4. REPORT STRUCTURE:
+- Use consistent hierarchical formatting
+- Present information in clearly defined sections
+- Employ bullet points for discrete observations
+- Use numbered lists only for sequential procedures
+
+5. TECHNICAL DETAILS:
+- Prioritize measurable and observable characteristics
+- Include specific measurements when visible with clear reference points
+- Document patterns and extent of damage precisely
+- Note spatial relationships and orientations
+- Reference specific media when making observations
+- Provide technical measurements using scale references (doors ~80", standard tiles, fixtures)
+- Estimate dimensions, areas, and volumes only when reasonable references are visible
+- Include quantitative assessments: counts, linear measurements, affected areas
+- Use standard units (feet/inches for US, meters/cm for metric)
+- Clearly state estimation methods and reference points used
+
+6. SAFETY AND COMPLIANCE:
+- Always highlight immediate safety concerns
+- Include relevant safety procedures for repairs
+- Note potential code violations or compliance issues
+- Document security implications
+
+7. COMMUNICATION STANDARDS:
+- Use industry-standard terminology
+- Maintain objective, fact-based descriptions
+- Exclude subjective assessments
+- Omit speculative content
+- For General Description section: Use common US service provider language (HVAC, plumbing, electrical, flooring, roofing, etc.)
+- Include terminology from work orders, service tickets, and contractor estimates
+- Use trade-specific language familiar to maintenance professionals and contractors
+
+8. FOCUS AREAS:
+- Structural elements
+- Mechanical systems
+- Electrical components
+- Plumbing systems
+- Environmental conditions
+- Safety hazards
+- Security vulnerabilities
+
+FORMAT ALL OBSERVATIONS USING THE PRESCRIBED TEMPLATE STRUCTURE IN THE USER PROMPT.{BACKUP_SYSTEM_PROMPT}"""
+
+    return SYSTEM_PROMPT, USER_PROMPT
+
+
+def build_cached_prompt(work_order_info=None):
+    """The per-request user prompt when the instructions come from a context cache"""
+    return (
+        "Analyze the provided video(s) and/or image(s) following the instructions "
+        "and report format given above.\n" + build_work_order_context(work_order_info)
+    )
+
+
+def build_contents(uploaded_files, user_prompt):
+    """Build the generate_content contents: every media file plus the user prompt
+
+    Inline images arrive as ready-made ``types.Part`` objects and are sent as is.
+    """
+    content_parts = []
+    for uploaded_file in uploaded_files:
+        if isinstance(uploaded_file, types.Part):
+            content_parts.append(uploaded_file)
+            continue
+        content_parts.append(
+            types.Part.from_uri(
+                file_uri=uploaded_file.uri, mime_type=uploaded_file.mime_type
+            )
+        )
+    if not content_parts:
+        return [user_prompt]  # a text-only request, e.g. merging segment reports
+    return [
+        types.Content(
+            role="user",
+            parts=content_parts,
+        ),
+        user_prompt,
+    ]
+
+
+def build_config(system_prompt, structured=False):
+    """Build the generation config used for every analysis request.
+
+    With ``structured`` the model answers with a report.InspectionReport as JSON.
+    """
+    return types.GenerateContentConfig(
+        system_instruction=system_prompt,
+        temperature=0.0,
+        **(STRUCTURED_OUTPUT if structured else {}),
+    )
+
+
+def build_cached_config(cache_name, structured=False):
+    """Build the generation config for a request whose instructions are cached"""
+    return types.GenerateContentConfig(
+        cached_content=cache_name,
+        temperature=0.0,
+        **(STRUCTURED_OUTPUT if structured else {}),
+    )
+
+
+def cached_request_for(context_cache, contents, structured=False):
+    """Return a run_analysis ``cached_request`` sending ``contents`` with a model's cache"""
+
+    def cached_request(model):
+        cache_name = context_cache.name(model)
+        if cache_name:
+            return contents, build_cached_config(cache_name, structured)
+
+    return cached_request
+
+
+def token_usage(response):
+    """Prompt, cached and output token counts of a response's usage metadata"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = (usage and usage.prompt_token_count) or 0
+    cached_tokens = (usage and usage.cached_content_token_count) or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "uncached_tokens": prompt_tokens - cached_tokens,
+        "output_tokens": (usage and usage.candidates_token_count) or 0,
+    }
+
+
+def generate(client, model, contents, config, estimated_tokens=0):
+    """Send one generate_content request through the shared rate limiter"""
+    response = limiter.call(
+        model,
+        lambda: client.models.generate_content(
+            model=model, contents=contents, config=config
+        ),
+        estimated_tokens,
+    )
+    usage = response.usage_metadata
+    limiter.settle(model, estimated_tokens, usage and usage.total_token_count)
+    return response
+
+
+# Primary model latencies and race winners, used to tune the hedge deadline
+latency_tracker = LatencyTracker()
+
+
+def generate_hedged(client, request, estimated_tokens=0):
+    """Ask the primary model and race HEDGE_MODEL if it is slower than usual.
+
+    ``request(model)`` returns the ``(contents, config)`` to send to a model.
+    The hedge fires once the primary has taken longer than its recorded
+    latency percentile. Returns ``(model, response)`` for the first non-empty
+    answer.
+    """
+    return hedged_call(
+        (
+            MODEL_NAME,
+            lambda: generate(
+                client, MODEL_NAME, *request(MODEL_NAME), estimated_tokens
+            ),
+        ),
+        (
+            HEDGE_MODEL,
+            lambda: generate(
+                client, HEDGE_MODEL, *request(HEDGE_MODEL), estimated_tokens
+            ),
+        ),
+        latency_tracker.deadline(MODEL_NAME),
+        is_valid=lambda response: bool(response.text and response.text.strip()),
+        tracker=latency_tracker,
+    )
+
+
+def generate_streaming(client, model, contents, config, on_text, estimated_tokens=0):
+    """Stream a model answer through the rate limiter, reporting partial text.
+
+    Returns a response-like object with the full ``text``, the last chunk's
+    ``candidates`` and ``time_to_first_token`` in seconds.
+    """
+    limiter.acquire(model, estimated_tokens)
+    started = time.monotonic()
+    first_token = None
+    text = ""
+    last_chunk = None
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=model, contents=contents, config=config
+        ):
+            last_chunk = chunk
+            if chunk.text:
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                text += chunk.text
+                on_text(text)
+    except Exception as e:
+        if is_rate_limited(e):
+            limiter.pause(model, retry_after(e) or DEFAULT_RETRY_AFTER)
+        raise
+
+    usage = last_chunk.usage_metadata if last_chunk else None
+    limiter.settle(model, estimated_tokens, usage and usage.total_token_count)
+    candidates = (last_chunk.candidates if last_chunk else None) or []
+    return SimpleNamespace(
+        text=text,
+        candidates=candidates,
+        usage_metadata=usage,
+        time_to_first_token=first_token,
+    )
+
+
+def media_fingerprints(uploaded_files, media_digests=None):
+    """Identify the analyzed media for caching: local digests or remote hashes"""
+    return media_digests or [
+        (
+            hashlib.sha256(f.inline_data.data).hexdigest()
+            if isinstance(f, types.Part)
+            else f.sha256_hash or f.uri
+        )
+        for f in uploaded_files
+    ]
+
+
+def describe_empty_response(model, response):
+    """Explain an empty answer using the first candidate's finish reason"""
+    candidates = getattr(response, "candidates", None) or []
+    finish_reason = (
+        getattr(candidates[0], "finish_reason", None) if candidates else None
+    )
+    return f"{model} returned an empty response (finish reason: {finish_reason})"
+
+
+def run_analysis(
+    client,
+    contents,
+    config,
+    estimated_tokens=0,
+    max_retries=MAX_RETRIES,
+    hedge=False,
+    on_text=None,
+    on_event=None,
+    cached_request=None,
+    validate=None,
+):
+    """Send an analysis request built once, retrying and falling back as needed.
+
+    The primary model gets ``max_retries`` retries with exponential backoff on
+    empty answers, server, network and rate-limit errors; the fallback model
+    then gets one attempt. With ``hedge`` primary attempts race HEDGE_MODEL,
+    otherwise with ``on_text`` they are streamed. Every attempt is reported to
+    ``on_event`` as a retry.AttemptEvent. ``cached_request(model)`` may return
+    the ``(contents, config)`` to send instead for a model whose instructions
+    are in a context cache. ``validate(text)`` may reject an answer by raising
+    EmptyResponseError, which is retried like an empty one. Returns
+    ``(model, response)``.
+    """
+
+    def request(model):
+        return (cached_request and cached_request(model)) or (contents, config)
+
+    def call(model):
+        if model == MODEL_NAME and hedge:
+            used_model, response = generate_hedged(client, request, estimated_tokens)
+        elif model == MODEL_NAME and on_text:
+            used_model = model
+            response = generate_streaming(
+                client, model, *request(model), on_text, estimated_tokens
+            )
+        else:
+            used_model = model
+            response = generate(client, model, *request(model), estimated_tokens)
+        if not response.text or not response.text.strip():
+            raise EmptyResponseError(describe_empty_response(used_model, response))
+        if validate:
+            validate(response.text)
+        return used_model, response
+
+    stages = [
+        (MODEL_NAME, RetryPolicy(max_attempts=max_retries + 1)),
+        (FALLBACK_MODEL, RetryPolicy(max_attempts=1)),
+    ]
+    return run_with_retries(call, stages, on_event)
+
+
+def analyze_media(
+    client,
+    uploaded_files,
+    work_order_info=None,
+    media_digests=None,
+    cache=None,
+    max_retries=MAX_RETRIES,
+    log=print,
+    hedge=False,
+    on_text=None,
+    context_cache=None,
+    structured=False,
+    report_store=None,
+    reuse_report=True,
+    work_order=None,
+    note=None,
+):
+    """Analyze uploaded media without any UI.
+
+    Returns a dict with the report ``text``, the ``model`` that produced it,
+    the per-attempt ``events`` (see run_analysis), the number of ``attempts``,
+    the ``latency`` and ``time_to_first_token`` in seconds and the token
+    ``usage`` (see token_usage); ``cached`` is True when the report came from
+    ``cache``, which only keeps answers of MODEL_NAME. Failed attempts are
+    passed to ``log`` as they happen and ``on_text`` streams the answer as in
+    run_analysis. With a context_cache.ContextCache the static instructions
+    are sent from its cache and only the media and work-order context go
+    with each request.
+
+    With ``structured`` the model fills in a report.InspectionReport instead
+    of writing free text: the result's ``report`` holds it as a dict and
+    ``text`` is rendered from it. Structured answers are not streamed.
+
+    Finished reports are recorded in ``report_store`` (a
+    report_store.ReportStore), whose ``report_id`` is returned, under the
+    number in ``work_order_info`` or else ``work_order``. With
+    ``reuse_report`` a report MODEL_NAME made for the same request (media,
+    prompts and work order) within report_store.REUSE_TTL is returned
+    instead of analyzing again (``cached`` is True then too).
+
+    ``note`` is appended to the user prompt, e.g. to say which part of a
+    recording the media covers (see segments.analyze_segments).
+
+    The analysis and each model attempt are recorded as tracing spans, with
+    the model, retries and token usage.
+    """
+    started = time.monotonic()
+    system_prompt, user_prompt = build_prompts(work_order_info)
+    if note:
+        user_prompt = f"{user_prompt}\n\n{note}"
+    contents = build_contents(uploaded_files, user_prompt)
+    config = build_config(system_prompt, structured)
+    tokens = estimate_tokens(
+        system_prompt, user_prompt, media_count=len(uploaded_files)
+    )
+
+    cache_key = result_key(
+        media_fingerprints(uploaded_files, media_digests),
+        MODEL_NAME,
+        prompt_hash(system_prompt, user_prompt, *(["json"] if structured else [])),
+        work_order_info,
+    )
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached:
+            report = parse_report(cached["text"]) if structured else None
+            record_span("analysis", time.monotonic() - started, "cached")
+            return {
+                "text": render_markdown(report) if structured else cached["text"],
+                "report": report and report.model_dump(),
+                "model": cached["model"],
+                "events": [],
+                "attempts": 0,
+                "latency": time.monotonic() - started,
+                "time_to_first_token": None,
+                "usage": None,
+                "cached": True,
+                "report_id": None,
+            }
+
+    media_hashes = media_fingerprints(uploaded_files, media_digests)
+    if work_order_info and work_order_info.get("success"):
+        work_order = work_order_info.get("work_order_number") or work_order
+    if report_store is not None and reuse_report:
+        stored = report_store.find_reusable(cache_key, MODEL_NAME, work_order)
+        if stored:
+            log(f"♻️ Reusing report #{stored['id']} made earlier from the same media")
+            record_span(
+                "analysis", time.monotonic() - started, "reused", report=stored["id"]
+            )
+            return {
+                "text": stored["text"],
+                "report": stored["structured"],
+                "model": stored["model"],
+                "events": [],
+                "attempts": 0,
+                "latency": time.monotonic() - started,
+                "time_to_first_token": None,
+                "usage": None,
+                "cached": True,
+                "report_id": stored["id"],
+            }
+
+    cached_request = None
+    if context_cache is not None:
+        cached_request = cached_request_for(
+            context_cache,
+            build_contents(
+                uploaded_files,
+                build_cached_prompt(work_order_info) + (f"\n\n{note}" if note else ""),
+            ),
+            structured,
+        )
+
+    events = []
+
+    def record(event):
+        events.append(event)
+        record_span(
+            "generate",
+            event.duration,
+            event.outcome,
+            model=event.model,
+            attempt=event.attempt + 1,
+        )
+        metrics.inc(
+            "model_attempts_total",
+            help="Model requests by outcome (ok or the error kind)",
+            model=event.model,
+            outcome=event.outcome,
+        )
+        if event.outcome != "ok":
+            log(
+                f"⚠️ {event.model} attempt {event.attempt + 1} failed "
+                f"({event.outcome}): {event.error}"
+            )
+
+    try:
+        model, response = run_analysis(
+            client,
+            contents,
+            config,
+            tokens,
+            max_retries=max_retries,
+            hedge=hedge,
+            on_text=None if structured else on_text,
+            on_event=record,
+            cached_request=cached_request,
+            validate=parse_report if structured else None,
+        )
+    except Exception:
+        record_span(
+            "analysis", time.monotonic() - started, "error", attempts=len(events)
+        )
+        raise
+    usage = token_usage(response)
+    for kind in ("prompt_tokens", "cached_tokens", "output_tokens"):
+        metrics.inc(
+            "tokens_total",
+            usage[kind],
+            help="Tokens per model: prompt (cached included), cached and output",
+            model=model,
+            kind=kind.replace("_tokens", ""),
+        )
+    if context_cache is not None:
+        context_cache.record(usage)
+    if cache is not None and model == MODEL_NAME:
+        # The key is looked up for the primary model; a fallback or hedge answer
+        # under it would be served instead of the primary's for the whole TTL
+        cache.put(cache_key, response.text, model)
+    report = parse_report(response.text) if structured else None
+    text = render_markdown(report) if structured else response.text
+    report = report and report.model_dump()
+    latency = time.monotonic() - started
+    report_id = None
+    if report_store is not None:
+        report_id = report_store.add(
+            text,
+            work_order_info,
+            model=model,
+            report=report,
+            latency=round(latency, 3),
+            media_hashes=media_hashes,
+            work_order=work_order,
+            reuse_key=cache_key,
+        )
+    first_token = getattr(response, "time_to_first_token", None)
+    record_span(
+        "analysis",
+        latency,
+        model=model,
+        attempts=len(events),
+        retries=len(events) - 1,
+        # HEDGE_MODEL may be FALLBACK_MODEL: only a primary that gave up means fallback
+        fallback=gave_up(events, MODEL_NAME) or None,
+        hedged=(hedge and model != MODEL_NAME and not gave_up(events, MODEL_NAME))
+        or None,
+        time_to_first_token=first_token and round(first_token, 3),
+        **usage,
+    )
+    return {
+        "text": text,
+        "report": report,
+        "model": model,
+        "events": events,
+        "attempts": len(events),
+        "latency": latency,
+        "time_to_first_token": first_token,
+        "usage": usage,
+        "cached": False,
+        "report_id": report_id,
+    }
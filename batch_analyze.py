@@ -0,0 +1,397 @@
+"""Headless batch analysis of work-order media downloaded by workorder.py.
+
+Files in the input directory are grouped by work order using the
+``<work order>_<index><ext>`` names workorder.py writes. Each work order is
+uploaded and analyzed on a bounded worker pool, its report is written to
+``<output>/<work order>.txt`` and one JSON line per work order is appended to
+``<output>/summary.jsonl``. Work orders already recorded as done in the
+summary are skipped, so an interrupted run can simply be started again.
+
+    python batch_analyze.py --input downloaded_files --output reports --workers 4
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+
+from google import genai
+
+from analysis import analyze_media, build_prompts, latency_tracker
+from context_cache import ContextCache
+from file_cache import RemoteFileIndex, file_digest, guess_mime_type
+from images import is_inline, item_digests, merge_uploaded, prepare_media
+from preprocess import (
+    PREPROCESS_MODES,
+    preprocess_media,
+    record_stats,
+    split_long_videos,
+    summarize,
+)
+from rate_limit import limiter
+from report_store import ReportStore
+from result_cache import ResultCache
+from segments import analyze_segments
+from tracing import (
+    METRICS_PORT,
+    Trace,
+    activate,
+    current_trace,
+    metrics,
+    start_metrics_server,
+)
+from uploads import upload_files
+from work_orders import fetch_work_order_info, work_order_client
+
+SUMMARY_FILE = "summary.jsonl"
+DONE_STATUSES = ("ok", "no_media")
+MEDIA_TYPES = ("video/", "image/")
+PARTIAL_SUFFIXES = (".part", ".validator", ".tmp")  # downloads still in progress
+
+
+def group_media_by_work_order(input_dir):
+    """Map each work order to its media files, in download order"""
+    groups = defaultdict(list)
+    for filename in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, filename)
+        stem, ext = os.path.splitext(filename)
+        if not os.path.isfile(path) or "_" not in stem or ext in PARTIAL_SUFFIXES:
+            continue
+        work_order, index = stem.rsplit("_", 1)
+        groups[work_order].append((int(index) if index.isdigit() else 0, path))
+    return {wo: [path for _, path in sorted(files)] for wo, files in groups.items()}
+
+
+def load_finished(summary_path):
+    """Return the work orders whose last summary record marks them as done"""
+    latest = {}
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                latest[record["work_order"]] = record["status"]
+    return {wo for wo, status in latest.items() if status in DONE_STATUSES}
+
+
+def write_report(output_dir, work_order, text, ext=".txt"):
+    """Write a report atomically so a crash never leaves a truncated file"""
+    path = os.path.join(output_dir, f"{work_order}{ext}")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return path
+
+
+class BatchRunner:
+    """Upload and analyze work orders concurrently, recording every outcome"""
+
+    def __init__(
+        self,
+        client,
+        output_dir,
+        workers=4,
+        upload_workers=4,
+        with_work_order_info=False,
+        keep_remote=False,
+        hedge=False,
+        preprocess="none",
+        context_cache=False,
+        structured=False,
+        reuse_reports=True,
+        segment_seconds=0,
+    ):
+        self.client = client
+        self.output_dir = output_dir
+        self.workers = workers
+        self.upload_workers = upload_workers
+        self.with_work_order_info = with_work_order_info
+        self.keep_remote = keep_remote
+        self.hedge = hedge
+        self.preprocess = preprocess
+        self.structured = structured
+        self.reuse_reports = reuse_reports
+        self.segment_seconds = segment_seconds  # 0 sends long videos whole
+        self.summary_path = os.path.join(output_dir, SUMMARY_FILE)
+        self.remote_index = RemoteFileIndex()
+        self.result_cache = ResultCache()
+        self.report_store = ReportStore()
+        self.work_order_infos = {}
+        # The static instructions, sent once per model instead of with every request
+        self.context_cache = (
+            ContextCache(client, *build_prompts()) if context_cache else None
+        )
+        self._lock = Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def run(self, groups):
+        """Process every work order in ``groups`` that is not finished yet"""
+        finished = load_finished(self.summary_path)
+        pending = [wo for wo in groups if wo not in finished]
+        print(f"📦 {len(groups)} work orders, {len(finished)} already done")
+        if self.with_work_order_info and pending:
+            # One bulk lookup over the pooled session instead of one per worker
+            self.work_order_infos = work_order_client.get_many(pending)
+            valid = sum(info["success"] for info in self.work_order_infos.values())
+            print(f"🔍 {valid}/{len(pending)} work orders found in the lookup API")
+
+        started = time.monotonic()
+        counts = defaultdict(int)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.process, wo, groups[wo]): wo for wo in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                counts[record["status"]] += 1
+                icon = "✅" if record["status"] in DONE_STATUSES else "❌"
+                print(
+                    f"{icon} {record['work_order']}: {record['status']} "
+                    f"({done}/{len(pending)}, {time.monotonic() - started:.0f}s, "
+                    f"{limiter.queue_depth()} queued for quota)"
+                )
+        if self.context_cache is not None:
+            self.context_cache.close()
+            totals = self.context_cache.totals()
+            print(
+                f"🧊 Context cache: {totals['cached_tokens']} of "
+                f"{totals['prompt_tokens']} prompt tokens cached, "
+                f"{totals['uncached_tokens']} sent in full "
+                f"({totals['cached_requests']}/{totals['requests']} requests)"
+            )
+        stages = metrics.stage_totals()
+        if stages:
+            print(
+                "⏱️ Time per stage: "
+                + ", ".join(
+                    f"{stage} {seconds:.1f}s ({count}x)"
+                    for stage, (count, seconds) in sorted(
+                        stages.items(), key=lambda item: -item[1][1]
+                    )
+                )
+            )
+        return dict(counts)
+
+    def process(self, work_order, file_paths):
+        """Analyze one work order; never raises, returns its summary record.
+
+        The record's ``timeline`` lists the time spent per stage (see tracing).
+        """
+        with activate(Trace()):
+            return self._process(work_order, file_paths)
+
+    def _process(self, work_order, file_paths):
+        started = time.monotonic()
+        record = {"work_order": work_order, "files": len(file_paths)}
+        media = [p for p in file_paths if guess_mime_type(p).startswith(MEDIA_TYPES)]
+        if not media:
+            record["status"] = "no_media"
+            return self._record(record, started)
+
+        handles = []
+        reused = set()  # indexes of files another run uploaded
+        preprocess_stats = []
+        try:
+            work_order_info = None
+            if self.with_work_order_info:
+                work_order_info = self.work_order_infos.get(work_order)
+                if not work_order_info or not (
+                    work_order_info["success"] or work_order_info.get("invalid")
+                ):
+                    # Missing or failed on a transient error: ask again
+                    work_order_info = fetch_work_order_info(work_order)
+            media, preprocess_stats = preprocess_media(media, self.preprocess)
+            if preprocess_stats:
+                record["preprocess"] = summarize(preprocess_stats)
+            windows = [None] * len(media)
+            if self.segment_seconds:
+                media, windows, errors = split_long_videos(media, self.segment_seconds)
+                for error in errors:
+                    print(
+                        f"   {work_order}: ⚠️ Could not split, sending it whole: {error}"
+                    )
+            items, upload_paths = prepare_media(media)
+            digests = item_digests(items, file_digest)
+
+            def on_progress(index, file_path, state):
+                if state == "REUSED":
+                    reused.add(index)
+
+            handles = upload_files(
+                self.client,
+                upload_paths,
+                max_workers=self.upload_workers,
+                on_progress=on_progress,
+                remote_index=self.remote_index,
+                digests=[d for item, d in zip(items, digests) if not is_inline(item)],
+            )
+            options = dict(
+                media_digests=digests,
+                cache=self.result_cache,
+                log=lambda message: print(f"   {work_order}: {message}"),
+                context_cache=self.context_cache,
+                structured=self.structured,
+                report_store=self.report_store,
+                reuse_report=self.reuse_reports,
+                work_order=work_order,
+            )
+            uploaded = merge_uploaded(items, handles)
+            if any(windows):
+                result = analyze_segments(
+                    self.client, uploaded, windows, work_order_info, **options
+                )
+                record["segments"] = result["segments"]
+            else:
+                result = analyze_media(
+                    self.client, uploaded, work_order_info, hedge=self.hedge, **options
+                )
+            record.update(
+                status="ok",
+                report=write_report(self.output_dir, work_order, result["text"]),
+                model=result["model"],
+                attempts=[
+                    [event.model, event.outcome, round(event.duration, 3)]
+                    for event in result["events"]
+                ],
+                cached=result["cached"],
+                usage=result["usage"],
+                report_id=result["report_id"],
+            )
+            if result["report"]:
+                record["structured"] = write_report(
+                    self.output_dir,
+                    work_order,
+                    json.dumps(result["report"], indent=2),
+                    ext=".json",
+                )
+
+        except Exception as e:
+            record.update(status="failed", error=str(e))
+        finally:
+            if not self.keep_remote:
+                # Reused files may be in use by other runs; they expire on their own
+                self._delete_remote(
+                    [h for index, h in enumerate(handles) if index not in reused]
+                )
+        record["timeline"] = current_trace().spans
+        record = self._record(record, started)
+        record_stats(
+            preprocess_stats,
+            work_order=work_order,
+            status=record["status"],
+            end_to_end_seconds=record["latency"],
+        )
+        return record
+
+    def _delete_remote(self, handles):
+        names = [handle.name for handle in handles if handle is not None]
+        # Forgotten first, so no other run picks them up while they are deleted
+        self.remote_index.evict_names(names)
+        for name in names:
+            try:
+                self.client.files.delete(name=name)
+            except Exception:
+                pass  # the file API expires uploads on its own
+
+    def _record(self, record, started):
+        record["latency"] = round(time.monotonic() - started, 3)
+        record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with self._lock:
+            with open(self.summary_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--input", default="downloaded_files")
+    parser.add_argument("--output", default="reports")
+    parser.add_argument("--workers", type=int, default=4, help="work orders at once")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, help="only the first N work orders")
+    parser.add_argument(
+        "--with-work-order-info",
+        action="store_true",
+        help="look up each work order and add its context to the prompt",
+    )
+    parser.add_argument(
+        "--keep-remote",
+        action="store_true",
+        help="keep uploaded files on Google AI for reuse instead of deleting them",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="race the hedge model when the primary is slower than usual",
+    )
+    parser.add_argument(
+        "--preprocess",
+        choices=list(PREPROCESS_MODES),
+        default="none",
+        help="shrink videos with ffmpeg before upload",
+    )
+    parser.add_argument(
+        "--context-cache",
+        action="store_true",
+        help="send the static instructions from a Gemini context cache",
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="ask for a typed JSON report, also written as <work order>.json",
+    )
+    parser.add_argument(
+        "--reanalyze",
+        action="store_true",
+        help="analyze media even when a stored report of the same media exists",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="serve Prometheus metrics on this port during the run (0: none)",
+    )
+    parser.add_argument(
+        "--segment-minutes",
+        type=float,
+        default=0,
+        help="analyze videos longer than this in parts of this length (0: whole)",
+    )
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    groups = group_media_by_work_order(args.input)
+    if args.limit:
+        groups = dict(list(groups.items())[: args.limit])
+
+    runner = BatchRunner(
+        genai.Client(api_key=os.environ["GOOGLE_API_KEY"]),
+        args.output,
+        workers=args.workers,
+        upload_workers=args.upload_workers,
+        with_work_order_info=args.with_work_order_info,
+        keep_remote=args.keep_remote,
+        hedge=args.hedge,
+        preprocess=args.preprocess,
+        context_cache=args.context_cache,
+        structured=args.structured,
+        reuse_reports=not args.reanalyze,
+        segment_seconds=round(args.segment_minutes * 60),
+    )
+    counts = runner.run(groups)
+    print(f"🏁 Done: {counts}")
+    if args.hedge:
+        print(f"🏎️ Race winners so far: {latency_tracker.wins()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Offline benchmarks against a local fake of the Gemini and work-order APIs (see bench.run)"""
@@ -0,0 +1,551 @@
+"""Local stand-in for the Gemini file and model APIs and the work-order APIs.
+
+Speaks enough of each protocol for the real clients to run against it:
+
+- the genai resumable upload (``POST /upload/v1beta/files``), file get,
+  list and delete, ``generateContent`` and ``streamGenerateContent`` (SSE)
+- ``confirm-work-order-number`` as used by work_orders.WorkOrderClient
+- ``GetFiles`` and the media downloads behind its ``FileUrl`` entries, with
+  Range and ETag support, as used by workorder.py
+
+Latency, error rates (429, 500, empty answers) and payload sizes are set on
+the FakeServer. Nothing is kept but hashes and sizes, so large uploads cost
+no memory.
+"""
+
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MEDIA_BLOCK = 64 * 1024  # bytes of generated media written at a time
+
+
+class FakeServer:
+    """HTTP server on localhost faking every API the app talks to.
+
+    ``latency`` seconds (varied by +/- ``jitter``) are added to every request
+    and ``generate_latency`` more to model requests. ``rate_429`` and
+    ``rate_500`` are the shares of API requests failing with those statuses,
+    ``empty_rate`` the share of model answers without text. Uploaded files
+    stay PROCESSING for ``processing_time`` seconds. Reports are
+    ``report_chars`` long; ``files_rate`` of the work orders have
+    ``files_per_work_order`` media files of ``media_bytes`` each, and
+    ``valid_rate`` of them pass the work-order check. ``bytes_per_second``
+    limits upload and download speed (None: unlimited). The same ``seed``
+    gives the same sequence of errors. ``scripted_errors`` maps a model name
+    or an endpoint ("upload", "get_file", ...) to the statuses its next
+    requests fail with, in order, before the rates apply, e.g.
+    ``{"gemini-2.5-pro": [500]}`` for one retried model attempt.
+    Streamed answers come in ``stream_chunks`` parts spread over
+    ``generate_latency``.
+    """
+
+    def __init__(
+        self,
+        latency=0.02,
+        jitter=0.5,
+        generate_latency=0.5,
+        rate_429=0.0,
+        rate_500=0.0,
+        empty_rate=0.0,
+        processing_time=1.0,
+        report_chars=4000,
+        media_bytes=1024 * 1024,
+        files_per_work_order=3,
+        files_rate=0.5,
+        valid_rate=0.9,
+        bytes_per_second=None,
+        retry_delay=1,
+        seed=0,
+        port=0,
+        scripted_errors=None,
+        stream_chunks=4,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.generate_latency = generate_latency
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.empty_rate = empty_rate
+        self.processing_time = processing_time
+        self.report_chars = report_chars
+        self.media_bytes = media_bytes
+        self.files_per_work_order = files_per_work_order
+        self.files_rate = files_rate
+        self.valid_rate = valid_rate
+        self.bytes_per_second = bytes_per_second
+        self.retry_delay = retry_delay
+        self.scripted_errors = {
+            key: list(statuses) for key, statuses in (scripted_errors or {}).items()
+        }
+        self.stream_chunks = stream_chunks
+        self.requests = Counter()  # (endpoint, status) -> count
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._uploads = {}  # upload id -> {"file": ..., "size": ..., "sha256": ...}
+        self._files = {}  # file id -> file resource, with "_ready_at"
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread; returns self"""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Helpers for the request handler
+
+    def count(self, endpoint, status):
+        with self._lock:
+            self.requests[endpoint, status] += 1
+
+    def delay(self, extra=0):
+        with self._lock:
+            factor = self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(max(0, self.latency * factor + extra))
+
+    def transfer_time(self, size):
+        return size / self.bytes_per_second if self.bytes_per_second else 0
+
+    def pick_error(self, key=None):
+        """Return 429, 500 or None for a request to ``key`` (model or endpoint)"""
+        with self._lock:
+            scripted = self.scripted_errors.get(key)
+            if scripted:
+                return scripted.pop(0)
+            roll = self._random.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_500:
+            return 500
+        return None
+
+    def roll(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+    def start_upload(self, metadata):
+        upload_id = str(next(self._ids))
+        with self._lock:
+            self._uploads[upload_id] = {
+                "file": metadata.get("file") or {},
+                "size": 0,
+                "sha256": hashlib.sha256(),
+            }
+        return upload_id
+
+    def upload_chunk(self, upload_id, chunk, finalize):
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None
+            upload["size"] += len(chunk)
+            upload["sha256"].update(chunk)
+            if not finalize:
+                return {}
+            del self._uploads[upload_id]
+            file_id = f"bench{next(self._ids)}"
+            now = time.time()
+            resource = {
+                "name": f"files/{file_id}",
+                "displayName": upload["file"].get("displayName", file_id),
+                "mimeType": upload["file"].get("mimeType")
+                or "application/octet-stream",
+                "sizeBytes": str(upload["size"]),
+                "sha256Hash": upload["sha256"].hexdigest(),
+                "uri": f"{self.url}/v1beta/files/{file_id}",
+                "createTime": _timestamp(now),
+                "updateTime": _timestamp(now),
+                "expirationTime": _timestamp(now + 48 * 60 * 60),
+                "_ready_at": now + self.processing_time,
+            }
+            self._files[file_id] = resource
+            return self.file_resource(file_id)
+
+    def file_resource(self, file_id):
+        resource = self._files.get(file_id)
+        if resource is None:
+            return None
+        resource = dict(resource)
+        ready = time.time() >= resource.pop("_ready_at")
+        resource["state"] = "ACTIVE" if ready else "PROCESSING"
+        return resource
+
+    def list_files(self):
+        with self._lock:
+            file_ids = list(self._files)
+        resources = (self.file_resource(file_id) for file_id in file_ids)
+        return [resource for resource in resources if resource]  # minus deleted
+
+    def delete_file(self, file_id):
+        with self._lock:
+            return self._files.pop(file_id, None) is not None
+
+    def work_order_files(self, work_order):
+        """The GetFiles entries of a work order, the same on every call"""
+        if not _chance(work_order, "files", self.files_rate):
+            return []
+        return [
+            {"FileUrl": f"{self.url}/media/{work_order}_{index}.mp4"}
+            for index in range(self.files_per_work_order)
+        ]
+
+
+def _chance(key, salt, rate):
+    """Deterministic yes/no for ``key``, true for about ``rate`` of all keys"""
+    digest = hashlib.sha256(f"{salt}:{key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 < rate
+
+
+def _timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def _media_block(name):
+    seed = hashlib.sha256(name.encode("utf-8")).digest()
+    return (seed * (MEDIA_BLOCK // len(seed) + 1))[:MEDIA_BLOCK]
+
+
+def _error_body(status, retry_delay):
+    if status == 429:
+        return {
+            "error": {
+                "code": 429,
+                "message": "Resource has been exhausted (e.g. check quota).",
+                "status": "RESOURCE_EXHAUSTED",
+                "details": [
+                    {
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": f"{retry_delay}s",
+                    }
+                ],
+            }
+        }
+    return {
+        "error": {
+            "code": status,
+            "message": "An internal error has occurred.",
+            "status": "INTERNAL",
+        }
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the pooled clients expect
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        routes = [
+            ("POST", r"/upload/v1beta/files", self._upload),
+            ("GET", r"/v1beta/files", self._list_files),
+            ("GET", r"/v1beta/files/([^/]+)", self._get_file),
+            ("DELETE", r"/v1beta/files/([^/]+)", self._delete_file),
+            ("POST", r"/v1beta/models/([^/:]+):generateContent", self._generate),
+            (
+                "POST",
+                r"/v1beta/models/([^/:]+):streamGenerateContent",
+                self._stream_generate,
+            ),
+            ("GET", r"/commserve/confirm-work-order-number", self._confirm),
+            ("POST", r"/api/WorkOrders/GetFiles/([^/]+)", self._get_files),
+            ("GET", r"/media/([^/]+)", self._media),
+        ]
+        for route_method, pattern, handler in routes:
+            match = re.fullmatch(pattern, url.path)
+            if match and route_method == method:
+                self.endpoint = handler.__name__.lstrip("_")
+                handler(fake, *match.groups())
+                return
+        self.endpoint = "unknown"
+        self._json(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+
+    def _json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.fake.count(self.endpoint, status)
+
+    def _fail(self, fake, model=None):
+        """Answer with an injected error; True when one was sent"""
+        status = fake.pick_error(model or self.endpoint)
+        if status:
+            self._json(status, _error_body(status, fake.retry_delay))
+        return bool(status)
+
+    def _upload(self, fake):
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if command == "start":
+            fake.delay()
+            if self._fail(fake):
+                return
+            upload_id = fake.start_upload(json.loads(self.body or b"{}"))
+            self._json(
+                200,
+                {},
+                {
+                    "X-Goog-Upload-URL": f"{fake.url}/upload/v1beta/files"
+                    f"?upload_id={upload_id}",
+                    "X-Goog-Upload-Status": "active",
+                },
+            )
+            return
+        fake.delay(fake.transfer_time(len(self.body)))
+        upload_id = self.query.get("upload_id", [""])[0]
+        resource = fake.upload_chunk(upload_id, self.body, "finalize" in command)
+        if resource is None:
+            self._json(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+        elif resource:
+            self._json(200, {"file": resource}, {"X-Goog-Upload-Status": "final"})
+        else:
+            self._json(200, {}, {"X-Goog-Upload-Status": "active"})
+
+    def _list_files(self, fake):
+        fake.delay()
+        self._json(200, {"files": fake.list_files()})
+
+    def _get_file(self, fake, file_id):
+        fake.delay()
+        if self._fail(fake):
+            return
+        resource = fake.file_resource(file_id)
+        if resource is None:
+            self._json(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+        else:
+            self._json(200, resource)
+
+    def _delete_file(self, fake, file_id):
+        fake.delay()
+        fake.delete_file(file_id)
+        self._json(200, {})
+
+    def _generate(self, fake, model):
+        fake.delay(fake.generate_latency)
+        answer = self._answer(fake, model)
+        if answer is not None:
+            self._json(200, answer)
+
+    def _stream_generate(self, fake, model):
+        fake.delay()
+        answer = self._answer(fake, model)
+        if answer is None:
+            return
+        # Like alt=sse: one "data:" event per chunk, usage on the last one
+        candidate = answer["candidates"][0]
+        text = candidate["content"]["parts"][0]["text"]
+        size = -(-len(text) // fake.stream_chunks) or 1
+        pieces = [text[i : i + size] for i in range(0, len(text), size)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, piece in enumerate(pieces):
+            time.sleep(fake.generate_latency / len(pieces))
+            part = dict(
+                candidate, content={"parts": [{"text": piece}], "role": "model"}
+            )
+            chunk = dict(answer, candidates=[part])
+            if index < len(pieces) - 1:
+                del part["finishReason"], chunk["usageMetadata"]
+            event = f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+        fake.count(self.endpoint, 200)
+
+    def _answer(self, fake, model):
+        """The generateContent answer, or None once an error was sent instead"""
+        if self._fail(fake, model):
+            return None
+        request = json.loads(self.body or b"{}")
+        # Like the real API, refuse files that are unknown or not ACTIVE yet
+        for uri in _file_uris(request.get("contents", [])):
+            resource = fake.file_resource(uri.rsplit("/", 1)[-1])
+            if resource is None or resource["state"] != "ACTIVE":
+                self._json(
+                    400,
+                    {
+                        "error": {
+                            "code": 400,
+                            "message": f"The File {uri} is not in an ACTIVE state",
+                            "status": "FAILED_PRECONDITION",
+                        }
+                    },
+                )
+                return None
+        empty = fake.roll(fake.empty_rate)
+        text = "" if empty else _report_text(model, fake.report_chars)
+        if "responseSchema" in json.dumps(request.get("generationConfig", {})):
+            text = "" if empty else _report_json(fake.report_chars)
+        prompt_tokens = len(self.body) // 4
+        output_tokens = len(text) // 4
+        return {
+            "candidates": [
+                {
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "SAFETY" if empty else "STOP",
+                    "index": 0,
+                }
+            ],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+            "modelVersion": model,
+        }
+
+    def _confirm(self, fake):
+        fake.delay()
+        if self._fail(fake):
+            return
+        number = self.query.get("query", [""])[0]
+        if not _chance(number, "valid", fake.valid_rate):
+            self._json(200, {"valid": False})
+            return
+        self._json(
+            200,
+            {
+                "valid": True,
+                "work_order_number": number,
+                "client_description": "Water stain on the ceiling below the bathroom",
+                "entity_name": "Bench Property Management",
+                "trades": ["Plumbing", "Drywall", "Painting"],
+            },
+        )
+
+    def _get_files(self, fake, work_order):
+        fake.delay()
+        if self._fail(fake):
+            return
+        self._json(200, {"data": fake.work_order_files(work_order)})
+
+    def _media(self, fake, name):
+        size = fake.media_bytes
+        etag = f'"{hashlib.sha256(f"{name}:{size}".encode("utf-8")).hexdigest()[:16]}"'
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+        if start >= size and start:
+            self.send_response(416)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            fake.count("media", 416)
+            return
+        fake.delay(fake.transfer_time(size - start))
+        status = 206 if start else 200
+        self.send_response(status)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("ETag", etag)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        block = _media_block(name)
+        position = start
+        while position < size:
+            offset = position % MEDIA_BLOCK
+            chunk = block[offset : offset + min(MEDIA_BLOCK - offset, size - position)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+        fake.count("media", status)
+
+
+REPORT_SECTIONS = (
+    "ISSUE TYPE",
+    "GENERAL DESCRIPTION",
+    "LOCATION",
+    "DETAILED ASSESSMENT",
+    "PHYSICAL CHARACTERISTICS",
+    "TECHNICAL IMPLICATIONS",
+    "RECOMMENDED TRADES",
+    "REPAIR REQUIREMENTS",
+)
+
+
+def _file_uris(contents):
+    """URIs of the files a generate request refers to"""
+    return [
+        data.get("fileUri") or data.get("file_uri")
+        for content in contents
+        for part in content.get("parts", [])
+        for data in [part.get("fileData") or part.get("file_data")]
+        if data
+    ]
+
+
+def _report_text(model, chars):
+    filler = f"Observed by {model}: water damage around the fixture. "
+    per_section = max(chars // len(REPORT_SECTIONS) - 30, len(filler))
+    sections = [
+        f"**{heading}:**\n\n{(filler * (per_section // len(filler) + 1))[:per_section]}"
+        for heading in REPORT_SECTIONS
+    ]
+    return "\n\n".join(sections)[:chars]
+
+
+def _report_json(chars):
+    sentence = "Water damage visible around the fixture. "
+    text = (sentence * (chars // 8 // len(sentence) + 1))[: max(chars // 8, 1)]
+    return json.dumps(
+        {
+            "work_order_validation": "",
+            "issue_type": "Water damage",
+            "general_description": text,
+            "location": "Bathroom ceiling",
+            "detailed_assessment": text,
+            "physical_characteristics": [text],
+            "technical_measurements": [],
+            "technical_implications": [text],
+            "recommended_trades": ["Plumbing", "Drywall"],
+            "repair_requirements": [text],
+            "documentation_notes": [text],
+        }
+    )
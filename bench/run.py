@@ -0,0 +1,307 @@
+"""Benchmark uploads, analyses, work-order lookups and the crawler offline.
+
+Runs the real code (uploads.upload_files, analysis.analyze_media,
+work_orders.WorkOrderClient and the workorder.py crawler) against the local
+bench.fake_server, so throughput can be measured and regressions caught
+without paid, rate-limited services:
+
+    python -m bench.run
+    python -m bench.run single_job multi_file --iterations 20 --concurrency 4
+    python -m bench.run crawl --rate-429 0.05 --rate-500 0.02 --output bench.jsonl
+
+Every scenario reports p50/p95 latency, throughput and peak memory, and the
+seconds spent per traced stage (see tracing).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from google import genai
+
+import workorder
+from analysis import analyze_media
+from bench.fake_server import FakeServer
+from crawl_checkpoint import CrawlCheckpoint
+from rate_limit import limiter
+from tracing import metrics
+from uploads import upload_files
+from work_orders import WorkOrderClient
+
+SCENARIOS = {
+    "single_job": "upload one video, look up its work order and analyze it",
+    "multi_file": "the same with --files videos per job",
+    "lookups": "--work-orders work-order checks through one pooled client",
+    "crawl": "crawl --work-orders work orders and download their media",
+}
+UNLIMITED = {"rpm": 1_000_000, "tpm": None}  # rate limits while benchmarking
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of ``values`` (share between 0 and 1)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+def measure(name, run_once, iterations, concurrency=1, units=1):
+    """Call ``run_once(i)`` ``iterations`` times, ``concurrency`` at a time.
+
+    ``units`` is the number of jobs, lookups or work orders one call handles,
+    for the throughput. Failed calls are counted and left out of the
+    latencies. Peak memory is what Python allocated during the scenario.
+    """
+    stages_before = metrics.stage_totals()
+    latencies = []
+    errors = []
+
+    def timed(index):
+        started = time.perf_counter()
+        try:
+            run_once(index)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stages = {}
+    for stage, (count, seconds) in metrics.stage_totals().items():
+        before_count, before_seconds = stages_before.get(stage, (0, 0.0))
+        if count > before_count:
+            stages[stage] = round(seconds - before_seconds, 3)
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0][:200] if errors else None,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "throughput": (iterations - len(errors)) * units / elapsed,
+        "elapsed": elapsed,
+        "peak_mb": peak / 1024 / 1024,
+        # ru_maxrss is in KiB on Linux; the peak of the whole process so far
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": stages,
+    }
+
+
+def write_media(directory, count, size):
+    """Create ``count`` video files of ``size`` random bytes; returns their paths"""
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"bench_{index}.mp4")
+        with open(path, "wb") as f:
+            for start in range(0, size, 1024 * 1024):
+                f.write(os.urandom(min(1024 * 1024, size - start)))
+        paths.append(path)
+    return paths
+
+
+def run_job(client, lookups, file_paths, work_order, stream=False):
+    """Upload, look up and analyze one job like the app does, then clean up"""
+    handles = upload_files(client, file_paths)
+    try:
+        info = lookups.get(work_order)
+        analyze_media(
+            client,
+            handles,
+            info if info["success"] else None,
+            log=lambda m: None,
+            on_text=(lambda text: None) if stream else None,
+        )
+    finally:
+        for handle in handles:
+            client.files.delete(name=handle.name)
+
+
+def crawl(server_url, work_orders, save_dir):
+    """Run the workorder.py crawler over ``work_orders`` into ``save_dir``"""
+    workorder.API_TEMPLATE = f"{server_url}/api/WorkOrders/GetFiles/{{}}"
+    workorder.SAVE_DIR = save_dir
+    os.makedirs(save_dir, exist_ok=True)
+    checkpoint = CrawlCheckpoint(os.path.join(save_dir, "checkpoint.sqlite3"))
+
+    async def run():
+        connections = workorder.MAX_METADATA_REQUESTS + workorder.MAX_DOWNLOADS
+        limits = httpx.Limits(
+            max_connections=connections, max_keepalive_connections=connections
+        )
+        async with httpx.AsyncClient(limits=limits) as client:
+            crawler = workorder.Crawler(
+                client, checkpoint, max_with_files=len(work_orders)
+            )
+            await crawler.run(work_orders)
+
+    with contextlib.redirect_stdout(io.StringIO()):  # one line per work order
+        asyncio.run(run())
+
+
+def run_scenario(name, server, args, work_dir):
+    client = genai.Client(api_key="bench", http_options={"base_url": server.url})
+    lookups = WorkOrderClient(url=f"{server.url}/commserve/confirm-work-order-number")
+    size = int(args.media_mb * 1024 * 1024)
+    if name == "single_job":
+        paths = write_media(work_dir, 1, size)
+        return measure(
+            name,
+            lambda i: run_job(client, lookups, paths, f"BENCH-{i}", args.stream),
+            args.iterations,
+            args.concurrency,
+        )
+    if name == "multi_file":
+        paths = write_media(work_dir, args.files, size)
+        return measure(
+            name,
+            lambda i: run_job(client, lookups, paths, f"BENCH-{i}", args.stream),
+            args.iterations,
+            args.concurrency,
+        )
+    if name == "lookups":
+        return measure(
+            name,
+            lambda i: WorkOrderClient(url=lookups.url).get_many(
+                f"LOOKUP-{i}-{n}" for n in range(args.work_orders)
+            ),
+            args.iterations,
+            args.concurrency,
+            units=args.work_orders,
+        )
+    if name == "crawl":
+        # The crawler is concurrent on its own and keeps its settings in globals
+        return measure(
+            name,
+            lambda i: crawl(
+                server.url,
+                [f"CRAWL-{i}-{n}" for n in range(args.work_orders)],
+                os.path.join(work_dir, f"crawl_{i}"),
+            ),
+            args.iterations,
+            units=args.work_orders,
+        )
+    raise ValueError(f"Unknown scenario {name!r}")
+
+
+def print_result(result):
+    def ms(seconds):
+        return f"{seconds * 1000:8.0f} ms" if seconds is not None else "       -   "
+
+    print(
+        f"{result['scenario']:<11} {result['iterations']:>4} runs "
+        f"{result['errors']:>3} errors  p50 {ms(result['p50'])}  "
+        f"p95 {ms(result['p95'])}  {result['throughput']:8.2f}/s  "
+        f"peak {result['peak_mb']:6.1f} MB  rss {result['max_rss_mb']:6.1f} MB"
+    )
+    if result["stages"]:
+        stages = sorted(result["stages"].items(), key=lambda item: -item[1])
+        print(
+            "    " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages)
+        )
+    if result["first_error"]:
+        print(f"    ❌ {result['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n")[0],
+        epilog="Scenarios: "
+        + "; ".join(f"{name}: {text}" for name, text in SCENARIOS.items()),
+    )
+    parser.add_argument("scenarios", nargs="*", help="all of them by default")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1, help="jobs at once")
+    parser.add_argument(
+        "--files", type=int, default=4, help="videos per multi_file job"
+    )
+    parser.add_argument("--media-mb", type=float, default=1, help="size of each video")
+    parser.add_argument("--work-orders", type=int, default=50)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds per request"
+    )
+    parser.add_argument("--generate-latency", type=float, default=0.5)
+    parser.add_argument("--processing-time", type=float, default=1.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--report-chars", type=int, default=4000)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the answers like the app does by default",
+    )
+    parser.add_argument("--mbps", type=float, help="upload/download speed limit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--rate-limits",
+        action="store_true",
+        help="keep the configured API rate limits instead of lifting them",
+    )
+    parser.add_argument("--output", help="append the results to this JSONL file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    if not args.rate_limits:
+        for key in list(limiter.limits):
+            limiter.limits[key] = UNLIMITED
+    server = FakeServer(
+        latency=args.latency,
+        generate_latency=args.generate_latency,
+        rate_429=args.rate_429,
+        rate_500=args.rate_500,
+        empty_rate=args.empty_rate,
+        processing_time=args.processing_time,
+        report_chars=args.report_chars,
+        media_bytes=int(args.media_mb * 1024 * 1024),
+        bytes_per_second=args.mbps and args.mbps * 1024 * 1024 / 8,
+        seed=args.seed,
+    )
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    results = []
+    try:
+        with server:
+            print(f"🧪 Fake APIs at {server.url}")
+            for name in args.scenarios or SCENARIOS:
+                server.requests.clear()
+                result = run_scenario(name, server, args, work_dir)
+                result["requests"] = {
+                    f"{endpoint} {status}": count
+                    for (endpoint, status), count in sorted(server.requests.items())
+                }
+                print_result(result)
+                results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "a") as f:
+            for result in results:
+                record = dict(result, settings=settings)
+                record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+from google.genai import errors
+
+from analysis import MODEL_NAME
+
+
+def test_stream_generate_content_streams_in_chunks(fake_server, genai_client):
+    fake_server.stream_chunks = 3
+    chunks = list(
+        genai_client.models.generate_content_stream(model=MODEL_NAME, contents="hi")
+    )
+
+    assert len(chunks) == 3
+    assert "".join(chunk.text for chunk in chunks).startswith("**ISSUE TYPE:**")
+    assert chunks[-1].usage_metadata.total_token_count > 0
+    assert fake_server.requests["stream_generate", 200] == 1
+
+
+def test_scripted_errors_fail_the_next_requests_in_order(fake_server, genai_client):
+    fake_server.scripted_errors = {MODEL_NAME: [500, 429]}
+
+    with pytest.raises(errors.ServerError):
+        genai_client.models.generate_content(model=MODEL_NAME, contents="hi")
+    with pytest.raises(errors.ClientError) as raised:
+        list(
+            genai_client.models.generate_content_stream(model=MODEL_NAME, contents="hi")
+        )
+    assert raised.value.code == 429
+    assert genai_client.models.generate_content(model=MODEL_NAME, contents="hi").text
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "walk.mp4"
+    path.write_bytes(b"video" * 100)
+    return str(path)
+
+
+def test_generating_against_a_processing_file_fails(fake_server, genai_client, video):
+    fake_server.processing_time = 5
+    handle = genai_client.files.upload(file=video)
+
+    with pytest.raises(errors.ClientError, match="not in an ACTIVE state"):
+        genai_client.models.generate_content(model=MODEL_NAME, contents=[handle])
+
+
+def test_generating_against_a_deleted_file_fails(fake_server, genai_client, video):
+    handle = genai_client.files.upload(file=video)
+    time.sleep(fake_server.processing_time)
+    assert genai_client.models.generate_content(model=MODEL_NAME, contents=[handle])
+
+    genai_client.files.delete(name=handle.name)
+
+    with pytest.raises(errors.ClientError, match="not in an ACTIVE state"):
+        genai_client.models.generate_content(model=MODEL_NAME, contents=[handle])
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+
+# Before any module under test is imported: keep their caches, queues and
+# report stores out of the real .cache
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="video_analytics_tests_")
+
+import pytest  # noqa: E402
+
+import retry  # noqa: E402
+from bench.fake_server import FakeServer  # noqa: E402
+
+
+@pytest.fixture
+def fake_server():
+    """A fast bench.fake_server.FakeServer; tests adjust its settings"""
+    server = FakeServer(latency=0, generate_latency=0.05, processing_time=0.05)
+    with server:
+        yield server
+
+
+@pytest.fixture
+def genai_client(fake_server):
+    from google import genai
+
+    return genai.Client(api_key="test", http_options={"base_url": fake_server.url})
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    """Retry at once instead of backing off for seconds"""
+    monkeypatch.setattr(retry.RetryPolicy, "delay", lambda self, attempt, kind: 0)
+
+
+FAKE_FFMPEG = r'''#!{python}
+"""Writes small stand-ins for what ffmpeg would write; fails with FAKE_FFMPEG_FAIL"""
+import os
+import sys
+
+args = sys.argv[1:]
+output = args[-1]
+if "-segment_list" in args:
+    segment_list = args[args.index("-segment_list") + 1]
+    count = int(os.getenv("FAKE_FFMPEG_SEGMENTS", "3"))
+    with open(segment_list, "w") as f:
+        for index in range(count):
+            path = output.replace("%03d", f"{{index:03d}}")
+            with open(path, "wb") as segment:
+                segment.write(b"segment %d" % index)
+            f.write(f"{{os.path.basename(path)}},{{index * 300.0}},{{(index + 1) * 300.0}}\n")
+else:
+    for index in range(1, 4 if "%03d" in output else 2):
+        with open(output.replace("%03d", f"{{index:03d}}"), "wb") as f:
+            f.write(b"frame" * 10)
+sys.exit(1 if os.getenv("FAKE_FFMPEG_FAIL") else 0)
+'''
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Put an ffmpeg on PATH that writes tiny outputs instead of transcoding"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "ffmpeg"
+    script.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return script
@@ -0,0 +1,126 @@
+import hashlib
+import threading
+import time
+
+from google.genai import types
+
+CACHE_TTL = 60 * 60  # seconds a cached instruction block lives unless refreshed
+REFRESH_MARGIN = 5 * 60  # extend the TTL when less than this is left
+RETRY_AFTER = 10 * 60  # seconds before trying again after a failed create
+DISPLAY_NAME_PREFIX = "video-analytics-instructions"
+
+
+class ContextCache:
+    """Explicit Gemini context caches holding the static instruction block.
+
+    The system prompt and the work-order independent user instructions are
+    uploaded once per model with ``client.caches`` and referenced by name, so
+    each request only carries its media and work-order context. Caches are
+    refreshed before they expire, reused across runs when the instructions
+    did not change (matched on a hash in the display name) and deleted by
+    close(). A model whose cache cannot be created (e.g. the block is under
+    its minimum cacheable size) gets the full prompt for a while instead.
+    Safe to share between threads.
+    """
+
+    def __init__(self, client, system_prompt, instructions, ttl=CACHE_TTL):
+        self.client = client
+        self.system_prompt = system_prompt
+        self.instructions = instructions
+        self.ttl = ttl
+        digest = hashlib.sha256(
+            f"{system_prompt}\0{instructions}".encode("utf-8")
+        ).hexdigest()
+        self.display_name = f"{DISPLAY_NAME_PREFIX}-{digest[:16]}"
+        self._caches = {}  # model -> (name, expires_at)
+        self._failed = {}  # model -> monotonic time of the last failed create
+        self._totals = {
+            "requests": 0,
+            "cached_requests": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+        }
+        self._lock = threading.Lock()
+
+    def name(self, model):
+        """Return the cache name to use for ``model``, or None to send the full prompt"""
+        with self._lock:
+            if time.monotonic() - self._failed.get(model, -RETRY_AFTER) < RETRY_AFTER:
+                return None
+            entry = self._caches.get(model)
+            try:
+                if entry is None:
+                    entry = self._find(model) or self._create(model)
+                elif entry[1] - time.time() < REFRESH_MARGIN:
+                    entry = self._refresh(model, entry[0])
+            except Exception as e:
+                print(f"⚠️ Sending full prompts to {model}, context cache failed: {e}")
+                self._caches.pop(model, None)
+                self._failed[model] = time.monotonic()
+                return None
+            self._caches[model] = entry
+            return entry[0]
+
+    def record(self, usage):
+        """Add one request's token counts (see analysis.token_usage) to the totals"""
+        with self._lock:
+            self._totals["requests"] += 1
+            self._totals["cached_requests"] += bool(usage["cached_tokens"])
+            self._totals["prompt_tokens"] += usage["prompt_tokens"]
+            self._totals["cached_tokens"] += usage["cached_tokens"]
+
+    def totals(self):
+        """Requests and prompt tokens so far, with the uncached remainder"""
+        with self._lock:
+            totals = dict(self._totals)
+        totals["uncached_tokens"] = totals["prompt_tokens"] - totals["cached_tokens"]
+        return totals
+
+    def close(self):
+        """Delete the caches created or reused by this instance"""
+        with self._lock:
+            caches, self._caches = self._caches, {}
+        for model, (name, _) in caches.items():
+            try:
+                self.client.caches.delete(name=name)
+            except Exception as e:
+                print(f"⚠️ Could not delete context cache {name}: {e}")
+
+    def _find(self, model):
+        # A previous run with the same instructions may have left one behind
+        for cached in self.client.caches.list():
+            if cached.display_name == self.display_name and cached.model.endswith(
+                f"/{model}"
+            ):
+                return self._refresh(model, cached.name)
+        return None
+
+    def _create(self, model):
+        cached = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=self.display_name,
+                system_instruction=self.system_prompt,
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=[types.Part.from_text(text=self.instructions)],
+                    )
+                ],
+                ttl=f"{self.ttl}s",
+            ),
+        )
+        tokens = cached.usage_metadata and cached.usage_metadata.total_token_count
+        print(f"🧊 Cached {tokens or '?'} instruction tokens for {model}")
+        return cached.name, _expires_at(cached, self.ttl)
+
+    def _refresh(self, model, name):
+        cached = self.client.caches.update(
+            name=name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+        )
+        return name, _expires_at(cached, self.ttl)
+
+
+def _expires_at(cached, ttl):
+    expire_time = getattr(cached, "expire_time", None)
+    return expire_time.timestamp() if expire_time else time.time() + ttl
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from file_cache import CACHE_DIR
+
+CHECKPOINT_PATH = os.path.join(CACHE_DIR, "workorder_crawl.sqlite3")
+DONE_STATUSES = ("no_files", "saved")  # "failed" work orders are retried
+
+
+class CrawlCheckpoint:
+    """SQLite record of crawled work orders and the files saved for them"""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS workorders (
+                    work_order TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    file_count INTEGER NOT NULL,
+                    reason TEXT,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    work_order TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (work_order, idx)
+                )"""
+            )
+
+    def finished(self):
+        """Return the work orders that need no further requests"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT work_order FROM workorders WHERE status IN (?, ?)",
+                DONE_STATUSES,
+            )
+            return {row[0] for row in rows}
+
+    def counts(self):
+        """Number of work orders per status"""
+        with self._connect() as db:
+            return dict(
+                db.execute("SELECT status, COUNT(*) FROM workorders GROUP BY status")
+            )
+
+    def record_workorder(self, work_order, status, file_count=0, reason=None):
+        """Set a work order's status: "no_files", "saved" or "failed" with a reason"""
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO workorders VALUES (?, ?, ?, ?, ?)",
+                (work_order, status, file_count, reason, time.time()),
+            )
+
+    def record_file(self, work_order, index, filename, size, sha256):
+        """Remember a file that was written to disk completely"""
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (work_order, index, filename, size, sha256, time.time()),
+            )
+
+    def saved_file(self, work_order, index, save_dir):
+        """Return {"filename", "size", "sha256"} if the file is still on disk intact"""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT filename, size, sha256 FROM files WHERE work_order = ? AND idx = ?",
+                (work_order, index),
+            ).fetchone()
+        if not row:
+            return None
+        try:
+            if os.path.getsize(os.path.join(save_dir, row[0])) != row[1]:
+                return None
+        except OSError:
+            return None
+        return {"filename": row[0], "size": row[1], "sha256": row[2]}
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
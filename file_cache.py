@@ -0,0 +1,116 @@
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+INDEX_PATH = os.path.join(CACHE_DIR, "remote_files.json")
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+EXPIRY_MARGIN = 15 * 60  # don't hand out a remote file that expires within 15 min
+
+
+def file_digest(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file, read in bounded chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def guess_mime_type(file_path):
+    """Guess the MIME type the file API will assign to a local file"""
+    return mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+
+
+def content_key(file_path, digest=None):
+    """Build the index key for a local file: content hash, size and MIME type"""
+    digest = digest or file_digest(file_path)
+    return f"{digest}:{os.path.getsize(file_path)}:{guess_mime_type(file_path)}"
+
+
+class RemoteFileIndex:
+    """Persistent map from local file content to an uploaded Google AI file.
+
+    Entries are dropped once the remote file expires, when the file API no
+    longer reports it as ACTIVE, or when the remote file is deleted.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def lookup(self, client, key):
+        """Return a still-ACTIVE remote file for ``key``, or None"""
+        with self._lock:
+            entry = self._load().get(key)
+        if not entry:
+            return None
+        if (
+            entry.get("expires_at")
+            and entry["expires_at"] - EXPIRY_MARGIN < time.time()
+        ):
+            self.evict(key)
+            return None
+
+        try:
+            remote = client.files.get(name=entry["name"])
+        except Exception:
+            self.evict(key)
+            return None
+        if getattr(remote.state, "value", remote.state) != "ACTIVE":
+            self.evict(key)
+            return None
+        return remote
+
+    def store(self, key, remote):
+        """Remember an ACTIVE remote file for ``key``"""
+        expires_at = None
+        if remote.expiration_time:
+            expires_at = remote.expiration_time.timestamp()
+        with self._lock:
+            now = time.time()
+            entries = {
+                k: v
+                for k, v in self._load().items()
+                if not v.get("expires_at") or v["expires_at"] > now
+            }
+            entries[key] = {
+                "name": remote.name,
+                "uri": remote.uri,
+                "mime_type": remote.mime_type,
+                "expires_at": expires_at,
+            }
+            self._save(entries)
+
+    def evict(self, key):
+        """Forget a single entry"""
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def evict_names(self, names):
+        """Forget every entry pointing at one of the given remote file names"""
+        names = set(names)
+        with self._lock:
+            entries = self._load()
+            kept = {k: v for k, v in entries.items() if v["name"] not in names}
+            if len(kept) != len(entries):
+                self._save(kept)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from file_cache import CACHE_DIR
+
+LATENCY_LOG_PATH = os.path.join(CACHE_DIR, "model_latency.json")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+DEFAULT_HEDGE_DEADLINE = 60  # seconds, used until enough latencies are recorded
+MIN_SAMPLES = 10
+MAX_SAMPLES = 500  # most recent latencies kept per model
+
+
+class LatencyTracker:
+    """Persistent record of how long each model took and which one won a race"""
+
+    def __init__(self, path=LATENCY_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def record(self, model, seconds, hedged=False):
+        """Record a winning answer from ``model`` after ``seconds``"""
+        with self._lock:
+            self._add_latency(model, seconds)
+            wins = self._data["wins"].setdefault(model, {"hedged": 0, "unhedged": 0})
+            wins["hedged" if hedged else "unhedged"] += 1
+            self._save()
+
+    def record_latency(self, model, seconds):
+        """Record how long ``model`` took for an answer that lost the race"""
+        with self._lock:
+            self._add_latency(model, seconds)
+            self._save()
+
+    def deadline(self, model, percentile=HEDGE_PERCENTILE):
+        """Latency percentile of ``model``, i.e. how long to wait before hedging"""
+        with self._lock:
+            latencies = sorted(self._data["latencies"].get(model, []))
+        if len(latencies) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DEADLINE
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def wins(self):
+        """Per model: how many races it won with and without a hedge in flight"""
+        with self._lock:
+            return json.loads(json.dumps(self._data["wins"]))
+
+    def _add_latency(self, model, seconds):
+        latencies = self._data["latencies"].setdefault(model, [])
+        latencies.append(round(seconds, 3))
+        del latencies[:-MAX_SAMPLES]
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault("latencies", {})
+        data.setdefault("wins", {})
+        return data
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+
+
+def hedged_call(primary, hedge, deadline, is_valid, tracker=None):
+    """Run ``primary`` and race ``hedge`` against it once it gets slow.
+
+    ``primary`` and ``hedge`` are ``(label, fn)`` pairs. The hedge starts when
+    the primary has not produced a valid result within ``deadline`` seconds, or
+    right away when the primary fails early. The first valid result wins and
+    the other call is abandoned: it is cancelled if it has not started and its
+    result is discarded otherwise. A call already in flight cannot be
+    interrupted, so it runs to the end and still spends its quota. Returns
+    ``(label, result)``; when neither call gives a valid result the last
+    invalid one is returned, and when both raise the first error is re-raised.
+
+    ``tracker`` records the winner's latency, and the loser's too once it
+    finishes with a valid result: dropping the slow primaries that lost to a
+    hedge would pull the deadline down and make hedges fire more and more.
+    """
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=2)
+    futures = {executor.submit(primary[1]): (primary[0], started)}
+    hedged = False
+    errors = []
+    fallback_result = None
+    try:
+        while futures or not hedged:
+            if not futures or time.monotonic() - started >= deadline and not hedged:
+                futures[executor.submit(hedge[1])] = (hedge[0], time.monotonic())
+                hedged = True
+
+            timeout = None
+            if not hedged:
+                timeout = max(0, deadline - (time.monotonic() - started))
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                label, submitted = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if is_valid(result):
+                    if tracker is not None:
+                        tracker.record(label, time.monotonic() - submitted, hedged)
+                        for loser, (loser_label, loser_submitted) in futures.items():
+                            loser.add_done_callback(
+                                _record_loser(
+                                    tracker, loser_label, loser_submitted, is_valid
+                                )
+                            )
+                    return label, result
+                fallback_result = (label, result)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if fallback_result is not None:
+        return fallback_result
+    raise errors[0]
+
+
+def _record_loser(tracker, label, submitted, is_valid):
+    """Done callback recording the latency of the call that lost a race"""
+
+    def record(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        if is_valid(future.result()):
+            tracker.record_latency(label, time.monotonic() - submitted)
+
+    return record
@@ -0,0 +1,90 @@
+import hashlib
+import io
+import os
+
+from google.genai import types
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from file_cache import CACHE_DIR, guess_mime_type
+
+IMAGE_DIR = os.path.join(CACHE_DIR, "images")
+MAX_IMAGE_SIDE = 1536  # larger photos are tiled down by the model anyway
+JPEG_QUALITY = 85
+INLINE_IMAGE_LIMIT = 1024 * 1024  # compacted images up to this size go inline
+INLINE_BUDGET = 14 * 1024 * 1024  # total inline bytes, under the 20MB request cap
+
+
+def compact_image(path, max_side=MAX_IMAGE_SIDE, quality=JPEG_QUALITY):
+    """Return ``path`` as JPEG bytes: upright, without EXIF, at most ``max_side`` px"""
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        if image.mode != "RGB":
+            # Flatten transparency onto white instead of letting it turn black
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        buffer = io.BytesIO()
+        # Saving without exif= drops the metadata, including GPS coordinates
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def prepare_media(file_paths, work_dir=IMAGE_DIR, inline_limit=INLINE_IMAGE_LIMIT):
+    """Compact every image and decide what is sent inline and what is uploaded.
+
+    Returns ``(items, upload_paths)``. ``items`` follows ``file_paths`` and
+    holds an inline ``types.Part`` for small images and the path to upload for
+    everything else; ``upload_paths`` lists those paths in order. Large images
+    are uploaded in their compacted form from ``work_dir``. Images Pillow
+    cannot read are uploaded untouched.
+    """
+    items = []
+    inline_bytes = 0
+    for path in file_paths:
+        if not guess_mime_type(path).startswith("image/"):
+            items.append(path)
+            continue
+        try:
+            data = compact_image(path)
+        except (OSError, UnidentifiedImageError, ValueError):
+            items.append(path)
+            continue
+
+        if len(data) <= inline_limit and inline_bytes + len(data) <= INLINE_BUDGET:
+            inline_bytes += len(data)
+            items.append(types.Part.from_bytes(data=data, mime_type="image/jpeg"))
+            continue
+
+        os.makedirs(work_dir, exist_ok=True)
+        # Named by content too: photo.png and photo.jpeg must not overwrite each other
+        stem = os.path.splitext(os.path.basename(path))[0]
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        compacted = os.path.join(work_dir, f"{stem}-{digest}.jpg")
+        with open(compacted, "wb") as f:
+            f.write(data)
+        items.append(compacted)
+    return items, [item for item in items if isinstance(item, str)]
+
+
+def merge_uploaded(items, handles):
+    """Put uploaded file handles back in place of their paths in ``items``"""
+    handles = iter(handles)
+    return [item if is_inline(item) else next(handles) for item in items]
+
+
+def is_inline(item):
+    """True for media sent as bytes inside the request rather than uploaded"""
+    return isinstance(item, types.Part)
+
+
+def item_digests(items, path_digest):
+    """SHA-256 hex digests for ``items``, using ``path_digest(path)`` for paths"""
+    return [
+        (
+            hashlib.sha256(item.inline_data.data).hexdigest()
+            if is_inline(item)
+            else path_digest(item)
+        )
+        for item in items
+    ]
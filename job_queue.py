@@ -0,0 +1,302 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from file_cache import CACHE_DIR
+
+JOB_QUEUE_PATH = os.path.join(CACHE_DIR, "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # jobs one process runs at once
+POLL_INTERVAL = 0.5  # seconds an idle worker waits before looking for work again
+HEARTBEAT_INTERVAL = 10  # seconds between heartbeats of running jobs
+STALE_AFTER = 60  # running jobs without a heartbeat this long lost their worker
+JOB_TTL = 7 * 24 * 60 * 60  # finished jobs are purged after this long
+
+FINAL_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobQueue:
+    """SQLite-backed queue of jobs that outlive reruns, page refreshes and restarts.
+
+    A job is a JSON ``spec`` describing the work and a JSON ``state`` its
+    worker fills in as it goes. Its status moves from "queued" to "running"
+    when a worker claims it and ends as "done", "failed" or "cancelled". A
+    worker may also park a job as "waiting" until the submitter calls
+    resume(). Running jobs are kept alive by heartbeats; jobs whose worker
+    died are queued again by requeue_stale(). Any number of threads and
+    processes may share one database file.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    spec TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    error TEXT,
+                    worker TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    resume_requested INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    heartbeat_at REAL
+                )"""
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+            )
+
+    def submit(self, spec, state=None):
+        """Queue a new job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, spec, state, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(spec), json.dumps(state or {}), now, now),
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict with decoded ``spec`` and ``state``, or None"""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _decode(row) if row else None
+
+    def claim(self, worker):
+        """Mark the oldest queued job as running for ``worker`` and return it"""
+        now = time.time()
+        with self._connect() as db:
+            # One statement, so two workers can never claim the same job
+            row = db.execute(
+                """UPDATE jobs
+                SET status = 'running', worker = ?, resume_requested = 0,
+                    updated_at = ?, heartbeat_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status = 'queued'
+                    ORDER BY created_at LIMIT 1
+                )
+                RETURNING *""",
+                (worker, now, now),
+            ).fetchone()
+        return _decode(row) if row else None
+
+    def update(self, job_id, **state):
+        """Merge ``state`` into the job's state; also counts as a heartbeat"""
+        self._merge(job_id, "state", state)
+
+    def update_spec(self, job_id, **spec):
+        """Merge ``spec`` into the job's spec, e.g. options changed after submit"""
+        self._merge(job_id, "spec", spec)
+
+    def heartbeat(self, job_ids):
+        """Tell the queue the workers of ``job_ids`` are still alive"""
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                [(now, job_id) for job_id in job_ids],
+            )
+
+    def finish(self, job_id, status, error=None):
+        """End a job as "done", "failed" or "cancelled" """
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def park(self, job_id):
+        """Leave a running job "waiting" for resume(), or requeue it if that came first"""
+        with self._connect() as db:
+            db.execute(
+                """UPDATE jobs
+                SET status = CASE
+                        WHEN cancel_requested THEN 'cancelled'
+                        WHEN resume_requested THEN 'queued'
+                        ELSE 'waiting' END,
+                    resume_requested = 0, updated_at = ?
+                WHERE id = ? AND status = 'running'""",
+                (time.time(), job_id),
+            )
+
+    def resume(self, job_id, **spec):
+        """Queue a waiting or failed job again, merging ``spec`` into its spec"""
+        if spec:
+            self.update_spec(job_id, **spec)
+        with self._connect() as db:
+            db.execute(
+                """UPDATE jobs
+                SET status = CASE WHEN status = 'running' THEN status ELSE 'queued' END,
+                    resume_requested = (status = 'running'),
+                    error = NULL, updated_at = ?
+                WHERE id = ? AND status IN ('waiting', 'failed', 'running')""",
+                (time.time(), job_id),
+            )
+
+    def cancel(self, job_id):
+        """Cancel a job; a running one stops at its worker's next check"""
+        with self._connect() as db:
+            db.execute(
+                """UPDATE jobs
+                SET status = CASE WHEN status = 'running' THEN status
+                        ELSE 'cancelled' END,
+                    cancel_requested = 1, updated_at = ?
+                WHERE id = ? AND status NOT IN ('done', 'failed', 'cancelled')""",
+                (time.time(), job_id),
+            )
+
+    def cancel_requested(self, job_id):
+        """True once cancel() was called for the job"""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def requeue_stale(self, max_age=STALE_AFTER):
+        """Queue running jobs again whose worker stopped sending heartbeats"""
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                """UPDATE jobs
+                SET status = CASE WHEN cancel_requested THEN 'cancelled'
+                        ELSE 'queued' END,
+                    worker = NULL, updated_at = ?
+                WHERE status = 'running' AND heartbeat_at < ?""",
+                (now, now - max_age),
+            )
+            return cursor.rowcount
+
+    def counts(self):
+        """Number of jobs per status"""
+        with self._connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def purge(self, max_age=JOB_TTL):
+        """Delete finished jobs not updated for ``max_age`` seconds"""
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+                (*FINAL_STATUSES, time.time() - max_age),
+            )
+
+    def _merge(self, job_id, column, changes):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT {column} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row[0])
+            merged.update(changes)
+            db.execute(
+                f"UPDATE jobs SET {column} = ?, updated_at = ?, "
+                "heartbeat_at = CASE WHEN status = 'running' THEN ? "
+                "ELSE heartbeat_at END WHERE id = ?",
+                (json.dumps(merged), now, now, job_id),
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+def _decode(row):
+    job = dict(row)
+    job["spec"] = json.loads(job["spec"])
+    job["state"] = json.loads(job["state"])
+    return job
+
+
+class WorkerPool:
+    """Threads that claim jobs from a JobQueue and pass them to ``handler(job)``.
+
+    ``concurrency`` jobs run at once in this process; more processes may
+    work on the same queue. ``handler`` receives the claimed job dict and is
+    expected to finish() or park() it; if it raises, the job is marked
+    failed. A monitor thread sends heartbeats for the jobs in progress and
+    requeues jobs left running by workers that went away.
+    """
+
+    def __init__(
+        self, queue, handler, concurrency=JOB_WORKERS, poll_interval=POLL_INTERVAL
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self._active = set()  # ids of the jobs being worked on
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker and monitor threads"""
+        self.queue.purge()
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._work, args=(index,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.concurrency:
+            thread = threading.Thread(target=self._monitor, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def join(self):
+        """Block until the pool is stopped"""
+        for thread in self._threads:
+            thread.join()
+
+    def stop(self, timeout=None):
+        """Stop claiming jobs and wait for the ones in progress to end"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self, index):
+        worker = f"{self.name}-{index}"
+        while not self._stopping.is_set():
+            job = self.queue.claim(worker)
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+            with self._lock:
+                self._active.add(job["id"])
+            try:
+                self.handler(job)
+            except Exception as e:
+                self.queue.finish(job["id"], "failed", str(e))
+            finally:
+                with self._lock:
+                    self._active.discard(job["id"])
+
+    def _monitor(self):
+        while not self._stopping.wait(HEARTBEAT_INTERVAL):
+            with self._lock:
+                active = list(self._active)
+            try:
+                self.queue.heartbeat(active)
+                requeued = self.queue.requeue_stale()
+                if requeued:
+                    print(f"♻️ Requeued {requeued} job(s) abandoned by their worker")
+            except sqlite3.Error as e:
+                print(f"⚠️ Job queue maintenance failed: {e}")
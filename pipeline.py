@@ -0,0 +1,445 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from analysis import HEDGE_MODEL, MODEL_NAME, analyze_media
+from file_cache import file_digest
+from images import is_inline, item_digests, merge_uploaded, prepare_media
+from polling import PollScheduler
+from preprocess import preprocess_media, record_stats, split_long_videos, summarize
+from retry import AttemptEvent, classify_error, gave_up
+from segments import analyze_segments, describe_window
+from tracing import Trace, activate, current_trace, record_span
+from uploads import upload_files
+from work_orders import fetch_work_order_info
+
+PREPARING_STAGES = ("queued", "preprocessing", "splitting", "uploading")
+FINISHED_STAGES = ("ready", "done", "failed", "cancelled")
+STREAM_SAVE_INTERVAL = 0.5  # seconds between saves of the streamed report
+MAX_PREPARED_JOBS = 32  # prepared media kept in memory for a later analysis
+
+
+def job_key(uploaded_files, preprocess_mode="none", segment_seconds=0):
+    """Identify the media of a job; a new key means the work has to start over"""
+    ids = [getattr(f, "file_id", None) or f.name for f in uploaded_files]
+    return "|".join(
+        ids + [preprocess_mode] + ([f"{segment_seconds}s"] if segment_seconds else [])
+    )
+
+
+def submit_job(
+    queue,
+    spill_dir,
+    file_paths,
+    key,
+    work_order_number=None,
+    preprocess_mode="none",
+    auto_analyze=False,
+    trace=None,
+    segment_seconds=0,
+):
+    """Queue the preparation (and maybe analysis) of spilled media; returns the id.
+
+    ``trace`` is the tracing.Trace the media was spilled under, continued by
+    the worker as the job's timeline. With ``segment_seconds`` long videos are
+    split into windows of that length and analyzed part by part (see
+    segments.analyze_segments).
+    """
+    trace = trace or Trace()
+    return queue.submit(
+        {
+            "key": key,
+            "file_paths": list(file_paths),
+            "digests": [spill_dir.digest(path) for path in file_paths],
+            "work_dir": spill_dir.path,
+            "work_order_number": (work_order_number or "").strip(),
+            "preprocess_mode": preprocess_mode,
+            "segment_seconds": segment_seconds,
+            "analyze": auto_analyze,
+            "hedge": False,
+            "stream": True,
+            "structured": False,
+            "reuse_report": True,
+        },
+        {"stage": "queued", "timeline": trace.spans, "trace_started": trace.started},
+    )
+
+
+def stored_event(event):
+    """An AttemptEvent as saved in the job state: JSON, with the error's message"""
+    return list(event._replace(error=event.error and str(event.error)))
+
+
+def result_notices(result):
+    """How an analysis result came about, as ``[(level, message)]`` for the UI.
+
+    Tells a cached answer, merged segment reports, a fallback answer after
+    the primary model gave up and a hedge that answered first apart.
+    """
+    events = result["events"]
+    if result["cached"]:
+        return [("info", f"⚡ Loaded cached analysis ({result['model']})")]
+
+    segments = result.get("segments")
+    if segments:
+        failed = [segment for segment in segments if segment["error"]]
+        fallback = [s for s in segments if s["model"] not in (None, MODEL_NAME)]
+        notices = [
+            (
+                "info",
+                f"✂️ Merged the reports on {len(segments) - len(failed)} of "
+                f"{len(segments)} parts",
+            )
+        ]
+        if fallback:
+            notices.append(
+                ("info", f"✅ {len(fallback)} part(s) analyzed by the fallback model")
+            )
+        if result["model"] == "segments":
+            notices.append(
+                ("warning", "⚠️ Could not merge the part reports, listed per part")
+            )
+        return notices + [
+            (
+                "warning",
+                f"⚠️ {describe_window(segment['window'])} was not analyzed: "
+                f"{segment['error']}",
+            )
+            for segment in failed
+        ]
+
+    if gave_up(events, MODEL_NAME):
+        return [
+            ("info", f"✅ Analysis completed using fallback model ({result['model']})")
+        ]
+    if result["model"] == HEDGE_MODEL != MODEL_NAME:
+        # Without a give-up the fallback stage never ran: the race was won
+        return [("info", f"🏁 The hedged request to {HEDGE_MODEL} answered first")]
+    return []
+
+
+class PipelineJob:
+    """Snapshot of a queued pipeline job, as read by the UI.
+
+    Progress is read from the job queue row (``stage``, ``file_states``,
+    ``messages``, ``partial_text``, ``result``, ``error``); load() again for
+    fresh values. Requests from the UI go back through the queue, so the
+    job survives reruns, page refreshes and restarts of the app.
+    """
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.id = job["id"]
+        self.status = job["status"]
+        spec, state = job["spec"], job["state"]
+        self.key = spec["key"]
+        self.file_paths = spec["file_paths"]
+        self.work_dir = spec["work_dir"]
+        self.work_order_number = spec["work_order_number"]
+        self.analysis_requested = spec["analyze"]
+        self.stage = "cancelled" if self.status == "cancelled" else state["stage"]
+        self.file_states = state.get("file_states", {})  # file name -> upload state
+        self.media_count = state.get("media_count", 0)  # after keyframes and splits
+        self.poll_counts = state.get("poll_counts", {})
+        self.preprocess_summary = state.get("preprocess_summary")
+        self.prepared = state.get("prepared", False)
+        self.uploaded_names = state.get("uploaded_names", [])
+        self.windows = state.get("windows", [])  # per uploaded file, see segments
+        self.timings = state.get("timings", {})  # stage -> seconds
+        self.timeline = state.get("timeline", [])  # spans, see tracing.Trace
+        self.messages = state.get("messages", [])
+        self.partial_text = state.get("partial_text", "")
+        self.error = state.get("error") or job["error"]
+        self.error_kind = state.get("error_kind")
+        self.failed_stage = state.get("failed_stage")
+        self.result = state.get("result")
+        if self.result is not None:
+            self.result = dict(
+                self.result,
+                events=[AttemptEvent(*event) for event in self.result["events"]],
+            )
+
+    @classmethod
+    def load(cls, queue, job_id):
+        """Read a job from ``queue``; None if it does not exist (any more)"""
+        job = queue.get(job_id) if job_id else None
+        return cls(queue, job) if job else None
+
+    def request_analysis(
+        self,
+        hedge=False,
+        stream=True,
+        work_order_number=None,
+        structured=False,
+        reuse_report=True,
+    ):
+        """Analyze as soon as the media is ready, or again after a failed analysis"""
+        spec = {
+            "analyze": True,
+            "hedge": hedge,
+            "stream": stream,
+            "structured": structured,
+            "reuse_report": reuse_report,
+        }
+        if work_order_number is not None:
+            spec["work_order_number"] = work_order_number.strip()
+        if self.stage in ("ready", "failed"):
+            self.queue.update(
+                self.id, stage="queued", error=None, error_kind=None, failed_stage=None
+            )
+        # Also flags a job still being prepared, so it is not parked as "ready"
+        self.queue.resume(self.id, **spec)
+
+    def set_work_order(self, work_order_number):
+        """Use another work order for an analysis that has not started yet"""
+        if work_order_number != self.work_order_number:
+            self.queue.update_spec(self.id, work_order_number=work_order_number)
+
+    def cancel(self):
+        """Stop after the current stage; an upload in progress still completes"""
+        self.queue.cancel(self.id)
+
+    def remote_files(self):
+        """Names of the files this job uploaded, for deleting them from the file API.
+
+        Files reused from the remote file index are left out: other sessions
+        may be using them, so they are left to expire.
+        """
+        return list(self.uploaded_names)
+
+
+class JobCancelled(Exception):
+    """The submitter cancelled the job"""
+
+
+class PipelineRunner:
+    """Queue handler that prepares a job's media and then analyzes it.
+
+    Preprocessing, upload and readiness polling run first. A job that was
+    not asked to analyze yet is parked as "waiting" with stage "ready"; when
+    the UI resumes it, the media prepared here is reused, or prepared again
+    (mostly answered by ``remote_index``) if the job was picked up by another
+    process or after a restart. Every stage is traced into the job's
+    ``timeline`` (see tracing.Trace).
+    """
+
+    def __init__(
+        self, client, queue, remote_index=None, result_cache=None, report_store=None
+    ):
+        self.client = client
+        self.queue = queue
+        self.remote_index = remote_index
+        self.result_cache = result_cache
+        self.report_store = report_store
+        self._prepared = OrderedDict()  # job id -> (media, digests, windows)
+        self._lock = threading.Lock()
+
+    def __call__(self, job):
+        state = job["state"]
+        trace = Trace(state.get("timeline"), state.get("trace_started"))
+        with activate(trace):
+            if not any(span["stage"] == "queue_wait" for span in trace.spans):
+                # Time from submission until a worker first picked the job up
+                record_span("queue_wait", time.time() - job["created_at"])
+            self._run(job)
+
+    def _run(self, job):
+        job_id, spec = job["id"], job["spec"]
+        state = job["state"]
+        with self._lock:
+            prepared = self._prepared.get(job_id)
+        try:
+            if prepared is None:
+                prepared = self._prepare(job_id, spec, state)
+                with self._lock:
+                    self._prepared[job_id] = prepared
+                    while len(self._prepared) > MAX_PREPARED_JOBS:
+                        self._prepared.popitem(last=False)
+
+            # Analysis may have been asked for while the media was prepared
+            spec = self.queue.get(job_id)["spec"]
+            if not spec["analyze"]:
+                self.queue.update(job_id, stage="ready", timeline=current_trace().spans)
+                self.queue.park(job_id)
+                return
+            self._analyze(job_id, spec, *prepared)
+            self.queue.finish(job_id, "done")
+        except Exception as e:
+            if self.queue.cancel_requested(job_id):
+                self.queue.update(
+                    job_id, stage="cancelled", timeline=current_trace().spans
+                )
+                self.queue.finish(job_id, "cancelled")
+            else:
+                self.queue.update(
+                    job_id,
+                    stage="failed",
+                    failed_stage=self.queue.get(job_id)["state"]["stage"],
+                    error=str(e),
+                    error_kind=classify_error(e),
+                    timeline=current_trace().spans,
+                )
+                self.queue.finish(job_id, "failed", str(e))
+        if self.queue.get(job_id)["status"] in ("done", "cancelled"):
+            with self._lock:
+                self._prepared.pop(job_id, None)
+
+    def _prepare(self, job_id, spec, state):
+        timings = state.get("timings", {})
+        paths = spec["file_paths"]
+        known = dict(zip(paths, spec["digests"]))
+        self._check_cancelled(job_id)
+
+        stats = []
+        preprocess_mode = spec["preprocess_mode"]
+        if preprocess_mode != "none":
+            self.queue.update(job_id, stage="preprocessing")
+            started = time.monotonic()
+            paths, stats = preprocess_media(
+                paths, preprocess_mode, os.path.join(spec["work_dir"], "preprocessed")
+            )
+            timings["preprocess"] = time.monotonic() - started
+            for entry in stats:
+                if "error" in entry:
+                    self._log(
+                        job_id,
+                        f"⚠️ Could not preprocess {entry['file']}, uploading the "
+                        f"original: {entry['error']}",
+                    )
+            self.queue.update(
+                job_id,
+                preprocess_summary=summarize(stats) if stats else None,
+                timings=timings,
+            )
+            self._check_cancelled(job_id)
+
+        windows = [None] * len(paths)
+        if spec.get("segment_seconds"):
+            self.queue.update(job_id, stage="splitting")
+            started = time.monotonic()
+            paths, windows, errors = split_long_videos(
+                paths,
+                spec["segment_seconds"],
+                os.path.join(spec["work_dir"], "segments"),
+            )
+            timings["split"] = time.monotonic() - started
+            for error in errors:
+                self._log(job_id, f"⚠️ Could not split, sending it whole: {error}")
+            self.queue.update(job_id, windows=windows, timings=timings)
+            self._check_cancelled(job_id)
+
+        items, upload_paths = prepare_media(
+            paths, os.path.join(spec["work_dir"], "images")
+        )
+        digests = item_digests(items, lambda path: known.get(path) or file_digest(path))
+        file_states = {
+            os.path.basename(path): "INLINE"
+            for item, path in zip(items, paths)
+            if is_inline(item)
+        }
+        self.queue.update(
+            job_id, stage="uploading", file_states=file_states, media_count=len(items)
+        )
+
+        reused = set()
+
+        def on_progress(index, file_path, upload_state):
+            if upload_state == "REUSED":
+                reused.add(index)
+            file_states[os.path.basename(file_path)] = upload_state
+            self.queue.update(job_id, file_states=file_states)
+
+        scheduler = PollScheduler()
+        started = time.monotonic()
+        handles = upload_files(
+            self.client,
+            upload_paths,
+            on_progress=on_progress,
+            scheduler=scheduler,
+            remote_index=self.remote_index,
+            digests=[d for item, d in zip(items, digests) if not is_inline(item)],
+        )
+        timings["upload"] = time.monotonic() - started
+        if stats:
+            record_stats(
+                stats,
+                end_to_end_seconds=round(timings["preprocess"] + timings["upload"], 3),
+            )
+        self.queue.update(
+            job_id,
+            prepared=True,
+            uploaded_names=[
+                handle.name
+                for index, handle in enumerate(handles)
+                if index not in reused
+            ],
+            # Readiness checks each file needed, kept for tuning the poll scheduler
+            poll_counts={
+                os.path.basename(upload_paths[index]): polls
+                for index, polls in scheduler.poll_counts.items()
+            },
+            timings=timings,
+            timeline=current_trace().spans,
+        )
+        return merge_uploaded(items, handles), digests, windows
+
+    def _analyze(self, job_id, spec, media, media_digests, windows):
+        self._check_cancelled(job_id)
+        self.queue.update(job_id, stage="analyzing", partial_text="")
+        timings = self.queue.get(job_id)["state"].get("timings", {})
+        work_order_info = None
+        if spec["work_order_number"]:
+            # Usually answered from the lookup the UI started in the meantime
+            started = time.monotonic()
+            info = fetch_work_order_info(spec["work_order_number"])
+            timings["lookup"] = time.monotonic() - started
+            if info.get("success"):
+                work_order_info = info
+
+        last_saved = [0.0]
+
+        def on_text(text):
+            # Saved at most every STREAM_SAVE_INTERVAL, the whole text is kept anyway
+            if time.monotonic() - last_saved[0] >= STREAM_SAVE_INTERVAL:
+                last_saved[0] = time.monotonic()
+                self.queue.update(job_id, partial_text=text)
+
+        started = time.monotonic()
+        options = dict(
+            media_digests=media_digests,
+            cache=self.result_cache,
+            log=lambda message: self._log(job_id, message),
+            on_text=on_text if spec["stream"] and not spec["hedge"] else None,
+            structured=spec.get("structured", False),
+            report_store=self.report_store,
+            reuse_report=spec.get("reuse_report", True),
+            work_order=spec["work_order_number"],
+        )
+        if any(windows):
+            # Hedging would double every segment request; parts already run in parallel
+            result = analyze_segments(
+                self.client, media, windows, work_order_info, **options
+            )
+        else:
+            result = analyze_media(
+                self.client, media, work_order_info, hedge=spec["hedge"], **options
+            )
+        timings["analysis"] = time.monotonic() - started
+        self.queue.update(
+            job_id,
+            stage="done",
+            result=dict(
+                result, events=[stored_event(event) for event in result["events"]]
+            ),
+            timings=timings,
+            timeline=current_trace().spans,
+        )
+
+    def _log(self, job_id, message):
+        messages = self.queue.get(job_id)["state"].get("messages", [])
+        self.queue.update(job_id, messages=messages + [message])
+
+    def _check_cancelled(self, job_id):
+        if self.queue.cancel_requested(job_id):
+            raise JobCancelled("cancelled")
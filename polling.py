@@ -0,0 +1,103 @@
+import random
+import time
+
+MIN_INTERVAL = 0.5  # seconds before the first check of any file
+MAX_INTERVAL = 15  # upper bound for the gap between two checks of one file
+BACKOFF = 1.6  # growth factor of the gap after every unfinished check
+JITTER = 0.2  # +/- fraction applied to every gap so files don't poll in lockstep
+COALESCE_WINDOW = 0.5  # checks due this close together are sent as one batch
+DEFAULT_DEADLINE = 900  # give up on a file that is still processing after this long
+
+# Rough server-side processing cost per media type: (fixed seconds, bytes per second)
+PROCESSING_PROFILES = {
+    "image": (0.3, 50 * 1024 * 1024),
+    "video": (2.0, 4 * 1024 * 1024),
+    "audio": (1.0, 8 * 1024 * 1024),
+}
+DEFAULT_PROFILE = (1.0, 8 * 1024 * 1024)
+
+
+def estimate_processing_time(size_bytes=None, mime_type=None):
+    """Guess how long the file API needs before a file becomes ACTIVE"""
+    kind = (mime_type or "").split("/")[0]
+    fixed, rate = PROCESSING_PROFILES.get(kind, DEFAULT_PROFILE)
+    return fixed + (size_bytes or 0) / rate
+
+
+class PollScheduler:
+    """Decide when each pending file should be checked again.
+
+    The first check comes after ``min_interval`` and later checks back off
+    exponentially with jitter. The gap never grows beyond the predicted
+    processing time (nor ``max_interval``), so a file that is faster than
+    predicted is seen soon and a slow one is not checked in a tight loop. A
+    file that is still not ready after ``deadline`` seconds raises
+    ``TimeoutError``. ``poll_counts``
+    keeps the number of checks each file needed so the constants above can be
+    tuned from real runs.
+    """
+
+    def __init__(
+        self,
+        deadline=DEFAULT_DEADLINE,
+        min_interval=MIN_INTERVAL,
+        max_interval=MAX_INTERVAL,
+        backoff=BACKOFF,
+        jitter=JITTER,
+    ):
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.poll_counts = {}
+        self._pending = {}
+
+    def add(self, key, size_bytes=None, mime_type=None, label=None):
+        """Start tracking a file that is still processing"""
+        now = time.monotonic()
+        expected = estimate_processing_time(size_bytes, mime_type)
+        self._pending[key] = {
+            "interval": self.min_interval,
+            "max_interval": min(max(expected, self.min_interval), self.max_interval),
+            "next": now + self._jittered(self.min_interval),
+            "deadline": now + self.deadline,
+            "label": label or key,
+        }
+        self.poll_counts[key] = 0
+
+    def record(self, key, ready):
+        """Record the outcome of a check and schedule the next one if needed"""
+        entry = self._pending[key]
+        self.poll_counts[key] += 1
+        if ready:
+            del self._pending[key]
+            return
+
+        now = time.monotonic()
+        if now >= entry["deadline"]:
+            del self._pending[key]
+            raise TimeoutError(
+                f"{entry['label']} still processing after {self.deadline}s "
+                f"({self.poll_counts[key]} checks)"
+            )
+        entry["interval"] = min(entry["interval"] * self.backoff, entry["max_interval"])
+        entry["next"] = min(now + self._jittered(entry["interval"]), entry["deadline"])
+
+    def due(self):
+        """Return the keys that should be checked now, batched together"""
+        horizon = time.monotonic() + COALESCE_WINDOW
+        return [key for key, entry in self._pending.items() if entry["next"] <= horizon]
+
+    def wait_time(self):
+        """Seconds until the next check is due, or None when nothing is pending"""
+        if not self._pending:
+            return None
+        next_check = min(entry["next"] for entry in self._pending.values())
+        return max(0, next_check - time.monotonic())
+
+    def __bool__(self):
+        return bool(self._pending)
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,266 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from file_cache import CACHE_DIR, guess_mime_type
+from tracing import record_span
+
+PREPROCESS_DIR = os.path.join(CACHE_DIR, "preprocessed")
+STATS_PATH = os.path.join(CACHE_DIR, "preprocess_stats.jsonl")
+TARGET_HEIGHT = 720  # the model samples frames well below 4K detail
+TARGET_BITRATE = "1500k"
+SCENE_THRESHOLD = 0.3  # ffmpeg scene score that counts as a new shot
+MAX_KEYFRAMES = 32
+FFMPEG_TIMEOUT = 30 * 60
+SEGMENT_DIR = os.path.join(CACHE_DIR, "segments")
+SEGMENT_SECONDS = 5 * 60  # window length of the long-video mode
+
+PREPROCESS_MODES = {
+    "none": "Send videos as recorded",
+    "downscale": f"Transcode to {TARGET_HEIGHT}p at {TARGET_BITRATE}",
+    "trim_idle": "Downscale and drop frames where nothing changes (removes audio)",
+    "keyframes": f"Replace each video with up to {MAX_KEYFRAMES} scene-change frames",
+}
+
+
+def ffmpeg_available():
+    """True when the ffmpeg binary needed for preprocessing is installed"""
+    return shutil.which("ffmpeg") is not None
+
+
+def output_dir(source, out_dir):
+    """The directory under ``out_dir`` holding what was made from ``source``.
+
+    One per source file, named after it and a digest of its path, so
+    kitchen.mp4, kitchen.mov and kitchen_2.mp4 never share outputs.
+    """
+    digest = hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()
+    return os.path.join(out_dir, f"{os.path.basename(source)}-{digest[:12]}")
+
+
+def _scale_filter(height):
+    return f"scale=-2:'min({height},ih)'"
+
+
+def _downscale(source, out_dir, height, idle=False):
+    filters = [_scale_filter(height)]
+    audio = ["-c:a", "aac", "-b:a", "64k"]
+    if idle:
+        # Drop near-duplicate frames and close the gaps they leave behind
+        filters = ["mpdecimate", "setpts=N/FRAME_RATE/TB"] + filters
+        audio = ["-an"]
+    stem = os.path.splitext(os.path.basename(source))[0]
+    output = os.path.join(out_dir, f"{stem}.mp4")
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-i", source, "-vf", ",".join(filters)]
+        + ["-c:v", "libx264", "-preset", "veryfast", "-b:v", TARGET_BITRATE]
+        + audio
+        + ["-movflags", "+faststart", output],
+        check=True,
+        capture_output=True,
+        timeout=FFMPEG_TIMEOUT,
+    )
+    return [output]
+
+
+def _keyframes(source, out_dir, height):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    select = f"select='eq(n\\,0)+gt(scene\\,{SCENE_THRESHOLD})'"
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-i", source]
+        + ["-vf", f"{select},{_scale_filter(height)}", "-vsync", "vfr"]
+        + ["-frames:v", str(MAX_KEYFRAMES), "-q:v", "3"]
+        + [os.path.join(out_dir, f"{stem}_%03d.jpg")],
+        check=True,
+        capture_output=True,
+        timeout=FFMPEG_TIMEOUT,
+    )
+    return sorted(glob.glob(os.path.join(out_dir, f"{stem}_*.jpg")))
+
+
+def preprocess_video(source, mode, out_dir, height=TARGET_HEIGHT):
+    """Turn one video into smaller media files according to ``mode``.
+
+    Outputs are written to the source's own directory under ``out_dir`` (see
+    output_dir) and reused when they are newer than the source; a failed run
+    removes whatever it wrote. Returns the output paths.
+    """
+    out_dir = output_dir(source, out_dir)
+    existing = sorted(glob.glob(os.path.join(out_dir, "*")))
+    if existing and min(os.path.getmtime(p) for p in existing) >= os.path.getmtime(
+        source
+    ):
+        return existing
+
+    # Start empty so outputs of an older version of the source are not picked up
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    try:
+        if mode == "keyframes":
+            return _keyframes(source, out_dir, height)
+        return _downscale(source, out_dir, height, idle=mode == "trim_idle")
+    except Exception:
+        # Never leave a half-written output behind to be reused next time
+        shutil.rmtree(out_dir, ignore_errors=True)
+        raise
+
+
+def split_video(source, out_dir, segment_seconds=SEGMENT_SECONDS):
+    """Cut a video into windows of about ``segment_seconds``, without re-encoding.
+
+    Cuts fall on keyframes, so the windows are a little uneven; their real
+    bounds are read from ffmpeg's segment list. Segments are written to the
+    source's own directory under ``out_dir`` (see output_dir) and reused when
+    they are newer than the source. Returns ``[(path, start, end)]`` in seconds.
+    """
+    out_dir = output_dir(source, out_dir)
+    stem, ext = os.path.splitext(os.path.basename(source))
+    segment_list = os.path.join(out_dir, "segments.csv")
+    fresh = os.path.exists(segment_list) and os.path.getmtime(
+        segment_list
+    ) >= os.path.getmtime(source)
+    if not fresh:
+        # Start empty so segments of a longer version of the video are not kept
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        try:
+            subprocess.run(
+                ["ffmpeg", "-y", "-v", "error", "-i", source]
+                + ["-map", "0:v:0", "-map", "0:a?", "-c", "copy", "-f", "segment"]
+                + ["-segment_time", str(segment_seconds), "-reset_timestamps", "1"]
+                + ["-segment_list", segment_list, "-segment_list_type", "csv"]
+                + [os.path.join(out_dir, f"{stem}_%03d{ext}")],
+                check=True,
+                capture_output=True,
+                timeout=FFMPEG_TIMEOUT,
+            )
+        except Exception:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+
+    segments = []
+    with open(segment_list) as f:
+        for line in f:
+            name, start, end = line.strip().rsplit(",", 2)
+            path = os.path.join(out_dir, os.path.basename(name))
+            segments.append((path, float(start), float(end)))
+    return segments
+
+
+def split_long_videos(
+    file_paths, segment_seconds=SEGMENT_SECONDS, work_dir=SEGMENT_DIR
+):
+    """Replace every video longer than one window by its segments.
+
+    Returns ``(paths, windows, errors)``. ``windows`` has one entry per path:
+    None for media sent whole, else a dict with the ``source`` file name,
+    the ``start`` and ``end`` second of the segment, its ``part`` number and
+    the number of ``parts``. A video ffmpeg cannot split is sent whole and
+    its error is listed in ``errors``.
+    """
+    if not ffmpeg_available():
+        return list(file_paths), [None] * len(file_paths), []
+
+    paths, windows, errors = [], [], []
+    out_dir = os.path.join(work_dir, f"{segment_seconds}s")
+    for source in file_paths:
+        segments = []
+        if guess_mime_type(source).startswith("video/"):
+            try:
+                segments = split_video(source, out_dir, segment_seconds)
+            except (OSError, ValueError, subprocess.SubprocessError) as e:
+                detail = str(getattr(e, "stderr", None) or e)[-500:]
+                errors.append(f"{os.path.basename(source)}: {detail}")
+        if len(segments) < 2:
+            paths.append(source)
+            windows.append(None)
+            continue
+        for part, (path, start, end) in enumerate(segments, 1):
+            paths.append(path)
+            windows.append(
+                {
+                    "source": os.path.basename(source),
+                    "start": start,
+                    "end": end,
+                    "part": part,
+                    "parts": len(segments),
+                }
+            )
+    return paths, windows, errors
+
+
+def preprocess_media(file_paths, mode, work_dir=PREPROCESS_DIR):
+    """Preprocess every video in ``file_paths``; images pass through untouched.
+
+    Returns ``(paths, stats)`` where ``paths`` replaces ``file_paths`` for the
+    upload step and ``stats`` has one entry per video with the bytes before
+    and after and the seconds spent. A video that ffmpeg cannot handle is kept
+    as is and its error is recorded in its entry. Callers pass ``stats`` to
+    record_stats() once the end-to-end time is known.
+    """
+    if mode == "none" or not ffmpeg_available():
+        return list(file_paths), []
+
+    paths = []
+    stats = []
+    for source in file_paths:
+        if not guess_mime_type(source).startswith("video/"):
+            paths.append(source)
+            continue
+
+        started = time.monotonic()
+        entry = {"file": os.path.basename(source), "mode": mode}
+        try:
+            outputs = preprocess_video(source, mode, os.path.join(work_dir, mode))
+            if not outputs:
+                raise ValueError("ffmpeg produced no output")
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            outputs = [source]
+            entry["error"] = str(getattr(e, "stderr", None) or e)[-500:]
+        entry.update(
+            bytes_in=os.path.getsize(source),
+            bytes_out=sum(os.path.getsize(p) for p in outputs),
+            outputs=len(outputs),
+            seconds=round(time.monotonic() - started, 3),
+        )
+        record_span(
+            "preprocess",
+            entry["seconds"],
+            "error" if "error" in entry else "ok",
+            file=entry["file"],
+            bytes=entry["bytes_in"],
+            bytes_out=entry["bytes_out"],
+        )
+        paths.extend(outputs)
+        stats.append(entry)
+
+    return paths, stats
+
+
+def record_stats(stats, **extra):
+    """Append ``stats`` and ``extra`` fields such as end-to-end seconds to the stats log
+
+    The log is what the default mode for each kind of job is picked from.
+    """
+    if not stats:
+        return
+    os.makedirs(os.path.dirname(STATS_PATH) or ".", exist_ok=True)
+    with open(STATS_PATH, "a") as f:
+        for entry in stats:
+            f.write(json.dumps(dict(entry, **extra, logged_at=time.time())) + "\n")
+
+
+def summarize(stats):
+    """Total bytes saved and seconds spent for a list of per-video stats"""
+    bytes_in = sum(entry["bytes_in"] for entry in stats)
+    bytes_out = sum(entry["bytes_out"] for entry in stats)
+    return {
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "bytes_saved": bytes_in - bytes_out,
+        "seconds": round(sum(entry["seconds"] for entry in stats), 3),
+    }
@@ -0,0 +1,184 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+
+from retry import classify_error
+from tracing import metrics, record_span
+
+# Per-minute budgets for every model and for the file API. Override with the
+# GEMINI_RATE_LIMITS environment variable, e.g.
+#   GEMINI_RATE_LIMITS='{"gemini-2.5-pro": {"rpm": 5, "tpm": 250000}}'
+DEFAULT_LIMITS = {
+    "gemini-2.5-pro": {"rpm": 150, "tpm": 2_000_000},
+    "gemini-2.5-flash": {"rpm": 1000, "tpm": 1_000_000},
+    "files": {"rpm": 600, "tpm": None},
+}
+FALLBACK_LIMITS = {"rpm": 60, "tpm": None}
+DEFAULT_RETRY_AFTER = 30  # pause after a 429 that carries no retry hint
+MEDIA_TOKEN_ESTIMATE = 10_000  # rough prompt tokens per attached media file
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units per minute up to a burst of ``per_minute``"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount):
+        """Seconds until ``amount`` units are available (0 when they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        """Remove ``amount`` units; the level may go negative to record debt"""
+        self._refill()
+        self.level -= amount
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Process-wide scheduler for Gemini requests.
+
+    Each key (a model name or "files") has a requests-per-minute and an optional
+    tokens-per-minute bucket. Callers queue in FIFO order until both buckets
+    can serve them, so concurrent sessions and batch workers share the quota
+    instead of racing into 429s. A 429 pauses the key for the server's
+    retry-after hint; callers retry once the pause is over (see
+    uploads.call_file_api and analysis.run_analysis).
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits if limits is not None else _env_limits())
+        self._buckets = {}
+        self._paused_until = defaultdict(float)
+        self._queues = defaultdict(deque)
+        self._condition = threading.Condition()
+
+    def acquire(self, key, tokens=0):
+        """Block until a request with ``tokens`` estimated tokens may be sent"""
+        ticket = object()
+        started = time.monotonic()
+        waited = False
+        with self._condition:
+            queue = self._queues[key]
+            queue.append(ticket)
+            try:
+                while True:
+                    wait = self._wait_time(key, tokens) if queue[0] is ticket else None
+                    if wait == 0:
+                        rpm, tpm = self._buckets_for(key)
+                        rpm.take(1)
+                        if tpm is not None:
+                            tpm.take(tokens)
+                        if waited:
+                            record_span(
+                                "quota_wait", time.monotonic() - started, key=key
+                            )
+                        return
+                    waited = True
+                    self._condition.wait(timeout=wait)
+            finally:
+                queue.remove(ticket)
+                self._condition.notify_all()
+
+    def settle(self, key, estimated, actual):
+        """Correct the token bucket once the real token usage is known"""
+        if actual is None:
+            return
+        with self._condition:
+            _, tpm = self._buckets_for(key)
+            if tpm is not None:
+                tpm.take(actual - estimated)
+
+    def pause(self, key, seconds):
+        """Hold every request for ``key`` for ``seconds`` (server back-pressure)"""
+        metrics.inc(
+            "rate_limit_pauses_total", help="429 answers that paused a key", key=key
+        )
+        with self._condition:
+            self._paused_until[key] = max(
+                self._paused_until[key], time.monotonic() + seconds
+            )
+            self._condition.notify_all()
+
+    def call(self, key, fn, tokens=0):
+        """Run ``fn()`` within the budget of ``key``, pausing the key on a 429"""
+        self.acquire(key, tokens)
+        try:
+            return fn()
+        except Exception as e:
+            if is_rate_limited(e):
+                self.pause(key, retry_after(e) or DEFAULT_RETRY_AFTER)
+            raise
+
+    def queue_depth(self, key=None):
+        """Number of requests waiting, for one key or across all keys"""
+        with self._condition:
+            if key is not None:
+                return len(self._queues[key])
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _wait_time(self, key, tokens):
+        rpm, tpm = self._buckets_for(key)
+        wait = max(0, self._paused_until[key] - time.monotonic(), rpm.wait_time(1))
+        if tpm is not None:
+            wait = max(wait, tpm.wait_time(tokens))
+        return wait
+
+    def _buckets_for(self, key):
+        if key not in self._buckets:
+            limits = self.limits.get(key, FALLBACK_LIMITS)
+            tpm = TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+            self._buckets[key] = (TokenBucket(limits["rpm"]), tpm)
+        return self._buckets[key]
+
+
+def is_rate_limited(error):
+    """True for quota / rate-limit errors from the API (see retry.classify_error)"""
+    return classify_error(error) == "rate_limit"
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, from RetryInfo or a Retry-After header"""
+    details = json.dumps(getattr(error, "details", None) or {})
+    match = re.search(r'"retryDelay":\s*"(\d+(?:\.\d+)?)s"', details)
+    if match:
+        return float(match.group(1))
+
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(*prompts, media_count=0):
+    """Rough prompt size used to reserve tokens before the real count is known"""
+    return sum(len(prompt) for prompt in prompts) // 4 + media_count * (
+        MEDIA_TOKEN_ESTIMATE
+    )
+
+
+def _env_limits():
+    try:
+        return json.loads(os.getenv("GEMINI_RATE_LIMITS", "{}"))
+    except ValueError:
+        return {}
+
+
+# Shared by the Streamlit sessions, the upload engine and batch workers
+limiter = RateLimiter()
@@ -0,0 +1,92 @@
+from pydantic import BaseModel, Field, ValidationError
+
+from retry import EmptyResponseError
+
+
+class InspectionReport(BaseModel):
+    """The technical report as structured output, one field per report section"""
+
+    work_order_validation: str = Field(
+        description="Alignment between the visual findings and the work order's "
+        "client description; empty when no work order context was given"
+    )
+    issue_type: str = Field(
+        description="Single line description of the primary issue(s) identified"
+    )
+    general_description: str = Field(
+        description="The issue in the terms US service providers and contractors "
+        "use on work orders and service tickets"
+    )
+    location: str = Field(
+        description="Specific location details based on visual evidence"
+    )
+    detailed_assessment: str = Field(
+        description="Thorough description of the damage based on all media"
+    )
+    physical_characteristics: list[str] = Field(
+        description="Measurable or observable features, extent and progression"
+    )
+    technical_measurements: list[str] = Field(
+        description="Estimates with the scale reference they are based on; only "
+        "where clear reference points are visible"
+    )
+    technical_implications: list[str] = Field(
+        description="Structural, functional, safety, security and environmental impacts"
+    )
+    recommended_trades: list[str] = Field(
+        description="Trades needed for the repair, from the work order's trades "
+        "list when one was given"
+    )
+    repair_requirements: list[str] = Field(
+        description="Necessary repairs in priority order, with safety measures"
+    )
+    documentation_notes: list[str] = Field(
+        description="Further observations, areas needing inspection and media correlation"
+    )
+
+
+class MalformedReportError(EmptyResponseError):
+    """The model's answer did not match the report schema"""
+
+
+# Section headings of the text report, in order, with how each field is listed
+SECTIONS = [
+    ("WORK ORDER VALIDATION", "work_order_validation", None),
+    ("ISSUE TYPE", "issue_type", None),
+    ("GENERAL DESCRIPTION", "general_description", None),
+    ("LOCATION", "location", None),
+    ("DETAILED ASSESSMENT", "detailed_assessment", None),
+    ("PHYSICAL CHARACTERISTICS", "physical_characteristics", "bullets"),
+    ("TECHNICAL MEASUREMENTS", "technical_measurements", "bullets"),
+    ("TECHNICAL IMPLICATIONS", "technical_implications", "bullets"),
+    ("RECOMMENDED TRADES", "recommended_trades", "bullets"),
+    ("REPAIR REQUIREMENTS", "repair_requirements", "numbered"),
+    ("DOCUMENTATION NOTES", "documentation_notes", "bullets"),
+]
+
+
+def parse_report(text):
+    """Parse the model's JSON answer into an InspectionReport"""
+    try:
+        return InspectionReport.model_validate_json(text)
+    except ValidationError as e:
+        raise MalformedReportError(f"Report does not match the schema: {e}") from e
+
+
+def render_markdown(report):
+    """Render a report (InspectionReport or its dict) in the usual text layout"""
+    if isinstance(report, dict):
+        report = InspectionReport.model_validate(report)
+    blocks = []
+    for heading, field, style in SECTIONS:
+        value = getattr(report, field)
+        if not value:
+            continue
+        if style == "bullets":
+            body = "\n".join(f"- {item}" for item in value)
+        elif style == "numbered":
+            body = "\n".join(f"{i}. {item}" for i, item in enumerate(value, 1))
+        else:
+            body = value
+        blocks.append(f"**{heading}:**\n\n{body}")
+    return "\n\n".join(blocks)
@@ -0,0 +1,406 @@
+"""Search the local index of finished inspection reports.
+
+Every report produced by the app, the job workers or batch_analyze.py is
+recorded in ``.cache/reports.sqlite3`` with its work order, entity, model,
+latency and media hashes. Report texts are full-text indexed (SQLite FTS5)
+and their recommended trades are indexed too, taken from the structured
+report or read from the RECOMMENDED TRADES section of a free-form one, so
+searches return in milliseconds without re-reading the report texts:
+
+    python report_store.py "water damage ceiling" --days 30
+    python report_store.py --trade roofing --days 7
+    python report_store.py --work-order 146106-02 --show
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from file_cache import CACHE_DIR
+from result_cache import RESULT_TTL
+
+REPORT_STORE_PATH = os.path.join(CACHE_DIR, "reports.sqlite3")
+SEARCH_LIMIT = 100
+REUSE_TTL = RESULT_TTL  # stored reports stand in for a new analysis this long
+
+# Columns added after the first version of the store, added to older databases
+ADDED_COLUMNS = {
+    "entity": "TEXT",
+    "latency": "REAL",
+    "media_key": "TEXT",
+    "media_hashes": "TEXT",
+    "work_order_trades": "TEXT",
+    "reuse_key": "TEXT",
+}
+TRADES_HEADING = "RECOMMENDED TRADES"
+# A section heading line such as "REPAIR REQUIREMENTS:" or "**LOCATION:**"
+HEADING_LINE = re.compile(r"^[#*\s]*([A-Z][A-Z /&,()-]*[A-Z)])\**\s*:\**\s*(.*)$")
+SUMMARY_COLUMNS = (
+    "id, created_at, work_order, entity, model, latency, issue_type, location, "
+    "structured, media_hashes"
+)
+
+
+def media_key(media_hashes):
+    """Key identifying a set of media regardless of order"""
+    return hashlib.sha256("\0".join(sorted(media_hashes)).encode("utf-8")).hexdigest()
+
+
+class ReportStore:
+    """SQLite store of finished reports, full-text indexed and faceted by trade.
+
+    Reports are also looked up by the request they answered (see
+    find_reusable), so analyzing media that already has a report can be
+    skipped. Falls back to substring search when SQLite lacks FTS5.
+    """
+
+    def __init__(self, path=REPORT_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS reports (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    work_order TEXT,
+                    model TEXT,
+                    issue_type TEXT,
+                    location TEXT,
+                    structured TEXT,
+                    text TEXT NOT NULL
+                )"""
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(reports)")}
+            for column, kind in ADDED_COLUMNS.items():
+                if column not in columns:
+                    db.execute(f"ALTER TABLE reports ADD COLUMN {column} {kind}")
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS report_trades (
+                    report_id INTEGER NOT NULL REFERENCES reports (id),
+                    trade TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS reports_created ON reports (created_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS reports_work_order "
+                "ON reports (work_order, created_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS reports_media "
+                "ON reports (media_key, work_order)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS reports_reuse "
+                "ON reports (reuse_key, created_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS report_trades_trade "
+                "ON report_trades (trade, created_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS report_trades_report "
+                "ON report_trades (report_id, trade)"
+            )
+            self.full_text = self._create_search_index(db)
+
+    def add(
+        self,
+        text,
+        work_order_info=None,
+        model=None,
+        report=None,
+        latency=None,
+        media_hashes=(),
+        work_order=None,
+        reuse_key=None,
+    ):
+        """Record a report and return its id.
+
+        ``work_order_info`` is the work order lookup result, ``report`` the
+        structured report dict if there is one and ``media_hashes`` the
+        SHA-256 digests of the analyzed media. ``work_order`` is used when
+        there is no successful lookup. Only reports with a ``reuse_key`` (the
+        result_cache.result_key of the request) are found by find_reusable.
+        """
+        now = time.time()
+        report = report or {}
+        info = (
+            work_order_info
+            if work_order_info and work_order_info.get("success")
+            else {}
+        )
+        work_order = info.get("work_order_number") or work_order or None
+        trades = normalize_trades(report.get("recommended_trades") or text_trades(text))
+        media_hashes = list(media_hashes)
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO reports (created_at, work_order, entity, model, latency, "
+                "issue_type, location, structured, text, media_key, media_hashes, "
+                "work_order_trades, reuse_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    now,
+                    work_order,
+                    info.get("entity_name"),
+                    model,
+                    latency,
+                    report.get("issue_type"),
+                    report.get("location"),
+                    json.dumps(report) if report else None,
+                    text,
+                    media_key(media_hashes) if media_hashes else None,
+                    json.dumps(media_hashes),
+                    json.dumps(info.get("trades", [])),
+                    reuse_key,
+                ),
+            )
+            report_id = cursor.lastrowid
+            db.executemany(
+                "INSERT INTO report_trades VALUES (?, ?, ?)",
+                [(report_id, trade, now) for trade in trades],
+            )
+            if self.full_text:
+                db.execute(
+                    "INSERT INTO report_search (rowid, work_order, entity, issue_type, "
+                    "trades, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        report_id,
+                        work_order or "",
+                        info.get("entity_name") or "",
+                        report.get("issue_type") or "",
+                        " ".join(trades),
+                        text,
+                    ),
+                )
+            return report_id
+
+    def search(
+        self,
+        query=None,
+        trade=None,
+        since=None,
+        until=None,
+        work_order=None,
+        model=None,
+        limit=SEARCH_LIMIT,
+    ):
+        """Return matching reports as dicts without their text, newest first.
+
+        ``query`` is matched word by word (as prefixes) against the report
+        text, work order, entity, issue type and trades. ``trade`` is a
+        recommended trade (case-insensitive); ``since`` and ``until`` are
+        Unix timestamps. Searches walk an index in newest-first order and
+        stop after ``limit`` matches, so they stay fast on large stores.
+        """
+        source, order = "reports", "reports.created_at DESC"
+        where, params = [], []
+        terms = re.findall(r"\w+", query or "")
+        if trade:
+            trade = trade.strip().lower()
+        if terms and self.full_text:
+            source = "report_search JOIN reports ON reports.id = report_search.rowid"
+            order = "report_search.rowid DESC"  # ids grow with creation time
+            where.append("report_search MATCH ?")
+            params.append(" ".join(f'"{term}"*' for term in terms))
+        elif trade:
+            source = (
+                "report_trades JOIN reports ON reports.id = report_trades.report_id"
+            )
+            order = "report_trades.created_at DESC"
+            where.append("report_trades.trade = ?")
+            params.append(trade)
+            trade = None
+        for term in terms if not self.full_text else []:
+            where.append("reports.text LIKE ?")
+            params.append(f"%{term}%")
+        if trade:
+            where.append(
+                "EXISTS (SELECT 1 FROM report_trades WHERE report_id = reports.id "
+                "AND trade = ?)"
+            )
+            params.append(trade)
+        if since:
+            where.append("reports.created_at >= ?")
+            params.append(since)
+        if until:
+            where.append("reports.created_at < ?")
+            params.append(until)
+        if work_order:
+            where.append("reports.work_order = ?")
+            params.append(work_order.strip())
+        if model:
+            where.append("reports.model = ?")
+            params.append(model)
+        columns = ", ".join(f"reports.{c}" for c in SUMMARY_COLUMNS.split(", "))
+        sql = (
+            f"SELECT {columns} FROM {source}"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + f" ORDER BY {order} LIMIT ?"
+        )
+        with self._connect() as db:
+            rows = db.execute(sql, params + [limit]).fetchall()
+        return [_decode(row) for row in rows]
+
+    def get(self, report_id):
+        """Return one report with its ``text``, or None"""
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT {SUMMARY_COLUMNS}, text FROM reports WHERE id = ?",
+                (report_id,),
+            ).fetchone()
+        return _decode(row) if row else None
+
+    def find_reusable(self, reuse_key, model, work_order=None, max_age=REUSE_TTL):
+        """Return the newest report ``model`` made for ``reuse_key``, or None.
+
+        Only reports for the same work order (or none) made within
+        ``max_age`` seconds count.
+        """
+        with self._connect() as db:
+            row = db.execute(
+                f"SELECT {SUMMARY_COLUMNS}, text FROM reports "
+                "WHERE reuse_key = ? AND model = ? AND work_order IS ? "
+                "AND created_at > ? ORDER BY created_at DESC LIMIT 1",
+                (reuse_key, model, work_order or None, time.time() - max_age),
+            ).fetchone()
+        return _decode(row) if row else None
+
+    def trade_counts(self, since=None):
+        """Number of reports per recommended trade"""
+        with self._connect() as db:
+            return dict(
+                db.execute(
+                    "SELECT trade, COUNT(*) FROM report_trades WHERE created_at >= ? "
+                    "GROUP BY trade ORDER BY COUNT(*) DESC",
+                    (since or 0,),
+                )
+            )
+
+    def count(self):
+        """Number of stored reports"""
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def _create_search_index(self, db):
+        exists = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'report_search'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            db.execute(
+                "CREATE VIRTUAL TABLE report_search USING fts5("
+                "work_order, entity, issue_type, trades, text)"
+            )
+        except sqlite3.OperationalError:
+            return False  # SQLite built without FTS5
+        # Index reports stored before the search index existed
+        db.execute(
+            """INSERT INTO report_search (rowid, work_order, entity, issue_type, trades, text)
+            SELECT id, COALESCE(work_order, ''), COALESCE(entity, ''),
+                COALESCE(issue_type, ''),
+                COALESCE((SELECT GROUP_CONCAT(trade, ' ') FROM report_trades
+                    WHERE report_id = reports.id), ''),
+                text
+            FROM reports"""
+        )
+        return True
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+def normalize_trades(trades):
+    """Lower-case, de-duplicated trade names for the trade index"""
+    return list(dict.fromkeys(t.strip().lower() for t in trades if t and t.strip()))
+
+
+def text_trades(text):
+    """Trades listed under RECOMMENDED TRADES in a free-form report's text.
+
+    Takes bullets, numbered items or a comma-separated line up to the next
+    heading; anything after a dash, colon or parenthesis is an explanation.
+    """
+    trades, in_section = [], False
+    for line in text.splitlines():
+        heading = HEADING_LINE.match(line.strip())
+        if heading and heading.group(1) == TRADES_HEADING:
+            in_section, line = True, heading.group(2)
+        elif heading and in_section:
+            break
+        if not in_section:
+            continue
+        item = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip("[]* \t")
+        for trade in re.split(r",|;|\band\b", item):
+            trade = re.split(r"\s+[-–—]\s+|:|\(", trade)[0].strip(" .*[]")
+            if trade:
+                trades.append(trade)
+    return trades
+
+
+def _decode(row):
+    report = dict(row)
+    report["structured"] = json.loads(report["structured"] or "null")
+    report["media_hashes"] = json.loads(report["media_hashes"] or "[]")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("query", nargs="?", help="words to search the reports for")
+    parser.add_argument("--trade", help="recommended trade, e.g. roofing")
+    parser.add_argument("--days", type=float, help="only the last N days")
+    parser.add_argument("--work-order")
+    parser.add_argument("--model")
+    parser.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    parser.add_argument("--show", action="store_true", help="print the report texts")
+    parser.add_argument(
+        "--trades", action="store_true", help="count reports per trade instead"
+    )
+    args = parser.parse_args()
+
+    store = ReportStore()
+    since = time.time() - args.days * 24 * 60 * 60 if args.days else None
+    if args.trades:
+        for trade, count in store.trade_counts(since).items():
+            print(f"{count:6d}  {trade}")
+        return
+
+    started = time.monotonic()
+    reports = store.search(
+        args.query,
+        trade=args.trade,
+        since=since,
+        work_order=args.work_order,
+        model=args.model,
+        limit=args.limit,
+    )
+    elapsed = (time.monotonic() - started) * 1000
+    for report in reports:
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(report["created_at"]))
+        print(
+            f"#{report['id']} {created} {report['work_order'] or '-'} "
+            f"[{report['model']}] {report['issue_type'] or '(free-form report)'}"
+        )
+        if args.show:
+            print(store.get(report["id"])["text"] + "\n")
+    print(f"🔎 {len(reports)} report(s) in {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from file_cache import CACHE_DIR
+
+RESULT_CACHE_PATH = os.path.join(CACHE_DIR, "analysis_results.sqlite3")
+RESULT_TTL = 7 * 24 * 60 * 60  # seconds a cached report stays valid
+MAX_ENTRIES = 1000
+MAX_BYTES = 64 * 1024 * 1024  # total size of cached report text
+
+
+def prompt_hash(*prompts):
+    """Hash the prompt text so any prompt change invalidates cached results"""
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        digest.update(prompt.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def result_key(media_digests, model, prompts_digest, work_order_info=None):
+    """Build the cache key for one analysis request"""
+    work_order = {}
+    if work_order_info and work_order_info.get("success"):
+        work_order = {
+            "work_order_number": work_order_info.get("work_order_number"),
+            "client_description": work_order_info.get("client_description"),
+            "trades": work_order_info.get("trades", []),
+        }
+    payload = json.dumps(
+        {
+            "media": list(media_digests),
+            "model": model,
+            "prompt": prompts_digest,
+            "work_order": work_order,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite store of finished analysis reports with TTL and size eviction"""
+
+    def __init__(
+        self,
+        path=RESULT_CACHE_PATH,
+        ttl=RESULT_TTL,
+        max_entries=MAX_ENTRIES,
+        max_bytes=MAX_BYTES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    model TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+
+    def get(self, key):
+        """Return {"text", "model"} for a fresh cached result, or None"""
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT text, model FROM results WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row:
+                db.execute(
+                    "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+            self._count(db, "hits" if row else "misses")
+        if row:
+            return {"text": row[0], "model": row[1]}
+        return None
+
+    def put(self, key, text, model=None):
+        """Store a result and evict expired or least recently used entries"""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, text, model, len(text.encode("utf-8")), now, now),
+            )
+            db.execute("DELETE FROM results WHERE created_at <= ?", (now - self.ttl,))
+            self._evict(db)
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache"""
+        with self._connect() as db:
+            counters = dict(db.execute("SELECT name, value FROM counters"))
+            entries, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def _evict(self, db):
+        entries, size = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        rows = db.execute(
+            "SELECT key, size FROM results ORDER BY accessed_at"
+        ).fetchall()
+        stale = []
+        for key, row_size in rows:
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            stale.append((key,))
+            entries -= 1
+            size -= row_size
+        db.executemany("DELETE FROM results WHERE key = ?", stale)
+
+    def _count(self, db, name):
+        db.execute(
+            "INSERT INTO counters VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
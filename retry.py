@@ -0,0 +1,153 @@
+import random
+import time
+from collections import namedtuple
+
+import httpx
+import requests
+from google.genai import errors
+
+# One event per attempt. ``outcome`` is "ok" or an error kind from
+# classify_error(); ``delay`` is the wait before the next attempt, or None when
+# this model gives up.
+AttemptEvent = namedtuple(
+    "AttemptEvent", ["model", "attempt", "outcome", "duration", "error", "delay"]
+)
+
+RETRYABLE_KINDS = ("empty", "server", "rate_limit", "network")
+NETWORK_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    httpx.TransportError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class EmptyResponseError(ValueError):
+    """The model answered without any text"""
+
+
+def classify_error(error):
+    """Sort an exception into "empty", "rate_limit", "server", "network" or "fatal" """
+    if isinstance(error, EmptyResponseError):
+        return "empty"
+    if isinstance(error, errors.APIError):
+        if error.code == 429 or error.status == "RESOURCE_EXHAUSTED":
+            return "rate_limit"
+        if isinstance(error, errors.ServerError):
+            return "server"
+        return "fatal"
+    if isinstance(error, NETWORK_ERRORS):
+        return "network"
+    return "fatal"
+
+
+class RetryPolicy:
+    """How often and how long to retry one model.
+
+    Delays grow exponentially from ``base_delay`` up to ``max_delay`` with
+    +/- ``jitter`` applied. A model stops being retried after ``max_attempts``
+    attempts or once the next attempt would start after ``max_elapsed``
+    seconds. Rate-limited attempts are retried without a delay of their own
+    because the shared rate limiter already holds them back.
+    """
+
+    def __init__(
+        self,
+        max_attempts=6,
+        base_delay=2,
+        multiplier=2,
+        max_delay=60,
+        jitter=0.25,
+        max_elapsed=600,
+        retry_on=RETRYABLE_KINDS,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_elapsed = max_elapsed
+        self.retry_on = retry_on
+
+    def delay(self, attempt, kind):
+        """Seconds to wait after failed attempt number ``attempt`` (0-based)"""
+        if kind == "rate_limit":
+            return 0
+        delay = min(self.max_delay, self.base_delay * self.multiplier**attempt)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_delay(self, attempt, kind, elapsed):
+        """The delay before the next attempt, or None when giving up"""
+        if kind not in self.retry_on or attempt + 1 >= self.max_attempts:
+            return None
+        delay = self.delay(attempt, kind)
+        if elapsed + delay > self.max_elapsed:
+            return None
+        return delay
+
+
+def gave_up(events, model):
+    """True when ``model`` gave up in ``events``, handing over to the next stage"""
+    return any(
+        event.model == model and event.delay is None and event.outcome != "ok"
+        for event in events
+    )
+
+
+def run_with_retries(call, stages, on_event=None):
+    """Run ``call(model)`` through an ordered list of ``(model, RetryPolicy)`` stages.
+
+    ``call`` returns ``(model_used, result)`` and raises to signal a failed
+    attempt (EmptyResponseError for an empty answer). Retryable failures are
+    retried by the current stage's policy, then the next stage (the fallback
+    model) takes over; a "fatal" error is raised immediately. Every attempt is
+    reported to ``on_event`` as an AttemptEvent. Returns ``(model_used, result)``.
+    """
+    last_error = None
+    attempts = 0
+    for model, policy in stages:
+        stage_started = time.monotonic()
+        for attempt in range(policy.max_attempts):
+            attempt_started = time.monotonic()
+            attempts += 1
+            try:
+                used_model, result = call(model)
+            except Exception as e:
+                last_error = e
+                kind = classify_error(e)
+                now = time.monotonic()
+                delay = policy.next_delay(attempt, kind, now - stage_started)
+                if on_event:
+                    on_event(
+                        AttemptEvent(
+                            model, attempt, kind, now - attempt_started, e, delay
+                        )
+                    )
+                if kind == "fatal":
+                    raise
+                if delay is None:
+                    break
+                time.sleep(delay)
+                continue
+
+            if on_event:
+                on_event(
+                    AttemptEvent(
+                        used_model,
+                        attempt,
+                        "ok",
+                        time.monotonic() - attempt_started,
+                        None,
+                        None,
+                    )
+                )
+            return used_model, result
+
+    if isinstance(last_error, EmptyResponseError):
+        models = " and ".join(model for model, _ in stages)
+        raise EmptyResponseError(
+            f"{models} returned empty responses after {attempts} attempts. "
+            "This may indicate content policy restrictions or file processing issues."
+        )
+    raise last_error
@@ -0,0 +1,273 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis import MODEL_NAME, analyze_media, build_prompts
+from result_cache import prompt_hash, result_key
+from tracing import propagate, record_span
+
+SEGMENT_WORKERS = 4  # segments analyzed at once per job
+SEGMENT_RETRIES = 2  # a failing segment gives up early instead of holding the job
+
+SEGMENT_NOTE = """LONG RECORDING: The attached video is part {part} of {parts} of the recording "{source}" and covers {start} to {end} of it. Report only what this part shows. Give the time of every finding in the full recording as [mm:ss], i.e. add {start} to times within this part."""
+
+OTHER_MEDIA_NOTE = """LONG RECORDING: These are the photos and short videos sent along with a long recording that is analyzed separately, in parts."""
+
+MERGE_NOTE = """MERGE PARTIAL REPORTS: The media of this job was too long to analyze at once, so it was analyzed in parts. No media is attached; below are the reports on each part, in order, headed by the time window they cover. Write one report on the whole job in the usual format: combine findings seen in several parts, keep the [mm:ss] timestamps of every finding (list the times an issue is seen when it appears more than once) and put the most serious issues first. Parts that could not be analyzed are listed too; state in the report that their time ranges were not covered.
+
+{findings}"""
+
+
+def format_time(seconds):
+    """Seconds as [h:]mm:ss"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return (
+        f"{hours}:{minutes:02d}:{seconds:02d}"
+        if hours
+        else f"{minutes:02d}:{seconds:02d}"
+    )
+
+
+def describe_window(window):
+    """Heading of one part, e.g. "walkthrough.mp4, part 2/6 [05:00-10:00]" """
+    if window is None:
+        return "Photos and short videos"
+    return (
+        f"{window['source']}, part {window['part']}/{window['parts']} "
+        f"[{format_time(window['start'])}-{format_time(window['end'])}]"
+    )
+
+
+def group_parts(uploaded_files, windows, media_digests=None):
+    """One unit of work per segment, plus one for all media sent whole.
+
+    Returns ``[(window, files, digests)]`` with window None for the media
+    that was not split.
+    """
+    digests = media_digests or [None] * len(uploaded_files)
+    parts = []
+    whole = ([], [])
+    for item, window, digest in zip(uploaded_files, windows, digests):
+        if window is None:
+            whole[0].append(item)
+            whole[1].append(digest)
+        else:
+            parts.append((window, [item], [digest]))
+    if whole[0]:
+        parts.append((None, *whole))
+    return parts
+
+
+def reuse_key(media_digests, windows, work_order_info=None, structured=False):
+    """Key a long recording's merged report is stored and reused under"""
+    prompts = prompt_hash(
+        *build_prompts(work_order_info),
+        SEGMENT_NOTE,
+        OTHER_MEDIA_NOTE,
+        MERGE_NOTE,
+        json.dumps(windows, sort_keys=True),
+        *(["json"] if structured else []),
+    )
+    return result_key(media_digests, MODEL_NAME, prompts, work_order_info)
+
+
+def merge_fallback(outcomes, error=None):
+    """Combine the part reports without the model, one section per part"""
+    lines = [
+        "**LONG RECORDING REPORT:** The parts below were analyzed separately and "
+        "could not be merged into one report"
+        + (f" ({error})" if error else "")
+        + "; findings are listed per part with their time windows."
+    ]
+    for window, result, part_error in outcomes:
+        lines.append(f"### {describe_window(window)}")
+        if result is not None:
+            lines.append(result["text"])
+        else:
+            lines.append(f"⚠️ This part could not be analyzed: {part_error}")
+    return "\n\n".join(lines)
+
+
+def analyze_segments(
+    client,
+    uploaded_files,
+    windows,
+    work_order_info=None,
+    media_digests=None,
+    cache=None,
+    log=print,
+    on_text=None,
+    context_cache=None,
+    structured=False,
+    report_store=None,
+    reuse_report=True,
+    work_order=None,
+    max_workers=SEGMENT_WORKERS,
+):
+    """Analyze a long recording part by part and merge the findings (map-reduce).
+
+    ``windows`` lines up with ``uploaded_files`` as returned by
+    preprocess.split_long_videos. Every segment is analyzed on its own, in
+    parallel, with its time window in the prompt so findings carry
+    timestamps of the full recording; the media that was not split is
+    analyzed together as one more part. A text-only request then merges the
+    part reports into one report, streamed to ``on_text``. If that request
+    fails the part reports are joined without the model instead.
+
+    A failed part is logged and named in the report rather than failing the
+    job; only when every part fails is the first error raised. Returns the
+    same dict as analysis.analyze_media plus ``segments``: per part its
+    ``window``, ``model`` and ``error``.
+
+    Merged reports are recorded in ``report_store``. Only those MODEL_NAME
+    wrote for parts that were all analyzed by MODEL_NAME are reused later;
+    a report missing parts or listing them unmerged is searchable but never
+    stands in for a new analysis.
+    """
+    started = time.monotonic()
+    if work_order_info and work_order_info.get("success"):
+        work_order = work_order_info.get("work_order_number") or work_order
+    key = None
+    if media_digests:
+        key = reuse_key(media_digests, windows, work_order_info, structured)
+    if report_store is not None and reuse_report and key:
+        stored = report_store.find_reusable(key, MODEL_NAME, work_order)
+        if stored:
+            log(f"♻️ Reusing report #{stored['id']} made earlier from the same media")
+            return {
+                "text": stored["text"],
+                "report": stored["structured"],
+                "model": stored["model"],
+                "events": [],
+                "attempts": 0,
+                "latency": time.monotonic() - started,
+                "time_to_first_token": None,
+                "usage": None,
+                "cached": True,
+                "report_id": stored["id"],
+                "segments": [],
+            }
+
+    parts = group_parts(uploaded_files, windows, media_digests)
+    log(f"✂️ Analyzing {len(parts)} parts of the recording in parallel")
+
+    def analyze_part(part):
+        window, files, digests = part
+        note = OTHER_MEDIA_NOTE
+        if window is not None:
+            note = SEGMENT_NOTE.format(
+                part=window["part"],
+                parts=window["parts"],
+                source=window["source"],
+                start=format_time(window["start"]),
+                end=format_time(window["end"]),
+            )
+        try:
+            result = analyze_media(
+                client,
+                files,
+                work_order_info,
+                media_digests=digests if all(digests) else None,
+                cache=cache,
+                max_retries=SEGMENT_RETRIES,
+                log=lambda message: log(f"{describe_window(window)}: {message}"),
+                context_cache=context_cache,
+                note=note,
+            )
+        except Exception as e:
+            log(f"⚠️ {describe_window(window)} could not be analyzed: {e}")
+            return window, None, e
+        return window, result, None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(parts))) as executor:
+        outcomes = list(executor.map(propagate(analyze_part), parts))
+    failed = [error for _, result, error in outcomes if result is None]
+    record_span(
+        "segments",
+        time.monotonic() - started,
+        "ok" if not failed else "partial" if len(failed) < len(outcomes) else "error",
+        parts=len(outcomes),
+        failed=len(failed),
+    )
+    if len(failed) == len(outcomes):
+        raise failed[0]
+
+    events = [
+        event for _, result, _ in outcomes if result for event in result["events"]
+    ]
+    usage = _sum_usage(result["usage"] for _, result, _ in outcomes if result)
+    findings = "\n\n".join(
+        f"=== {describe_window(window)} ===\n"
+        + (result["text"] if result else f"(not analyzed: {error})")
+        for window, result, error in outcomes
+    )
+    try:
+        merged = analyze_media(
+            client,
+            [],
+            work_order_info,
+            media_digests=media_digests,
+            cache=cache,
+            log=log,
+            on_text=on_text,
+            context_cache=context_cache,
+            structured=structured,
+            note=MERGE_NOTE.format(findings=findings),
+        )
+    except Exception as e:
+        log(f"⚠️ Could not merge the part reports, listing them per part: {e}")
+        merged = {
+            "text": merge_fallback(outcomes, e),
+            "report": None,
+            "model": "segments",
+            "events": [],
+            "time_to_first_token": None,
+            "usage": None,
+            "cached": False,
+        }
+
+    complete = merged["model"] == MODEL_NAME and all(
+        result and result["model"] == MODEL_NAME for _, result, _ in outcomes
+    )
+    report_id = None
+    if report_store is not None:
+        report_id = report_store.add(
+            merged["text"],
+            work_order_info,
+            model=merged["model"],
+            report=merged["report"],
+            latency=round(time.monotonic() - started, 3),
+            media_hashes=media_digests or (),
+            work_order=work_order,
+            reuse_key=key if complete else None,
+        )
+
+    events += merged["events"]
+    return dict(
+        merged,
+        report_id=report_id,
+        events=events,
+        attempts=len(events),
+        latency=time.monotonic() - started,
+        usage=_sum_usage([usage, merged["usage"]]),
+        segments=[
+            {
+                "window": window,
+                "model": result and result["model"],
+                "error": str(error) if error else None,
+            }
+            for window, result, error in outcomes
+        ],
+    )
+
+
+def _sum_usage(usages):
+    total = None
+    for usage in usages:
+        if usage is None:
+            continue
+        total = dict(total or {key: 0 for key in usage})
+        for key, value in usage.items():
+            total[key] += value
+    return total
@@ -0,0 +1,93 @@
+import os
+
+from analysis import (
+    FALLBACK_MODEL,
+    HEDGE_MODEL,
+    MAX_RETRIES,
+    MODEL_NAME,
+    analyze_media,
+)
+from report_store import ReportStore
+from result_cache import ResultCache
+from tracing import Trace, activate
+
+
+def quiet(message):
+    pass
+
+
+def test_primary_answer_is_cached(tmp_path, genai_client):
+    cache = ResultCache(os.path.join(tmp_path, "results.sqlite3"))
+
+    first = analyze_media(genai_client, [], cache=cache, log=quiet)
+    second = analyze_media(genai_client, [], cache=cache, log=quiet)
+
+    assert (first["model"], first["cached"]) == (MODEL_NAME, False)
+    assert (second["model"], second["cached"]) == (MODEL_NAME, True)
+    assert second["text"] == first["text"]
+
+
+def test_fallback_answer_is_not_cached_for_the_primary(
+    tmp_path, fake_server, genai_client
+):
+    cache = ResultCache(os.path.join(tmp_path, "results.sqlite3"))
+    fake_server.scripted_errors = {MODEL_NAME: [500] * (MAX_RETRIES + 1)}
+
+    degraded = analyze_media(genai_client, [], cache=cache, log=quiet)
+    recovered = analyze_media(genai_client, [], cache=cache, log=quiet)
+
+    assert degraded["model"] == FALLBACK_MODEL
+    assert [event.outcome for event in degraded["events"]] == ["server"] * (
+        MAX_RETRIES + 1
+    ) + ["ok"]
+    assert cache.stats()["entries"] == 1  # only the primary's answer
+    assert (recovered["model"], recovered["cached"]) == (MODEL_NAME, False)
+
+
+def test_streamed_answer_reports_partial_text(genai_client):
+    partial = []
+
+    result = analyze_media(genai_client, [], log=quiet, on_text=partial.append)
+
+    assert len(partial) > 1
+    assert partial[-1] == result["text"]
+    assert result["time_to_first_token"] is not None
+
+
+def test_only_reports_of_the_primary_model_are_reused(
+    tmp_path, fake_server, genai_client
+):
+    store = ReportStore(os.path.join(tmp_path, "reports.sqlite3"))
+    fake_server.scripted_errors = {MODEL_NAME: [500] * (MAX_RETRIES + 1)}
+
+    degraded = analyze_media(genai_client, [], report_store=store, log=quiet)
+    first = analyze_media(genai_client, [], report_store=store, log=quiet)
+    second = analyze_media(genai_client, [], report_store=store, log=quiet)
+    other_prompt = analyze_media(
+        genai_client, [], report_store=store, log=quiet, note="Part 2"
+    )
+
+    assert (degraded["model"], degraded["cached"]) == (FALLBACK_MODEL, False)
+    assert (first["model"], first["cached"]) == (MODEL_NAME, False)
+    assert (second["report_id"], second["cached"]) == (first["report_id"], True)
+    assert other_prompt["cached"] is False
+
+
+def analysis_span(genai_client, **options):
+    with activate(Trace()) as trace:
+        result = analyze_media(genai_client, [], log=quiet, **options)
+    (span,) = [span for span in trace.spans if span["stage"] == "analysis"]
+    return result, span
+
+
+def test_span_tells_a_fallback_from_a_hedge_that_won(fake_server, genai_client):
+    fake_server.scripted_errors = {MODEL_NAME: [500] * (MAX_RETRIES + 1)}
+    result, span = analysis_span(genai_client)
+    assert result["model"] == FALLBACK_MODEL
+    assert (span.get("fallback"), span.get("hedged")) == (True, None)
+
+    # A failing primary hedges right away; the hedge is no fallback
+    fake_server.scripted_errors = {MODEL_NAME: [500]}
+    result, span = analysis_span(genai_client, hedge=True)
+    assert result["model"] == HEDGE_MODEL
+    assert (span.get("fallback"), span.get("hedged")) == (None, True)
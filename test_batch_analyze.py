@@ -0,0 +1,110 @@
+import json
+import os
+
+import pytest
+
+from analysis import MAX_RETRIES, MODEL_NAME
+from batch_analyze import (
+    SUMMARY_FILE,
+    BatchRunner,
+    group_media_by_work_order,
+    load_finished,
+)
+from file_cache import RemoteFileIndex
+from report_store import ReportStore
+from result_cache import ResultCache
+
+
+def write_media(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture
+def make_runner(tmp_path, genai_client):
+    index = RemoteFileIndex(os.path.join(tmp_path, "remote.json"))
+
+    def make_runner(**options):
+        runner = BatchRunner(genai_client, str(tmp_path / "reports"), **options)
+        runner.remote_index = index
+        runner.result_cache = ResultCache(os.path.join(tmp_path, "results.sqlite3"))
+        runner.report_store = ReportStore(os.path.join(tmp_path, "reports.sqlite3"))
+        return runner
+
+    return make_runner
+
+
+def test_only_files_uploaded_by_the_run_are_deleted(tmp_path, fake_server, make_runner):
+    video = b"video" * 1000
+    first = write_media(tmp_path, "first.mp4", video)
+    same = write_media(tmp_path, "same.mp4", video)
+    other = write_media(tmp_path, "other.mp4", b"other" * 1000)
+
+    assert make_runner(keep_remote=True).process("WO-1", [first])["status"] == "ok"
+    cleaning = make_runner()
+    assert cleaning.process("WO-2", [same])["status"] == "ok"
+    assert fake_server.requests["delete_file", 200] == 0  # WO-1's file is shared
+
+    assert cleaning.process("WO-3", [other])["status"] == "ok"
+    assert fake_server.requests["delete_file", 200] == 1
+
+
+def test_media_is_grouped_by_work_order_in_download_order(tmp_path):
+    for name in ["146106_10.mp4", "146106_2.jpg", "146107_0.mp4", "146107_1.mp4.part"]:
+        write_media(tmp_path, name, b"media")
+    write_media(tmp_path, "notes.txt", b"no work order")
+
+    assert group_media_by_work_order(str(tmp_path)) == {
+        "146106": [str(tmp_path / "146106_2.jpg"), str(tmp_path / "146106_10.mp4")],
+        "146107": [str(tmp_path / "146107_0.mp4")],
+    }
+
+
+def test_the_last_record_of_a_work_order_counts(tmp_path):
+    summary = tmp_path / SUMMARY_FILE
+    summary.write_text(
+        '{"work_order": "1", "status": "ok"}\n'
+        '{"work_order": "2", "status": "failed"}\n'
+        '{"work_order": "1", "status": "failed"}\n'
+        '{"work_order": "3", "status": "no_media"}\n'
+        '{"work_order": "2", "sta'  # torn by a crash
+    )
+
+    assert load_finished(str(summary)) == {"3"}
+
+
+def test_run_resumes_after_the_finished_work_orders(tmp_path, fake_server, make_runner):
+    media_dir = tmp_path / "media"
+    media_dir.mkdir()
+    groups = {
+        "146106": [write_media(media_dir, "146106_0.mp4", b"video" * 100)],
+        "146107": [write_media(media_dir, "146107_0.mp4", b"other" * 100)],
+        "146108": [write_media(media_dir, "146108_0.txt", b"notes")],
+    }
+    fake_server.scripted_errors = {MODEL_NAME: [400]}  # fails one work order
+
+    first = make_runner(workers=1).run(groups)
+    second = make_runner().run(groups)
+
+    assert first == {"ok": 1, "failed": 1, "no_media": 1}
+    assert second == {"ok": 1}
+    with open(tmp_path / "reports" / SUMMARY_FILE) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 4
+    done = [record for record in records if record["status"] == "ok"]
+    assert all(os.path.exists(record["report"]) for record in done)
+    assert all(record["timeline"] for record in done)
+
+
+def test_a_work_order_that_keeps_failing_is_recorded_as_failed(
+    tmp_path, fake_server, make_runner
+):
+    fake_server.scripted_errors = {MODEL_NAME: [500] * (MAX_RETRIES + 1)}
+    fake_server.rate_500 = 1  # the fallback model fails too
+    video = write_media(tmp_path, "146106_0.mp4", b"video" * 100)
+
+    record = make_runner().process("146106", [video])
+
+    assert record["status"] == "failed" and "500" in record["error"]
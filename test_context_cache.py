@@ -0,0 +1,115 @@
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import context_cache
+from context_cache import ContextCache
+
+
+class FakeCaches:
+    """In-memory stand-in for ``client.caches``"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.entries = {}
+        self.calls = []
+
+    def _entry(self, name, ttl):
+        expire = datetime.fromtimestamp(time.time() + ttl, timezone.utc)
+        self.entries[name].expire_time = expire
+        return self.entries[name]
+
+    def list(self):
+        self.calls.append("list")
+        return list(self.entries.values())
+
+    def create(self, model, config):
+        self.calls.append("create")
+        if self.fail:
+            raise ValueError("too few tokens to cache")
+        name = f"cachedContents/{len(self.entries)}"
+        self.entries[name] = SimpleNamespace(
+            name=name,
+            model=f"models/{model}",
+            display_name=config.display_name,
+            usage_metadata=None,
+        )
+        return self._entry(name, int(config.ttl.rstrip("s")))
+
+    def update(self, name, config):
+        self.calls.append("update")
+        return self._entry(name, int(config.ttl.rstrip("s")))
+
+    def delete(self, name):
+        self.calls.append("delete")
+        del self.entries[name]
+
+
+def make_cache(caches, instructions="Describe the work", ttl=3600):
+    client = SimpleNamespace(caches=caches)
+    return ContextCache(client, "You are an inspector", instructions, ttl=ttl)
+
+
+def test_cache_is_created_once_per_model_and_refreshed_before_it_expires():
+    caches = FakeCaches()
+    cache = make_cache(caches)
+
+    first = cache.name("gemini-a")
+    assert cache.name("gemini-a") == first
+    assert cache.name("gemini-b") != first
+    assert caches.calls == ["list", "create", "list", "create"]
+
+    short = make_cache(caches, ttl=context_cache.REFRESH_MARGIN - 1)
+    short.name("gemini-a")  # found from the other instance, TTL updated
+    short.name("gemini-a")
+    assert caches.calls[4:] == ["list", "update", "update"]
+
+
+def test_caches_from_another_run_are_reused_only_for_the_same_instructions():
+    caches = FakeCaches()
+    name = make_cache(caches).name("gemini-a")
+
+    assert make_cache(caches).name("gemini-a") == name
+    assert make_cache(caches, "Other instructions").name("gemini-a") != name
+    assert len(caches.entries) == 2
+
+
+def test_failed_create_sends_full_prompts_for_a_while(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(context_cache.time, "monotonic", lambda: now[0])
+    caches = FakeCaches(fail=True)
+    cache = make_cache(caches)
+
+    assert cache.name("gemini-a") is None
+    assert cache.name("gemini-a") is None
+    assert caches.calls.count("create") == 1
+
+    now[0] += context_cache.RETRY_AFTER
+    caches.fail = False
+    assert cache.name("gemini-a") is not None
+
+
+def test_close_deletes_the_caches_in_use():
+    caches = FakeCaches()
+    cache = make_cache(caches)
+    cache.name("gemini-a")
+    cache.name("gemini-b")
+
+    cache.close()
+
+    assert caches.entries == {}
+    assert caches.calls.count("delete") == 2
+
+
+def test_totals_count_cached_and_uncached_tokens():
+    cache = make_cache(FakeCaches())
+    cache.record({"prompt_tokens": 1000, "cached_tokens": 800})
+    cache.record({"prompt_tokens": 300, "cached_tokens": 0})
+
+    assert cache.totals() == {
+        "requests": 2,
+        "cached_requests": 1,
+        "prompt_tokens": 1300,
+        "cached_tokens": 800,
+        "uncached_tokens": 500,
+    }
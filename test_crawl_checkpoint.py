@@ -0,0 +1,33 @@
+import os
+
+from crawl_checkpoint import CrawlCheckpoint
+
+
+def test_saved_file_must_still_be_on_disk_intact(tmp_path):
+    checkpoint = CrawlCheckpoint(os.path.join(tmp_path, "crawl.sqlite3"))
+    (tmp_path / "146106_0.mp4").write_bytes(b"video")
+    checkpoint.record_file("146106", 0, "146106_0.mp4", 5, "digest")
+
+    assert checkpoint.saved_file("146106", 0, tmp_path) == {
+        "filename": "146106_0.mp4",
+        "size": 5,
+        "sha256": "digest",
+    }
+    assert checkpoint.saved_file("146106", 1, tmp_path) is None
+
+    (tmp_path / "146106_0.mp4").write_bytes(b"vid")
+    assert checkpoint.saved_file("146106", 0, tmp_path) is None
+
+    os.remove(tmp_path / "146106_0.mp4")
+    assert checkpoint.saved_file("146106", 0, tmp_path) is None
+
+
+def test_failed_work_orders_are_not_finished(tmp_path):
+    checkpoint = CrawlCheckpoint(os.path.join(tmp_path, "crawl.sqlite3"))
+    checkpoint.record_workorder("1", "saved", 2)
+    checkpoint.record_workorder("2", "no_files")
+    checkpoint.record_workorder("3", "failed", reason="HTTP 503")
+
+    assert checkpoint.finished() == {"1", "2"}
+    checkpoint.record_workorder("3", "saved", 1)
+    assert checkpoint.finished() == {"1", "2", "3"}
@@ -0,0 +1,83 @@
+import json
+import os
+import time
+
+import pytest
+
+from file_cache import RemoteFileIndex, content_key
+from uploads import upload_files
+
+
+def write_media(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture
+def index(tmp_path):
+    return RemoteFileIndex(os.path.join(tmp_path, "remote.json"))
+
+
+def upload(genai_client, index, path):
+    states = []
+    (handle,) = upload_files(
+        genai_client,
+        [path],
+        remote_index=index,
+        on_progress=lambda i, p, state: states.append(state),
+    )
+    return handle, states
+
+
+def test_key_follows_the_content_not_the_name(tmp_path):
+    first = write_media(tmp_path, "a.mp4", b"video")
+    renamed = write_media(tmp_path, "b.mp4", b"video")
+    changed = write_media(tmp_path, "c.mp4", b"other")
+
+    assert content_key(first) == content_key(renamed)
+    assert content_key(first) != content_key(changed)
+
+
+def test_same_content_is_uploaded_once(tmp_path, genai_client, index):
+    first, _ = upload(genai_client, index, write_media(tmp_path, "a.mp4", b"v" * 99))
+    again, states = upload(
+        genai_client, index, write_media(tmp_path, "b.mp4", b"v" * 99)
+    )
+
+    assert again.name == first.name
+    assert "REUSED" in states
+
+
+def test_deleted_remote_file_is_uploaded_again(tmp_path, genai_client, index):
+    path = write_media(tmp_path, "a.mp4", b"v" * 99)
+    first, _ = upload(genai_client, index, path)
+    genai_client.files.delete(name=first.name)
+
+    again, states = upload(genai_client, index, path)
+
+    assert again.name != first.name
+    assert "REUSED" not in states
+
+
+def test_entries_close_to_expiry_are_not_handed_out(tmp_path, genai_client, index):
+    path = write_media(tmp_path, "a.mp4", b"v" * 99)
+    upload(genai_client, index, path)
+    with open(index.path) as f:
+        entries = json.load(f)
+    for entry in entries.values():
+        entry["expires_at"] = time.time() + 60
+    with open(index.path, "w") as f:
+        json.dump(entries, f)
+
+    assert index.lookup(genai_client, content_key(path)) is None
+    assert index._load() == {}
+
+
+def test_evict_names_forgets_every_entry_of_a_file(tmp_path, genai_client, index):
+    handle, _ = upload(genai_client, index, write_media(tmp_path, "a.mp4", b"v"))
+
+    index.evict_names([handle.name])
+
+    assert index._load() == {}
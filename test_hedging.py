@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+from hedging import MIN_SAMPLES, LatencyTracker, hedged_call
+
+
+def answer(text, after=0):
+    def call():
+        time.sleep(after)
+        return text
+
+    return call
+
+
+def fail(after=0):
+    def call():
+        time.sleep(after)
+        raise RuntimeError("failed")
+
+    return call
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    return LatencyTracker(os.path.join(tmp_path, "latency.json"))
+
+
+def test_fast_primary_is_not_hedged(tracker):
+    hedge_calls = []
+
+    label, result = hedged_call(
+        ("primary", answer("report")),
+        ("hedge", lambda: hedge_calls.append(1)),
+        deadline=1,
+        is_valid=bool,
+        tracker=tracker,
+    )
+
+    assert (label, result) == ("primary", "report")
+    assert hedge_calls == []
+    assert tracker.wins() == {"primary": {"hedged": 0, "unhedged": 1}}
+
+
+def test_slow_primary_still_counts_when_the_hedge_wins(tracker):
+    label, _ = hedged_call(
+        ("primary", answer("slow report", after=0.3)),
+        ("hedge", answer("fast report")),
+        deadline=0.05,
+        is_valid=bool,
+        tracker=tracker,
+    )
+    time.sleep(0.4)  # the abandoned primary finishes in the background
+
+    assert label == "hedge"
+    assert tracker.wins() == {"hedge": {"hedged": 1, "unhedged": 0}}
+    # Its latency is kept, so the deadline does not drift down
+    assert tracker._data["latencies"]["primary"][0] >= 0.3
+
+
+def test_failing_primary_hedges_right_away():
+    started = time.monotonic()
+
+    label, result = hedged_call(
+        ("primary", fail()), ("hedge", answer("report")), deadline=5, is_valid=bool
+    )
+
+    assert (label, result) == ("hedge", "report")
+    assert time.monotonic() - started < 1
+
+
+def test_first_error_is_raised_when_both_fail():
+    with pytest.raises(RuntimeError):
+        hedged_call(("primary", fail()), ("hedge", fail()), deadline=5, is_valid=bool)
+
+
+def test_deadline_is_the_latency_percentile(tracker):
+    for seconds in range(1, MIN_SAMPLES + 1):
+        tracker.record("primary", seconds)
+
+    assert tracker.deadline("primary", percentile=90) == MIN_SAMPLES
+    assert LatencyTracker(tracker.path).deadline("primary", 50) == MIN_SAMPLES // 2 + 1
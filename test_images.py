@@ -0,0 +1,46 @@
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from images import is_inline, item_digests, merge_uploaded, prepare_media
+
+
+def write_image(directory, name, color, size=(64, 48)):
+    path = os.path.join(directory, name)
+    Image.new("RGB", size, color).save(path)
+    return path
+
+
+def test_small_images_go_inline_and_videos_are_uploaded(tmp_path):
+    video = os.path.join(tmp_path, "walk.mp4")
+    open(video, "wb").close()
+    photo = write_image(tmp_path, "photo.png", "red")
+
+    items, upload_paths = prepare_media([photo, video], str(tmp_path / "images"))
+
+    assert is_inline(items[0]) and items[0].inline_data.mime_type == "image/jpeg"
+    assert items[1] == video and upload_paths == [video]
+    assert merge_uploaded(items, ["handle"])[1] == "handle"
+
+
+def test_same_stem_images_are_compacted_to_separate_files(tmp_path):
+    png = write_image(tmp_path, "photo.png", "red")
+    jpeg = write_image(tmp_path, "photo.jpeg", "blue")
+
+    items, upload_paths = prepare_media(
+        [png, jpeg], str(tmp_path / "images"), inline_limit=0
+    )
+
+    assert len(set(upload_paths)) == 2
+    digests = item_digests(items, lambda path: Path(path).read_bytes())
+    assert digests[0] != digests[1]
+
+
+def test_large_photos_are_downsized_upright(tmp_path):
+    photo = write_image(tmp_path, "big.jpg", "green", size=(4000, 3000))
+
+    items, _ = prepare_media([photo], str(tmp_path / "images"), inline_limit=0)
+
+    with Image.open(items[0]) as image:
+        assert max(image.size) == 1536
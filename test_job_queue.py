@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+from job_queue import JobQueue, WorkerPool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(os.path.join(tmp_path, "jobs.sqlite3"))
+
+
+def test_jobs_are_claimed_oldest_first_and_only_once(queue):
+    first = queue.submit({"n": 1})
+    second = queue.submit({"n": 2})
+
+    assert queue.claim("worker-a")["id"] == first
+    assert queue.claim("worker-b")["id"] == second
+    assert queue.claim("worker-c") is None
+    assert queue.counts() == {"running": 2}
+
+
+def test_update_merges_into_the_state(queue):
+    job_id = queue.submit({"n": 1}, {"stage": "queued", "kept": True})
+
+    queue.update(job_id, stage="uploading")
+    queue.update_spec(job_id, analyze=True)
+
+    job = queue.get(job_id)
+    assert job["state"] == {"stage": "uploading", "kept": True}
+    assert job["spec"] == {"n": 1, "analyze": True}
+
+
+def test_parked_job_waits_for_resume(queue):
+    job_id = queue.submit({"analyze": False})
+    queue.claim("worker")
+
+    queue.park(job_id)
+    assert queue.get(job_id)["status"] == "waiting"
+    assert queue.claim("worker") is None
+
+    queue.resume(job_id, analyze=True)
+    job = queue.claim("worker")
+    assert (job["id"], job["spec"]["analyze"]) == (job_id, True)
+
+
+def test_resume_while_running_requeues_at_park(queue):
+    job_id = queue.submit({})
+    queue.claim("worker")
+
+    queue.resume(job_id)
+    queue.park(job_id)
+
+    assert queue.get(job_id)["status"] == "queued"
+
+
+def test_cancel(queue):
+    running = queue.submit({})
+    queued = queue.submit({})
+    queue.claim("worker")  # the older job
+
+    queue.cancel(running)
+    queue.cancel(queued)
+
+    assert queue.get(running)["status"] == "running"  # stops at its next check
+    assert queue.cancel_requested(running)
+    assert queue.get(queued)["status"] == "cancelled"
+
+
+def test_stale_running_jobs_are_requeued(queue):
+    job_id = queue.submit({})
+    queue.claim("worker")
+
+    assert queue.requeue_stale(max_age=60) == 0
+    time.sleep(0.05)
+    assert queue.requeue_stale(max_age=0.01) == 1
+    assert queue.get(job_id)["status"] == "queued"
+
+
+def test_worker_pool_marks_failing_handlers_failed(queue):
+    def handler(job):
+        if job["spec"]["fail"]:
+            raise RuntimeError("broken")
+        queue.finish(job["id"], "done")
+
+    failing = queue.submit({"fail": True})
+    passing = queue.submit({"fail": False})
+    pool = WorkerPool(queue, handler, concurrency=2, poll_interval=0.01).start()
+    try:
+        deadline = time.monotonic() + 10
+        while queue.counts() != {"done": 1, "failed": 1}:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        pool.stop(timeout=5)
+
+    assert queue.get(failing)["error"] == "broken"
+    assert queue.get(passing)["status"] == "done"
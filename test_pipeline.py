@@ -0,0 +1,110 @@
+import io
+import os
+import time
+
+from analysis import FALLBACK_MODEL, HEDGE_MODEL, MODEL_NAME
+from file_cache import RemoteFileIndex
+from job_queue import JobQueue, WorkerPool
+from pipeline import PipelineJob, PipelineRunner, job_key, result_notices, submit_job
+from report_store import ReportStore
+from retry import AttemptEvent
+from spill import SpillDir
+
+
+class Upload(io.BytesIO):
+    """Stand-in for a Streamlit UploadedFile"""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.file_id = name
+        self.size = len(data)
+
+
+def wait_until_finished(queue, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in ("done", "failed", "cancelled"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+def run_jobs(tmp_path, runner, *uploads):
+    """Submit one job per upload, run them one after another and return them"""
+    spill_dir = SpillDir(os.path.join(tmp_path, "temp"))
+    pool = WorkerPool(runner.queue, runner, 1, 0.05).start()
+    jobs = []
+    try:
+        for upload in uploads:
+            path = spill_dir.spill(upload)
+            job_id = submit_job(
+                runner.queue,
+                spill_dir,
+                [path],
+                job_key([upload]),
+                "WO-1",
+                auto_analyze=True,
+            )
+            jobs.append(wait_until_finished(runner.queue, job_id))
+    finally:
+        pool.stop(timeout=5)
+    return jobs
+
+
+def test_retried_job_is_stored_and_reloaded(tmp_path, fake_server, genai_client):
+    queue = JobQueue(os.path.join(tmp_path, "jobs.sqlite3"))
+    store = ReportStore(os.path.join(tmp_path, "reports.sqlite3"))
+    fake_server.scripted_errors = {MODEL_NAME: [500]}
+
+    (job,) = run_jobs(
+        tmp_path,
+        PipelineRunner(genai_client, queue, report_store=store),
+        Upload("site.mp4", b"video" * 100),
+    )
+
+    assert (job["status"], job["state"]["stage"]) == ("done", "done")
+    assert PipelineJob(queue, job).media_count == 1
+    events = PipelineJob(queue, job).result["events"]
+    assert [(event.model, event.outcome) for event in events] == [
+        (MODEL_NAME, "server"),
+        (MODEL_NAME, "ok"),
+    ]
+    assert isinstance(events[0].error, str)
+    assert store.count() == 1
+
+
+def test_only_files_the_job_uploaded_are_cleaned_up(tmp_path, genai_client):
+    queue = JobQueue(os.path.join(tmp_path, "jobs.sqlite3"))
+    index = RemoteFileIndex(os.path.join(tmp_path, "remote.json"))
+    runner = PipelineRunner(genai_client, queue, remote_index=index)
+
+    first, second = run_jobs(
+        tmp_path,
+        runner,
+        Upload("site.mp4", b"video" * 100),
+        Upload("same.mp4", b"video" * 100),
+    )
+
+    assert len(PipelineJob(queue, first).remote_files()) == 1
+    # The second job reused the first one's file, which it must not delete
+    assert PipelineJob(queue, second).remote_files() == []
+
+
+def finished(model, *events):
+    return {"model": model, "cached": False, "events": list(events)}
+
+
+def test_notices_tell_a_fallback_from_a_hedge():
+    gave_up = AttemptEvent(MODEL_NAME, 0, "server", 1.0, "500", None)
+    answered = AttemptEvent(FALLBACK_MODEL, 0, "ok", 1.0, None, None)
+    hedged = AttemptEvent(HEDGE_MODEL, 0, "ok", 1.0, None, None)
+
+    assert result_notices(finished(FALLBACK_MODEL, gave_up, answered)) == [
+        ("info", f"✅ Analysis completed using fallback model ({FALLBACK_MODEL})")
+    ]
+    assert result_notices(finished(HEDGE_MODEL, hedged)) == [
+        ("info", f"🏁 The hedged request to {HEDGE_MODEL} answered first")
+    ]
+    assert result_notices(finished(MODEL_NAME)) == []
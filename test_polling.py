@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from polling import PollScheduler, estimate_processing_time
+from uploads import upload_files
+
+MB = 1024 * 1024
+
+
+def intervals(scheduler, key, checks):
+    """The gaps scheduled after ``checks`` unfinished checks of ``key``"""
+    gaps = []
+    for _ in range(checks):
+        scheduler.record(key, ready=False)
+        gaps.append(round(scheduler._pending[key]["interval"], 3))
+    return gaps
+
+
+def test_larger_videos_are_expected_to_take_longer():
+    small = estimate_processing_time(MB, "video/mp4")
+    large = estimate_processing_time(100 * MB, "video/mp4")
+
+    assert estimate_processing_time(MB, "image/jpeg") < small < large
+
+
+def test_first_check_does_not_wait_for_the_prediction():
+    scheduler = PollScheduler(jitter=0)
+    scheduler.add("walk.mp4", 100 * MB, "video/mp4")  # predicted to take 27s
+
+    assert scheduler.wait_time() <= 0.5
+
+
+def test_gaps_back_off_up_to_the_prediction():
+    scheduler = PollScheduler(min_interval=1, max_interval=60, backoff=2, jitter=0)
+    scheduler.add("clip.mp4", 4 * MB, "video/mp4")  # predicted to take 3s
+    scheduler.add("walk.mp4", 100 * MB, "video/mp4")
+
+    assert intervals(scheduler, "clip.mp4", 4) == [2, 3, 3, 3]
+    assert intervals(scheduler, "walk.mp4", 6) == [2, 4, 8, 16, 27, 27]
+
+
+def test_ready_files_stop_being_checked():
+    scheduler = PollScheduler()
+    scheduler.add("photo.jpg", MB, "image/jpeg")
+
+    scheduler.record("photo.jpg", ready=True)
+
+    assert not scheduler and scheduler.wait_time() is None
+    assert scheduler.poll_counts == {"photo.jpg": 1}
+
+
+def test_files_still_processing_after_the_deadline_time_out():
+    scheduler = PollScheduler(deadline=0.01)
+    scheduler.add("walk.mp4", MB, "video/mp4", label="walk.mp4")
+    time.sleep(0.02)
+
+    with pytest.raises(TimeoutError, match="walk.mp4 still processing"):
+        scheduler.record("walk.mp4", ready=False)
+
+
+def test_quickly_processed_upload_is_ready_quickly(tmp_path, fake_server, genai_client):
+    fake_server.processing_time = 0.2
+    video = tmp_path / "walk.mp4"
+    video.write_bytes(b"\0" * MB)
+    scheduler = PollScheduler()
+    started = time.monotonic()
+
+    upload_files(genai_client, [str(video)], scheduler=scheduler)
+
+    assert time.monotonic() - started < 1.5  # the prediction is over 2s
+    assert scheduler.poll_counts[0] <= 3
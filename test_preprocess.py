@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from preprocess import preprocess_media, preprocess_video, split_long_videos
+
+
+def write_video(directory, name, size=10_000):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def test_similar_names_do_not_share_outputs(tmp_path, fake_ffmpeg):
+    out_dir = str(tmp_path / "out")
+    kitchen = write_video(tmp_path, "kitchen.mp4")
+    kitchen_2 = write_video(tmp_path, "kitchen_2.mp4")
+    kitchen_mov = write_video(tmp_path, "kitchen.mov")
+
+    frames = preprocess_video(kitchen, "keyframes", out_dir)
+    frames_2 = preprocess_video(kitchen_2, "keyframes", out_dir)
+    transcoded = preprocess_video(kitchen_mov, "downscale", out_dir)
+
+    assert len(frames) == len(frames_2) == 3
+    assert not set(frames) & set(frames_2)
+    assert transcoded[0] not in frames
+    # Reused on the next run, without picking up the other file's frames
+    assert preprocess_video(kitchen, "keyframes", out_dir) == frames
+
+
+def test_failed_run_removes_only_its_own_outputs(tmp_path, fake_ffmpeg, monkeypatch):
+    out_dir = str(tmp_path / "out")
+    kept = preprocess_video(
+        write_video(tmp_path, "kitchen_2.mp4"), "keyframes", out_dir
+    )
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+
+    with pytest.raises(Exception):
+        preprocess_video(write_video(tmp_path, "kitchen.mp4"), "keyframes", out_dir)
+
+    assert all(os.path.exists(path) for path in kept)
+
+
+def test_images_pass_through_and_failures_keep_the_original(
+    tmp_path, fake_ffmpeg, monkeypatch
+):
+    video = write_video(tmp_path, "walk.mp4")
+    photo = write_video(tmp_path, "photo.jpg", 100)
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+
+    paths, stats = preprocess_media([video, photo], "downscale", str(tmp_path / "out"))
+
+    assert paths == [video, photo]
+    assert len(stats) == 1 and "error" in stats[0]
+
+
+def test_videos_with_the_same_name_keep_their_own_segments(
+    tmp_path, fake_ffmpeg, monkeypatch
+):
+    os.makedirs(tmp_path / "a")
+    os.makedirs(tmp_path / "b")
+    first = write_video(tmp_path / "a", "walk.mp4")
+    second = write_video(tmp_path / "b", "walk.mp4")
+    work_dir = str(tmp_path / "segments")
+    split_long_videos([first], 300, work_dir)
+    monkeypatch.setenv("FAKE_FFMPEG_SEGMENTS", "2")
+
+    paths, windows, errors = split_long_videos([first, second], 300, work_dir)
+
+    assert errors == []
+    assert [window["parts"] for window in windows] == [3, 3, 3, 2, 2]
+    assert len(set(paths)) == 5
@@ -0,0 +1,71 @@
+import time
+
+import httpx
+from google.genai import errors
+
+from rate_limit import RateLimiter, is_rate_limited, retry_after
+
+
+def api_error(code, status, details=None):
+    body = {"error": {"code": code, "status": status, "message": "failed"}}
+    if details:
+        body["error"]["details"] = details
+    error_class = errors.ClientError if code < 500 else errors.ServerError
+    return error_class(code, httpx.Response(code, json=body))
+
+
+def test_rate_limit_errors_are_typed_not_matched_by_text():
+    assert is_rate_limited(api_error(429, "RESOURCE_EXHAUSTED"))
+    assert not is_rate_limited(api_error(500, "INTERNAL"))
+    assert not is_rate_limited(ValueError("file name contains 429"))
+
+
+def test_retry_after_reads_the_retry_info():
+    error = api_error(
+        429,
+        "RESOURCE_EXHAUSTED",
+        [
+            {
+                "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                "retryDelay": "1.5s",
+            }
+        ],
+    )
+
+    assert retry_after(error) == 1.5
+
+
+def test_requests_beyond_the_budget_wait_for_the_bucket():
+    limiter = RateLimiter({"test": {"rpm": 600, "tpm": None}})  # one per 0.1s
+    limiter._buckets_for("test")[0].level = 1
+
+    started = time.monotonic()
+    for _ in range(3):
+        limiter.acquire("test")
+
+    assert 0.15 < time.monotonic() - started < 1
+
+
+def test_a_429_pauses_the_key():
+    limiter = RateLimiter({"test": {"rpm": 1000, "tpm": None}})
+    error = api_error(
+        429,
+        "RESOURCE_EXHAUSTED",
+        [
+            {
+                "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                "retryDelay": "0.2s",
+            }
+        ],
+    )
+
+    def fail():
+        raise error
+
+    try:
+        limiter.call("test", fail)
+    except errors.APIError:
+        pass
+    started = time.monotonic()
+    assert limiter.call("test", lambda: "ok") == "ok"
+    assert time.monotonic() - started >= 0.15
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from report_store import ReportStore
+
+WORK_ORDER = {
+    "success": True,
+    "work_order_number": "146106-02",
+    "entity_name": "Acme Stores",
+    "trades": ["Roofing"],
+}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ReportStore(os.path.join(tmp_path, "reports.sqlite3"))
+
+
+def test_search_by_words_work_order_and_trade(store):
+    leak = store.add(
+        "Water damage on the ceiling tiles",
+        WORK_ORDER,
+        model="gemini-2.5-pro",
+        report={"issue_type": "Leak", "recommended_trades": ["Roofing ", "roofing"]},
+    )
+    store.add("Cracked floor tile near the entrance", work_order="146107-01")
+
+    assert [r["id"] for r in store.search("ceil")] == [leak]
+    assert [r["id"] for r in store.search("acme")] == [leak]
+    assert [r["id"] for r in store.search(trade="ROOFING")] == [leak]
+    assert [r["id"] for r in store.search("tile", trade="roofing")] == [leak]
+    assert len(store.search("tile")) == 2
+    assert store.search(work_order="146107-01")[0]["entity"] is None
+    assert store.trade_counts() == {"roofing": 1}
+
+
+def test_free_form_reports_index_their_recommended_trades(store):
+    report_id = store.add(
+        "**ISSUE TYPE:** Leak\n\n**RECOMMENDED TRADES:**\n\n"
+        "- Roofing - the flashing is loose\n- Drywall, Painting\n\n"
+        "**REPAIR REQUIREMENTS:**\n\n1. Plumbing: check the drain"
+    )
+
+    assert [r["id"] for r in store.search(trade="painting")] == [report_id]
+    assert store.search(trade="plumbing") == []
+    assert store.trade_counts() == {"roofing": 1, "drywall": 1, "painting": 1}
+
+
+def test_search_is_newest_first_and_limited(store):
+    ids = [store.add(f"report {n}") for n in range(3)]
+
+    assert [r["id"] for r in store.search("report", limit=2)] == ids[:0:-1]
+
+
+def test_only_fresh_reports_of_the_model_and_work_order_are_reusable(store):
+    report_id = store.add("report", WORK_ORDER, model="pro", reuse_key="key")
+    store.add("degraded report", WORK_ORDER, model="pro")  # no reuse key
+
+    assert store.find_reusable("key", "pro", "146106-02")["id"] == report_id
+    assert store.find_reusable("key", "flash", "146106-02") is None
+    assert store.find_reusable("key", "pro") is None
+    assert store.find_reusable("other", "pro", "146106-02") is None
+    assert store.find_reusable("key", "pro", "146106-02", max_age=0) is None
@@ -0,0 +1,60 @@
+import os
+import time
+
+from result_cache import ResultCache, prompt_hash, result_key
+
+
+def cache_at(tmp_path, **options):
+    return ResultCache(os.path.join(tmp_path, "results.sqlite3"), **options)
+
+
+def test_key_depends_on_media_model_prompt_and_work_order():
+    key = result_key(["a"], "model", prompt_hash("prompt"))
+    work_order = {"success": True, "work_order_number": "1", "trades": []}
+
+    assert key == result_key(["a"], "model", prompt_hash("prompt"))
+    assert key != result_key(["b"], "model", prompt_hash("prompt"))
+    assert key != result_key(["a"], "other", prompt_hash("prompt"))
+    assert key != result_key(["a"], "model", prompt_hash("new prompt"))
+    assert key != result_key(["a"], "model", prompt_hash("prompt"), work_order)
+    assert key == result_key(["a"], "model", prompt_hash("prompt"), {"success": False})
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = cache_at(tmp_path)
+
+    assert cache.get("key") is None
+    cache.put("key", "report", "model")
+
+    assert cache.get("key") == {"text": "report", "model": "model"}
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "bytes": 6}
+
+
+def test_expired_results_are_not_returned(tmp_path):
+    cache = cache_at(tmp_path, ttl=0.05)
+    cache.put("key", "report")
+
+    time.sleep(0.1)
+
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = cache_at(tmp_path, max_entries=2)
+    cache.put("old", "report")
+    cache.put("used", "report")
+    cache.get("old")
+
+    cache.put("new", "report")
+
+    assert cache.get("used") is None
+    assert cache.get("old") and cache.get("new")
+
+
+def test_eviction_keeps_the_cache_under_max_bytes(tmp_path):
+    cache = cache_at(tmp_path, max_bytes=10)
+    cache.put("first", "x" * 6)
+    cache.put("second", "y" * 6)
+
+    assert cache.stats()["entries"] == 1
+    assert cache.get("second")
@@ -0,0 +1,99 @@
+import httpx
+import pytest
+from google.genai import errors
+
+from retry import (
+    EmptyResponseError,
+    RetryPolicy,
+    classify_error,
+    run_with_retries,
+)
+
+real_delay = RetryPolicy.delay  # conftest makes delays 0 for the other tests
+
+
+def api_error(error_class, code):
+    return error_class(code, httpx.Response(code, json={"error": {"code": code}}))
+
+
+@pytest.mark.parametrize(
+    "error, kind",
+    [
+        (EmptyResponseError(), "empty"),
+        (api_error(errors.ClientError, 429), "rate_limit"),
+        (api_error(errors.ServerError, 503), "server"),
+        (api_error(errors.ClientError, 400), "fatal"),
+        (httpx.ConnectError("refused"), "network"),
+        (ValueError("bad"), "fatal"),
+    ],
+)
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_delays_grow_up_to_the_cap():
+    policy = RetryPolicy(base_delay=2, max_delay=10, jitter=0)
+
+    assert [real_delay(policy, attempt, "server") for attempt in range(4)] == [
+        2,
+        4,
+        8,
+        10,
+    ]
+    assert real_delay(policy, 3, "rate_limit") == 0  # the rate limiter waits
+
+
+def test_next_delay_gives_up():
+    policy = RetryPolicy(max_attempts=3, max_elapsed=60)
+
+    assert policy.next_delay(0, "server", elapsed=0) == 0
+    assert policy.next_delay(2, "server", elapsed=0) is None  # out of attempts
+    assert policy.next_delay(0, "server", elapsed=61) is None  # out of time
+    assert policy.next_delay(0, "fatal", elapsed=0) is None
+
+
+def test_falls_back_after_the_primary_gives_up():
+    events = []
+
+    def call(model):
+        if model == "primary":
+            raise api_error(errors.ServerError, 500)
+        return model, "report"
+
+    result = run_with_retries(
+        call,
+        [("primary", RetryPolicy(max_attempts=2)), ("fallback", RetryPolicy())],
+        events.append,
+    )
+
+    assert result == ("fallback", "report")
+    assert [(e.model, e.outcome, e.delay) for e in events] == [
+        ("primary", "server", 0),
+        ("primary", "server", None),
+        ("fallback", "ok", None),
+    ]
+
+
+def test_fatal_error_is_raised_without_retrying():
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        raise api_error(errors.ClientError, 400)
+
+    with pytest.raises(errors.ClientError):
+        run_with_retries(
+            call, [("primary", RetryPolicy()), ("fallback", RetryPolicy())]
+        )
+    assert calls == ["primary"]
+
+
+def test_empty_answers_everywhere_raise_empty_response():
+    def call(model):
+        raise EmptyResponseError()
+
+    with pytest.raises(EmptyResponseError, match="primary and fallback"):
+        run_with_retries(
+            call,
+            [("primary", RetryPolicy(max_attempts=2)), ("fallback", RetryPolicy(1))],
+        )
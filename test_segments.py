@@ -0,0 +1,112 @@
+import os
+
+import pytest
+from google.genai import errors, types
+
+import segments
+from analysis import FALLBACK_MODEL, MODEL_NAME
+from pipeline import result_notices
+from report_store import ReportStore
+from segments import SEGMENT_RETRIES, analyze_segments
+
+PRIMARY_GIVES_UP = [500] * (SEGMENT_RETRIES + 1)
+
+
+def quiet(message):
+    pass
+
+
+def recording(parts=3):
+    media = [
+        types.Part.from_bytes(data=b"segment %d" % part, mime_type="video/mp4")
+        for part in range(parts)
+    ]
+    windows = [
+        {
+            "source": "walk.mp4",
+            "start": part * 300.0,
+            "end": (part + 1) * 300.0,
+            "part": part + 1,
+            "parts": parts,
+        }
+        for part in range(parts)
+    ]
+    return media, windows
+
+
+def test_failed_part_is_named_in_the_merged_report(tmp_path, fake_server, genai_client):
+    store = ReportStore(os.path.join(tmp_path, "reports.sqlite3"))
+    fake_server.scripted_errors = {
+        MODEL_NAME: list(PRIMARY_GIVES_UP),
+        FALLBACK_MODEL: [500],
+    }
+    media, windows = recording()
+    options = dict(
+        media_digests=["a", "b", "c"], report_store=store, log=quiet, max_workers=1
+    )
+
+    result = analyze_segments(genai_client, media, windows, **options)
+    # The partial report is recorded, but the recording is analyzed again
+    again = analyze_segments(genai_client, media, windows, **options)
+    reused = analyze_segments(genai_client, media, windows, **options)
+
+    assert result["model"] == MODEL_NAME
+    assert [segment["error"] is not None for segment in result["segments"]] == [
+        True,
+        False,
+        False,
+    ]
+    notices = result_notices(result)
+    assert notices[0] == ("info", "✂️ Merged the reports on 2 of 3 parts")
+    assert notices[-1][0] == "warning" and "walk.mp4, part 1/3" in notices[-1][1]
+    # The first part's fallback attempt is no reason to credit the fallback model
+    assert not any("fallback" in message for _, message in notices)
+    assert store.count() == 2
+    assert again["cached"] is False and not any(s["error"] for s in again["segments"])
+    assert (reused["cached"], reused["report_id"]) == (True, again["report_id"])
+
+
+def test_part_answered_by_the_fallback(fake_server, genai_client):
+    fake_server.scripted_errors = {MODEL_NAME: list(PRIMARY_GIVES_UP)}
+
+    result = analyze_segments(genai_client, *recording(), log=quiet, max_workers=1)
+
+    assert [segment["model"] for segment in result["segments"]] == [
+        FALLBACK_MODEL,
+        MODEL_NAME,
+        MODEL_NAME,
+    ]
+    assert ("info", "✅ 1 part(s) analyzed by the fallback model") in result_notices(
+        result
+    )
+
+
+def test_parts_are_listed_when_the_merge_fails(genai_client, monkeypatch):
+    analyze_media = segments.analyze_media
+
+    def merge_fails(client, files, *args, **kwargs):
+        if not files:
+            raise errors.ServerError(503, {"error": {"message": "overloaded"}})
+        return analyze_media(client, files, *args, **kwargs)
+
+    monkeypatch.setattr(segments, "analyze_media", merge_fails)
+
+    result = analyze_segments(genai_client, *recording(), log=quiet)
+
+    assert result["model"] == "segments"
+    assert result["text"].count("### walk.mp4, part") == 3
+    assert (
+        "warning",
+        "⚠️ Could not merge the part reports, listed per part",
+    ) in result_notices(result)
+    assert not any("hedged" in message for _, message in result_notices(result))
+
+
+def test_first_error_is_raised_when_every_part_fails(fake_server, genai_client):
+    fake_server.scripted_errors = {
+        MODEL_NAME: PRIMARY_GIVES_UP * 2,
+        FALLBACK_MODEL: [500] * 2,
+    }
+
+    with pytest.raises(errors.ServerError):
+        analyze_segments(genai_client, *recording(2), log=quiet, max_workers=1)
@@ -0,0 +1,81 @@
+import hashlib
+import io
+import os
+import time
+
+from spill import SpillDir, prune_session_dirs
+
+
+class Upload(io.BytesIO):
+    """Stand-in for a Streamlit UploadedFile that counts its reads"""
+
+    def __init__(self, name, data, file_id=None):
+        super().__init__(data)
+        self.name = name
+        self.file_id = file_id
+        self.size = len(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def test_file_is_written_in_chunks_and_hashed(tmp_path):
+    spill_dir = SpillDir(str(tmp_path))
+    data = os.urandom(10_000)
+    upload = Upload("walk.mp4", data, "id-1")
+
+    path = spill_dir.spill(upload, chunk_size=1024)
+
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert upload.reads == 11  # ten chunks and the empty read at the end
+    assert spill_dir.digest(path) == hashlib.sha256(data).hexdigest()
+
+
+def test_unchanged_upload_is_not_read_again(tmp_path):
+    spill_dir = SpillDir(str(tmp_path))
+    spill_dir.spill(Upload("walk.mp4", b"video", "id-1"))
+    rerun = Upload("walk.mp4", b"video", "id-1")
+
+    spill_dir.spill(rerun)
+
+    assert rerun.reads == 0
+
+
+def test_new_upload_with_the_same_content_is_not_written_again(tmp_path):
+    spill_dir = SpillDir(str(tmp_path))
+    path = spill_dir.spill(Upload("walk.mp4", b"video", "id-1"))
+    written = os.path.getmtime(path)
+    time.sleep(0.01)
+
+    spill_dir.spill(Upload("walk.mp4", b"video", "id-2"))
+    assert os.path.getmtime(path) == written
+
+    spill_dir.spill(Upload("walk.mp4", b"VIDEO", "id-3"))
+    assert os.path.getmtime(path) > written
+    with open(path, "rb") as f:
+        assert f.read() == b"VIDEO"
+
+
+def test_clear_removes_the_session_files(tmp_path):
+    spill_dir = SpillDir(str(tmp_path))
+    path = spill_dir.spill(Upload("walk.mp4", b"video"))
+    os.makedirs(os.path.join(spill_dir.path, "preprocessed"))
+
+    assert sorted(spill_dir.clear()) == ["preprocessed", "walk.mp4"]
+    assert not os.path.exists(path) and spill_dir.digest(path) is None
+
+
+def test_idle_session_directories_are_pruned(tmp_path):
+    old = SpillDir(str(tmp_path))
+    old.spill(Upload("walk.mp4", b"video"))
+    recent = SpillDir(str(tmp_path))
+    recent.spill(Upload("walk.mp4", b"video"))
+    day_ago = time.time() - 2 * 24 * 60 * 60
+    os.utime(old.path, (day_ago, day_ago))
+
+    prune_session_dirs(str(tmp_path))
+
+    assert not os.path.exists(old.path) and os.path.exists(recent.path)
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import tracing
+from tracing import Metrics, Trace, activate, current_trace, propagate, span
+
+
+@pytest.fixture(autouse=True)
+def metrics(monkeypatch):
+    metrics = Metrics(buckets=(0.1, 1))
+    monkeypatch.setattr(tracing, "metrics", metrics)
+    return metrics
+
+
+def test_spans_go_to_the_active_trace_and_the_metrics(metrics):
+    with activate(Trace()) as trace:
+        with span("upload", file="site.mp4") as attrs:
+            attrs["bytes"] = 500
+        with span("poll") as attrs:
+            attrs["outcome"] = "timeout"
+        with pytest.raises(ValueError):
+            with span("analysis", model=None):
+                raise ValueError("bad answer")
+    with span("upload"):
+        pass  # outside the job, counted in the metrics only
+
+    assert current_trace() is None
+    assert [(s["stage"], s["outcome"]) for s in trace.spans] == [
+        ("upload", "ok"),
+        ("poll", "timeout"),
+        ("analysis", "error"),
+    ]
+    assert trace.spans[0]["file"] == "site.mp4"
+    assert "model" not in trace.spans[2]
+    assert set(metrics.stage_totals()) == {"upload", "poll", "analysis"}
+    assert metrics.stage_totals()["upload"][0] == 2
+
+
+def test_timeline_keeps_the_latest_spans(monkeypatch):
+    monkeypatch.setattr(tracing, "MAX_TIMELINE_SPANS", 3)
+    trace = Trace(spans=[{"stage": "saved earlier"}], started=100.0)
+
+    for index in range(4):
+        trace.add("poll", 100.0 + index, 0.5, attempt=index)
+
+    assert [s["attempt"] for s in trace.spans] == [1, 2, 3]
+    assert trace.spans[-1]["start"] == 3.0
+
+
+def test_propagate_records_worker_threads_into_the_callers_trace():
+    def upload():
+        with span("upload"):
+            pass
+
+    with activate(Trace()) as trace:
+        worker = threading.Thread(target=propagate(upload))
+        worker.start()
+        worker.join()
+        unpropagated = threading.Thread(target=upload)
+        unpropagated.start()
+        unpropagated.join()
+
+    assert [s["stage"] for s in trace.spans] == ["upload"]
+
+
+def test_render_uses_the_prometheus_text_format(metrics):
+    metrics.inc("uploads_total", 2, help="Files uploaded", model='gemini "x"')
+    metrics.observe("stage_duration_seconds", 0.5, stage="poll", outcome="ok")
+    metrics.observe("stage_duration_seconds", 2, stage="poll", outcome="ok")
+
+    assert metrics.render().splitlines() == [
+        "# TYPE video_analytics_stage_duration_seconds histogram",
+        'video_analytics_stage_duration_seconds_bucket{outcome="ok",stage="poll",le="0.1"} 0',
+        'video_analytics_stage_duration_seconds_bucket{outcome="ok",stage="poll",le="1"} 1',
+        'video_analytics_stage_duration_seconds_bucket{outcome="ok",stage="poll",le="+Inf"} 2',
+        'video_analytics_stage_duration_seconds_sum{outcome="ok",stage="poll"} 2.5',
+        'video_analytics_stage_duration_seconds_count{outcome="ok",stage="poll"} 2',
+        "# HELP video_analytics_uploads_total Files uploaded",
+        "# TYPE video_analytics_uploads_total counter",
+        'video_analytics_uploads_total{model="gemini \\"x\\""} 2',
+    ]
+    assert metrics.stage_totals() == {"poll": (2, 2.5)}
@@ -0,0 +1,35 @@
+from uploads import upload_files
+
+
+def write_video(tmp_path, name="walk.mp4", size=4096):
+    path = tmp_path / name
+    path.write_bytes(b"\0" * size)
+    return str(path)
+
+
+def test_upload_waits_until_files_are_active(tmp_path, genai_client):
+    paths = [write_video(tmp_path, f"walk_{i}.mp4", 1000 + i) for i in range(3)]
+    progress = []
+
+    handles = upload_files(
+        genai_client, paths, on_progress=lambda i, path, state: progress.append(state)
+    )
+
+    assert [handle.state.value for handle in handles] == ["ACTIVE"] * 3
+    assert [handle.size_bytes for handle in handles] == [1000, 1001, 1002]
+    assert "PROCESSING" in progress
+
+
+def test_rate_limited_and_failed_file_requests_are_retried(
+    tmp_path, fake_server, genai_client
+):
+    fake_server.retry_delay = 0.1  # seconds the 429 asks to pause "files"
+    fake_server.scripted_errors = {"upload": [429, 500], "get_file": [500, 429]}
+
+    handles = upload_files(genai_client, [write_video(tmp_path)])
+
+    assert handles[0].state.value == "ACTIVE"
+    assert fake_server.requests["upload", 429] == 1
+    assert fake_server.requests["upload", 500] == 1
+    assert fake_server.requests["get_file", 500] == 1
+    assert fake_server.requests["get_file", 429] == 1
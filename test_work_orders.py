@@ -0,0 +1,96 @@
+import json
+
+import pytest
+import requests
+
+import work_orders
+from work_orders import WorkOrderClient
+
+
+class FakeSession:
+    """Answers work-order lookups from ``answers`` (number -> JSON or status)"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.queries = []
+
+    def get(self, url, params, timeout):
+        number = params["query"]
+        self.queries.append(number)
+        answer = self.answers[number]
+        response = requests.Response()
+        response.url = url
+        if isinstance(answer, int):
+            response.status_code = answer
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = json.dumps(answer).encode()
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(work_orders.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_client(answers, **options):
+    client = WorkOrderClient(**options)
+    client.session = FakeSession(answers)
+    return client
+
+
+VALID = {"valid": True, "work_order_number": "146106", "trades": ["HVAC"]}
+
+
+def test_valid_work_orders_are_cached_until_they_expire(clock):
+    client = make_client({"146106": VALID}, ttl=60)
+
+    assert client.get("146106")["trades"] == ["HVAC"]
+    assert client.get(" 146106 ")["work_order_number"] == "146106"
+    assert client.session.queries == ["146106"]
+
+    clock[0] += 61
+    assert client.get("146106")["success"]
+    assert client.session.queries == ["146106", "146106"]
+
+
+def test_invalid_answers_expire_sooner_and_errors_are_not_cached(clock):
+    client = make_client({"1": {"valid": False}, "2": 503}, negative_ttl=10)
+
+    assert client.get("1")["invalid"]
+    assert client.get("1")["invalid"]
+    assert not client.get("2")["success"]
+    assert not client.get("2")["success"]
+    assert client.session.queries == ["1", "2", "2"]
+
+    clock[0] += 11
+    client.get("1")
+    assert client.session.queries == ["1", "2", "2", "1"]
+
+
+def test_least_recently_used_work_order_is_dropped(clock):
+    client = make_client({n: VALID for n in "123"}, max_entries=2)
+
+    client.get("1")
+    client.get("2")
+    client.get("1")
+    client.get("3")  # drops 2, which was used least recently
+    client.get("1")
+    client.get("2")
+
+    assert client.session.queries == ["1", "2", "3", "2"]
+
+
+def test_get_many_looks_each_number_up_once(clock):
+    client = make_client({n: VALID for n in "123"})
+
+    infos = client.get_many(["1", "2", " 1", "3"])
+
+    assert sorted(infos) == ["1", "2", "3"]
+    assert sorted(client.session.queries) == ["1", "2", "3"]
+    client.invalidate("2")
+    client.get_many(["1", "2"])
+    assert sorted(client.session.queries) == ["1", "2", "2", "3"]
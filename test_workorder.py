@@ -0,0 +1,319 @@
+import asyncio
+import base64
+import hashlib
+import os
+
+import httpx
+import pytest
+
+import workorder
+from crawl_checkpoint import CrawlCheckpoint
+from workorder import Crawler
+
+
+@pytest.fixture(autouse=True)
+def save_dir(tmp_path, monkeypatch):
+    path = tmp_path / "files"
+    path.mkdir()
+    monkeypatch.setattr(workorder, "SAVE_DIR", str(path))
+    return path
+
+
+def files_api(files_per_workorder, requests=None):
+    """A GetFiles endpoint answering with file URLs, and the files behind them"""
+
+    async def handler(request):
+        if requests is not None:
+            requests.append(request)
+        await asyncio.sleep(0.001)  # let the other workers run, like a real server
+        if request.url.host == "files.test":
+            return httpx.Response(200, content=b"media " + request.url.path.encode())
+        wo = request.url.path.rsplit("/", 1)[-1]
+        files = [
+            {"FileUrl": f"https://files.test/{wo}/{index}.mp4"}
+            for index in range(files_per_workorder.get(wo, 0))
+        ]
+        return httpx.Response(200, json={"data": files})
+
+    return handler
+
+
+def crawl(tmp_path, handler, workorders, **options):
+    """Run a Crawler against ``handler(request)`` and return its checkpoint"""
+    checkpoint = CrawlCheckpoint(os.path.join(tmp_path, "crawl.sqlite3"))
+
+    async def run():
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await Crawler(client, checkpoint, **options).run(workorders)
+
+    asyncio.run(run())
+    return checkpoint
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(401),
+        httpx.Response(404),
+        httpx.Response(408),
+        httpx.Response(429),
+        httpx.Response(502),
+        httpx.Response(200),
+        httpx.Response(200, text="<html>gateway</html>"),
+    ],
+)
+def test_unusable_answers_are_retried_on_the_next_run(tmp_path, response):
+    checkpoint = crawl(
+        tmp_path, lambda request: response, ["146106"], metadata_requests=1
+    )
+
+    assert checkpoint.counts() == {"failed": 1}
+    assert checkpoint.finished() == set()
+
+
+def test_json_answer_without_files_is_done(tmp_path):
+    checkpoint = crawl(
+        tmp_path, lambda request: httpx.Response(200, json={"data": []}), ["146106"]
+    )
+
+    assert checkpoint.finished() == {"146106"}
+
+
+def test_crawl_stops_once_enough_work_orders_had_files(tmp_path, save_dir):
+    workorders = [str(146100 + n) for n in range(50)]
+    requests = []
+
+    checkpoint = crawl(
+        tmp_path,
+        files_api({wo: 2 for wo in workorders}, requests),
+        workorders,
+        max_with_files=3,
+        metadata_requests=4,
+    )
+
+    assert checkpoint.counts()["saved"] == 3
+    metadata_calls = [r for r in requests if r.url.host != "files.test"]
+    assert len(metadata_calls) < len(workorders)
+    # Every counted work order got all of its files, even the ones in flight
+    assert len(os.listdir(save_dir)) == 2 * checkpoint.counts()["saved"]
+
+
+def test_inline_content_is_decoded_a_slice_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(workorder, "BASE64_CHUNK_SIZE", 7)
+    data = os.urandom(1000)
+    encoded = base64.encodebytes(data).decode()  # with line breaks every 76 chars
+    path = str(tmp_path / "photo.jpg")
+
+    size, digest = workorder.write_base64(encoded, path)
+
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert (size, digest) == (len(data), hashlib.sha256(data).hexdigest())
+
+
+def download(handler, path, **options):
+    """Run download_file against ``handler(request)``"""
+
+    async def run():
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await workorder.download_file(
+                client, "https://files.test/walk.mp4", str(path), **options
+            )
+
+    return asyncio.run(run())
+
+
+def test_downloads_are_written_through_a_part_file(tmp_path):
+    data = os.urandom(8192)
+
+    size, digest = download(
+        lambda request: httpx.Response(200, content=data), tmp_path / "walk.mp4"
+    )
+
+    assert (size, digest) == (len(data), hashlib.sha256(data).hexdigest())
+    assert (tmp_path / "walk.mp4").read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["files", "walk.mp4"]
+
+
+def test_inline_and_linked_files_are_saved(tmp_path, save_dir):
+    def handler(request):
+        if request.url.host == "files.test":
+            return httpx.Response(200, content=b"video")
+        return httpx.Response(
+            200,
+            json=[
+                {"FileUrl": "https://files.test/walk.mp4"},
+                {"FileContent": base64.b64encode(b"photo").decode()},
+                {"Comment": "no file"},
+            ],
+        )
+
+    checkpoint = crawl(tmp_path, handler, ["146106"])
+
+    assert checkpoint.counts() == {"saved": 1}
+    assert sorted(os.listdir(save_dir)) == ["146106_0.mp4", "146106_1.bin"]
+    assert (save_dir / "146106_1.bin").read_bytes() == b"photo"
+
+
+def test_rerun_only_retries_what_failed(tmp_path):
+    handler = files_api({"1": 2, "2": 1})
+
+    async def flaky(request):
+        if request.url.path.endswith("/2") or request.url.path == "/1/1.mp4":
+            return httpx.Response(503)
+        return await handler(request)
+
+    first = crawl(tmp_path, flaky, ["1", "2", "3"])
+    assert first.counts() == {"failed": 2, "no_files": 1}
+
+    requests = []
+    second = crawl(tmp_path, files_api({"1": 2, "2": 1}, requests), ["1", "2", "3"])
+
+    assert second.counts() == {"saved": 2, "no_files": 1}
+    assert sorted(request.url.path for request in requests) == [
+        "/1/1.mp4",
+        "/2/0.mp4",
+        "/blackstone-new-backend/api/WorkOrders/GetFiles/1",
+        "/blackstone-new-backend/api/WorkOrders/GetFiles/2",
+    ]
+
+
+def test_work_orders_saved_earlier_count_towards_the_target(tmp_path, save_dir):
+    workorders = [str(wo) for wo in range(10)]
+    handler = files_api({wo: 1 for wo in workorders})
+
+    crawl(tmp_path, handler, workorders, max_with_files=2, metadata_requests=1)
+    checkpoint = crawl(
+        tmp_path, handler, workorders, max_with_files=3, metadata_requests=1
+    )
+
+    assert checkpoint.counts() == {"saved": 3}
+    assert len(os.listdir(save_dir)) == 3
+
+
+class RangeServer:
+    """Serves ``data`` with Range support, cutting off the first ``cut`` responses"""
+
+    def __init__(self, data, etag='"v1"', cut=0):
+        self.data = data
+        self.etag = etag
+        self.cut = cut
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        offset = 0
+        headers = {"ETag": self.etag}
+        status = 200
+        range_header = request.headers.get("Range")
+        if range_header and request.headers.get("If-Range", self.etag) == self.etag:
+            offset = int(range_header.split("=")[1].rstrip("-"))
+            if offset >= len(self.data):
+                return httpx.Response(416)
+            status = 206
+            headers["Content-Range"] = (
+                f"bytes {offset}-{len(self.data) - 1}/{len(self.data)}"
+            )
+        body = self.data[offset:]
+        headers["Content-Length"] = str(len(body))
+        if self.cut:
+            self.cut -= 1
+            body = body[: len(body) // 2]
+        return httpx.Response(status, headers=headers, content=body)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(workorder.asyncio, "sleep", sleep)
+    return delays
+
+
+def test_interrupted_download_resumes_with_range(tmp_path, sleeps):
+    data = os.urandom(1000)
+    server = RangeServer(data, cut=2)
+
+    size, digest = download(server, tmp_path / "walk.mp4")
+
+    assert (tmp_path / "walk.mp4").read_bytes() == data
+    assert (size, digest) == (len(data), hashlib.sha256(data).hexdigest())
+    assert [request.headers.get("Range") for request in server.requests] == [
+        None,
+        "bytes=500-",
+        "bytes=750-",
+    ]
+    assert server.requests[1].headers["If-Range"] == '"v1"'
+    assert sleeps == [1, 2]
+    assert sorted(os.listdir(tmp_path)) == ["files", "walk.mp4"]
+
+
+def test_partial_download_is_kept_for_the_next_run(tmp_path, sleeps):
+    data = os.urandom(1000)
+    server = RangeServer(data, cut=workorder.DOWNLOAD_ATTEMPTS)
+
+    with pytest.raises(workorder.IncompleteDownload):
+        download(server, tmp_path / "walk.mp4")
+    assert os.path.getsize(tmp_path / "walk.mp4.part") < len(data)
+
+    download(server, tmp_path / "walk.mp4")
+    assert (tmp_path / "walk.mp4").read_bytes() == data
+
+
+def test_changed_file_is_downloaded_from_the_start(tmp_path, sleeps):
+    (tmp_path / "walk.mp4.part").write_bytes(b"old bytes")
+    (tmp_path / "walk.mp4.part.validator").write_text('"v0"')
+    server = RangeServer(b"new video")
+
+    download(server, tmp_path / "walk.mp4")
+
+    assert server.requests[0].headers["If-Range"] == '"v0"'
+    assert (tmp_path / "walk.mp4").read_bytes() == b"new video"
+
+
+def test_part_file_past_the_end_is_discarded(tmp_path, sleeps):
+    (tmp_path / "walk.mp4.part").write_bytes(b"longer than the file")
+    (tmp_path / "walk.mp4.part.validator").write_text('"v1"')
+    server = RangeServer(b"short")
+
+    download(server, tmp_path / "walk.mp4")
+
+    assert [request.headers.get("Range") for request in server.requests] == [
+        "bytes=20-",
+        None,
+    ]
+    assert (tmp_path / "walk.mp4").read_bytes() == b"short"
+
+
+def test_resume_at_the_wrong_offset_is_rejected(tmp_path, sleeps, monkeypatch):
+    monkeypatch.setattr(workorder, "DOWNLOAD_ATTEMPTS", 1)
+    (tmp_path / "walk.mp4.part").write_bytes(b"vid")
+
+    def handler(request):
+        headers = {"Content-Range": "bytes 0-4/5"}
+        return httpx.Response(206, headers=headers, content=b"video")
+
+    with pytest.raises(workorder.IncompleteDownload):
+        download(handler, tmp_path / "walk.mp4")
+    assert not os.path.exists(tmp_path / "walk.mp4")
+
+
+@pytest.mark.parametrize(
+    "headers, options",
+    [
+        ({"Content-MD5": base64.b64encode(b"0" * 16).decode()}, {}),
+        ({}, {"expected_sha256": "0" * 64}),
+    ],
+)
+def test_corrupt_download_is_discarded(tmp_path, headers, options):
+    def handler(request):
+        return httpx.Response(200, headers=headers, content=b"video")
+
+    with pytest.raises(ValueError):
+        download(handler, tmp_path / "walk.mp4", **options)
+    assert sorted(os.listdir(tmp_path)) == ["files"]
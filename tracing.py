@@ -0,0 +1,252 @@
+"""Stage timings of every job, as Prometheus metrics and per-job timelines.
+
+Saving, preprocessing, uploading, readiness polling, work-order lookups and
+each model attempt are timed as spans. Every span is counted in the
+process-wide ``metrics`` and appended to the timeline of the job it ran
+for (see activate), so a slow job shows where its time went. With
+``METRICS_PORT`` set the app and worker.py serve the metrics for scraping:
+
+    METRICS_PORT=9464 streamlit run video_processing.py
+    curl localhost:9464/metrics
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 serves no metrics
+METRIC_PREFIX = "video_analytics"
+# Histogram buckets in seconds, from cached lookups up to long video analyses
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+MAX_TIMELINE_SPANS = 500  # spans kept per job, the oldest are dropped first
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Metric names get METRIC_PREFIX; labels are passed as keyword arguments.
+    Safe to share between threads.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, help=None, **labels):
+        """Add ``amount`` to a counter"""
+        with self._lock:
+            self._help.setdefault(name, (help, "counter"))
+            self._counters[name, _label_key(labels)] += amount
+
+    def observe(self, name, value, help=None, **labels):
+        """Record one value in a histogram"""
+        with self._lock:
+            self._help.setdefault(name, (help, "histogram"))
+            entry = self._histograms.setdefault(
+                (name, _label_key(labels)), [[0] * len(self.buckets), 0.0, 0]
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def stage_totals(self):
+        """Number of spans and seconds spent per stage, over all outcomes"""
+        totals = defaultdict(lambda: [0, 0.0])
+        with self._lock:
+            for (name, labels), (_, total, count) in self._histograms.items():
+                if name == "stage_duration_seconds":
+                    stage = dict(labels)["stage"]
+                    totals[stage][0] += count
+                    totals[stage][1] += total
+        return {stage: tuple(values) for stage, values in totals.items()}
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, (help, kind) in sorted(self._help.items()):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                if help:
+                    lines.append(f"# HELP {full_name} {help}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                if kind == "counter":
+                    for (key, labels), value in sorted(self._counters.items()):
+                        if key == name:
+                            lines.append(f"{full_name}{_format(labels)} {value:g}")
+                    continue
+                for (key, labels), entry in sorted(self._histograms.items()):
+                    if key != name:
+                        continue
+                    counts, total, count = entry
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        bucket = labels + (("le", f"{bound:g}"),)
+                        lines.append(
+                            f"{full_name}_bucket{_format(bucket)} {bucket_count}"
+                        )
+                    bucket = labels + (("le", "+Inf"),)
+                    lines.append(f"{full_name}_bucket{_format(bucket)} {count}")
+                    lines.append(f"{full_name}_sum{_format(labels)} {total:g}")
+                    lines.append(f"{full_name}_count{_format(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+# Shared by everything running in this process
+metrics = Metrics()
+
+
+class Trace:
+    """Timeline of one job: its spans in the order they finished.
+
+    Each span is a dict with the ``stage``, its ``start`` in seconds after the
+    job was submitted, its ``duration``, ``outcome`` and whatever attributes
+    the stage recorded (bytes, file, model, attempt, tokens...). A job that is
+    picked up again continues the timeline it saved (see ``spans``).
+    """
+
+    def __init__(self, spans=None, started=None):
+        self.started = started or time.time()
+        self._spans = list(spans or [])
+        self._lock = threading.Lock()
+
+    @property
+    def spans(self):
+        """A copy of the spans so far, JSON serializable"""
+        with self._lock:
+            return list(self._spans)
+
+    def add(self, stage, started, duration, outcome="ok", **attrs):
+        """Append a span that began at Unix time ``started``"""
+        span = {
+            "stage": stage,
+            "start": round(started - self.started, 3),
+            "duration": round(duration, 3),
+            "outcome": outcome,
+        }
+        span.update((key, value) for key, value in attrs.items() if value is not None)
+        with self._lock:
+            self._spans.append(span)
+            del self._spans[:-MAX_TIMELINE_SPANS]
+
+
+@contextmanager
+def activate(trace):
+    """Record the spans of the current thread (and context) into ``trace``"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    """The Trace spans are recorded into right now, or None"""
+    return _current_trace.get()
+
+
+def record_span(stage, duration, outcome="ok", **attrs):
+    """Record a stage that just finished after ``duration`` seconds.
+
+    The duration goes into the ``stage_duration_seconds`` histogram and a
+    ``bytes`` attribute into ``stage_bytes_total``; the whole span into the
+    active Trace, if any.
+    """
+    metrics.observe(
+        "stage_duration_seconds",
+        duration,
+        help="Seconds spent per pipeline stage",
+        stage=stage,
+        outcome=outcome,
+    )
+    if attrs.get("bytes"):
+        metrics.inc(
+            "stage_bytes_total",
+            attrs["bytes"],
+            help="Bytes handled per pipeline stage",
+            stage=stage,
+        )
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, time.time() - duration, duration, outcome, **attrs)
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time the enclosed block as a stage; yields a dict for more attributes.
+
+    Set ``outcome`` in the dict to report something other than "ok"; an
+    exception is recorded as "error" and raised again.
+    """
+    started = time.monotonic()
+    outcome = "ok"
+    try:
+        yield attrs
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        requested = attrs.pop("outcome", None)
+        if outcome == "ok" and requested:
+            outcome = requested
+        record_span(stage, time.monotonic() - started, outcome, **attrs)
+
+
+def propagate(function):
+    """Wrap ``function`` to record into the caller's Trace, for worker threads"""
+    trace = _current_trace.get()
+
+    def run(*args, **kwargs):
+        with activate(trace):
+            return function(*args, **kwargs)
+
+    return run
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Serve ``metrics`` at /metrics from a daemon thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
@@ -0,0 +1,169 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from file_cache import content_key
+from polling import PollScheduler
+from rate_limit import limiter
+from retry import RetryPolicy, run_with_retries
+from tracing import metrics, propagate, record_span, span
+
+MAX_UPLOAD_WORKERS = 4  # parallel uploads to the Google AI file API
+# Uploads and readiness checks failing on a 429, a server or a network error
+FILE_API_RETRIES = RetryPolicy(
+    max_attempts=5, base_delay=1, max_delay=15, max_elapsed=120
+)
+
+
+def state_name(state):
+    """Return a file state as a plain string (e.g. "PROCESSING")"""
+    return getattr(state, "value", state) or "UNKNOWN"
+
+
+def call_file_api(fn, policy=FILE_API_RETRIES):
+    """Run a file API request within the "files" rate limit, retrying on failure.
+
+    A 429 pauses the key for the server's retry hint (see RateLimiter.call)
+    and is retried once the pause is over; server and network errors are
+    retried with backoff. Other errors are raised at once.
+    """
+
+    def on_event(event):
+        if event.outcome != "ok":
+            metrics.inc(
+                "file_api_errors_total",
+                help="Failed file API requests by error kind",
+                kind=event.outcome,
+            )
+
+    _, result = run_with_retries(
+        lambda key: (key, limiter.call(key, fn)), [("files", policy)], on_event
+    )
+    return result
+
+
+def upload_files(
+    client,
+    file_paths,
+    max_workers=MAX_UPLOAD_WORKERS,
+    on_progress=None,
+    scheduler=None,
+    remote_index=None,
+    digests=None,
+):
+    """Upload files concurrently and wait until every one of them is ready.
+
+    All uploads start at once on a bounded worker pool and the files that are
+    still PROCESSING are polled together, so wall time follows the slowest file
+    instead of the sum. Handles are returned in the order of ``file_paths``.
+
+    ``on_progress(index, file_path, state)`` is called from the calling thread
+    whenever a file changes state, so it may safely update Streamlit elements.
+    Readiness checks are timed by ``scheduler`` (a fresh ``PollScheduler`` by
+    default); its ``poll_counts`` are keyed by the index into ``file_paths``.
+
+    With a ``RemoteFileIndex`` as ``remote_index``, files whose content was
+    uploaded before and is still ACTIVE are reused instead of uploaded again
+    (reported as "REUSED"). ``digests`` may carry the already known SHA-256
+    hex digests of the files so they are not hashed a second time.
+    """
+    scheduler = scheduler if scheduler is not None else PollScheduler()
+    handles = [None] * len(file_paths)
+    states = ["UPLOADING"] * len(file_paths)
+    keys = [None] * len(file_paths)
+    if not file_paths:
+        return handles
+
+    processing_since = {}  # index -> monotonic time the file was seen PROCESSING
+
+    def upload(index):
+        path = file_paths[index]
+        with span("upload", file=os.path.basename(path)) as attrs:
+            if remote_index is not None:
+                keys[index] = content_key(path, digests[index] if digests else None)
+                remote = remote_index.lookup(client, keys[index])
+                if remote is not None:
+                    attrs["outcome"] = "reused"
+                    return remote, True
+            attrs["bytes"] = os.path.getsize(path)
+            handle = call_file_api(lambda: client.files.upload(file=path))
+            return handle, False
+
+    def settle(index, handle):
+        handles[index] = handle
+        state = state_name(handle.state)
+        if state == "PROCESSING":
+            processing_since.setdefault(index, time.monotonic())
+        elif index in processing_since:
+            # Time the file API spent making the upload usable
+            record_span(
+                "processing",
+                time.monotonic() - processing_since.pop(index),
+                "ok" if state == "ACTIVE" else state.lower(),
+                file=os.path.basename(file_paths[index]),
+                polls=scheduler.poll_counts.get(index, 0) + 1,  # counting this one
+            )
+        if on_progress and state != states[index]:
+            on_progress(index, file_paths[index], state)
+        states[index] = state
+        if state == "FAILED":
+            if keys[index]:
+                remote_index.evict(keys[index])
+            raise ValueError(f"{os.path.basename(file_paths[index])}: {state}")
+        if state == "ACTIVE" and keys[index]:
+            remote_index.store(keys[index], handle)
+        return state == "PROCESSING"
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(file_paths)))
+    try:
+        uploading = {
+            executor.submit(propagate(upload), index): index
+            for index in range(len(file_paths))
+        }
+        if on_progress:
+            for index, path in enumerate(file_paths):
+                on_progress(index, path, "UPLOADING")
+
+        pending_uploads = set(uploading)
+        while pending_uploads or scheduler:
+            timeout = scheduler.wait_time()
+            if pending_uploads:
+                done, pending_uploads = wait(
+                    pending_uploads, timeout=timeout, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    index = uploading[future]
+                    handle, reused = future.result()
+                    if reused:
+                        states[index] = "REUSED"
+                        if on_progress:
+                            on_progress(index, file_paths[index], "REUSED")
+                    if settle(index, handle):
+                        scheduler.add(
+                            index,
+                            handle.size_bytes,
+                            handle.mime_type,
+                            label=os.path.basename(file_paths[index]),
+                        )
+            else:
+                time.sleep(timeout)
+
+            due = scheduler.due()
+            if due:
+                metrics.inc(
+                    "file_polls_total",
+                    len(due),
+                    help="Readiness checks of uploaded files still PROCESSING",
+                )
+            refreshed = executor.map(
+                lambda index: call_file_api(
+                    lambda: client.files.get(name=handles[index].name)
+                ),
+                due,
+            )
+            for index, handle in zip(due, refreshed):
+                scheduler.record(index, ready=not settle(index, handle))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return handles
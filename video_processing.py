@@ -1,11 +1,29 @@
 import streamlit as st
 import os
-from google import genai
-from google.genai import types
+import json
+import shutil
 import time
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from google import genai
+from concurrent.futures import ThreadPoolExecutor
+from analysis import FALLBACK_MODEL, HEDGE_MODEL, MODEL_NAME
+from file_cache import RemoteFileIndex
+from job_queue import JOB_WORKERS, JobQueue, WorkerPool
+from pipeline import (
+    FINISHED_STAGES,
+    PREPARING_STAGES,
+    PipelineJob,
+    PipelineRunner,
+    job_key,
+    result_notices,
+    submit_job,
+)
+from preprocess import PREPROCESS_MODES, SEGMENT_SECONDS, ffmpeg_available
+from rate_limit import limiter
+from report_store import ReportStore
+from result_cache import ResultCache
+from spill import SpillDir
+from tracing import METRICS_PORT, Trace, activate, start_metrics_server
+from work_orders import fetch_work_order_info
 
 # Set page config
 st.set_page_config(
@@ -25,517 +43,285 @@ if not GOOGLE_API_KEY:
         st.stop()
 
 client = genai.Client(api_key=GOOGLE_API_KEY)
-# model_name = "gemini-2.0-flash-exp"
-model_name = "gemini-2.5-pro"
-fallback_model = "gemini-2.5-flash"  # Fallback model for when primary fails
-
-
-def get_with_retries(url, params=None, retries=3, backoff_factor=0.5):
-    """Make HTTP requests with retry logic"""
-    session = requests.Session()
-    retry = Retry(
-        total=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET", "POST"],
+model_name = MODEL_NAME
+fallback_model = FALLBACK_MODEL  # Fallback model for when primary fails
+# Remembers uploaded files by content so identical media is not uploaded twice
+remote_file_index = RemoteFileIndex()
+# Finished reports keyed by media, model, prompts and work order
+result_cache = ResultCache()
+# Every finished report, indexed by work order, date and recommended trade
+report_store = ReportStore()
+# Work-order lookups started as soon as a number is typed
+lookup_executor = ThreadPoolExecutor(max_workers=4)
+# Uploads and analyses, kept on disk so they survive reruns, refreshes and restarts
+job_queue = JobQueue()
+
+
+@st.cache_resource
+def start_workers():
+    """Work on queued jobs in this server process (none with JOB_WORKERS=0)"""
+    runner = PipelineRunner(
+        client,
+        job_queue,
+        remote_index=remote_file_index,
+        result_cache=result_cache,
+        report_store=report_store,
     )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
+    return WorkerPool(job_queue, runner, concurrency=JOB_WORKERS).start()
 
-    resp = session.get(url, params=params, timeout=10)
-    resp.raise_for_status()
-    return resp
-
-
-def fetch_work_order_info(work_order_number):
-    """Fetch work order information from the API"""
-    url = "https://proposal-backend-uat.onengine.io/commserve/confirm-work-order-number"
-    params = {"query": work_order_number}
 
+@st.cache_resource
+def start_metrics():
+    """Serve stage metrics at /metrics on METRICS_PORT, if one is set"""
+    if not METRICS_PORT:
+        return None
     try:
-        response = get_with_retries(url, params=params)
-        data = response.json()
-
-        if data.get("valid"):
-            return {
-                "success": True,
-                "work_order_number": data.get("work_order_number"),
-                "client_description": data.get("client_description"),
-                "entity_name": data.get("entity_name"),
-                "trades": data.get("trades", []),
-            }
-        else:
-            return {"success": False, "error": "Invalid work order number"}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
-
-
-def upload_file(file_path):
-    """Upload a video or image file to Google AI"""
-    uploaded_file = client.files.upload(file=file_path)
-    with st.spinner("Uploading file..."):
-        while uploaded_file.state == "PROCESSING":
-            time.sleep(10)
-            uploaded_file = client.files.get(name=uploaded_file.name)
-        if uploaded_file.state == "FAILED":
-            raise ValueError(uploaded_file.state)
-    st.success(f"Uploaded {os.path.basename(file_path)}!")
-    return uploaded_file
-
-
-# BACKUP PROMPTS (Original working prompts)
-BACKUP_USER_PROMPT = """Analyze the provided video(s) and/or image(s) to identify any household issues such as broken/leaking faucets, cracked doors, damp walls, damaged tiles, electrical issues, structural problems, etc. 
-
-If multiple files are provided, correlate information across all media to provide a comprehensive assessment. Generate a structured technical report using the following format:
-
-ISSUE TYPE:
-[Single line description of the primary issue(s) identified]
-
-LOCATION:
-[Specific location details based on visual evidence from videos/images]
+        return start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        print(f"⚠️ Not serving metrics on port {METRICS_PORT}: {e}")
+        return None
 
-DETAILED ASSESSMENT:
-[Thorough description of the damage/issue based on analysis of all provided media]
 
-PHYSICAL CHARACTERISTICS:
-- [Bullet points describing measurable/observable features from videos and images]
-- [Include dimensions, patterns, extent of damage where visible]
-- [Note any progression or variation visible across different media]
-
-TECHNICAL IMPLICATIONS:
-- [List of structural/functional impacts]
-- [Safety concerns]
-- [Security implications]
-- [Environmental effects]
+UPLOAD_STATUS_ICONS = {
+    "UPLOADING": "📤",
+    "REUSED": "♻️",
+    "INLINE": "🖼️",
+    "PROCESSING": "⏳",
+    "ACTIVE": "✅",
+    "FAILED": "❌",
+}
+READY_STATES = ("REUSED", "INLINE", "ACTIVE")
+
+STAGE_LABELS = {
+    "queued": "🕒 Waiting for a free worker...",
+    "preprocessing": "🎞️ Preprocessing videos...",
+    "splitting": "✂️ Splitting long videos...",
+    "uploading": "📤 Uploading files to AI...",
+    "ready": "✅ Files uploaded and ready for analysis",
+    "analyzing": f"🔍 Analyzing files using {MODEL_NAME}...",
+    "done": "🎉 Analysis completed",
+    "cancelled": "⏹️ Cancelled",
+}
+
+
+def get_spill_dir():
+    """Return this session's temp directory for uploaded media"""
+    if "spill_dir" not in st.session_state:
+        st.session_state.spill_dir = SpillDir()
+    return st.session_state.spill_dir
+
+
+def prefetch_work_order(work_order_number, refresh=False):
+    """Look up a work order in the background; returns the lookup's future"""
+    lookups = st.session_state.setdefault("work_order_lookups", {})
+    if refresh or work_order_number not in lookups:
+        lookups[work_order_number] = lookup_executor.submit(
+            fetch_work_order_info, work_order_number
+        )
+    return lookups[work_order_number]
 
-REPAIR REQUIREMENTS:
-1. [Prioritized list of necessary repairs]
-2. [Include safety measures required]
-3. [Special considerations for repair work]
 
-DOCUMENTATION NOTES:
-- [Additional relevant observations from video/image analysis]
-- [Areas needing further inspection]
-- [Correlation between different media if multiple files provided]
-"""
-
-BACKUP_SYSTEM_PROMPT = """You are a professional property inspection assistant specializing in technical documentation. Your role is to analyze video and image content showing household issues and produce structured technical reports. You will receive one or more media files (videos and/or images) and must analyze all provided content comprehensively.
-
-Follow these key principles:
-
-1. MULTI-MEDIA ANALYSIS:
-- Analyze all provided videos and images thoroughly
-- Correlate information across different media types
-- Use static images for detailed visual assessment
-- Use video content for understanding motion, flow, or progressive damage
-- Synthesize findings from all sources into a unified report
-
-2. DOCUMENTATION STYLE:
-- Maintain strictly professional and technical language
-- Never use conversational phrases or first-person language
-- Exclude greetings, introductions, and concluding remarks
-- Avoid hedging words like "seems," "appears," or "might"
-
-3. REPORT STRUCTURE:
-- Use consistent hierarchical formatting
-- Present information in clearly defined sections
-- Employ bullet points for discrete observations
-- Use numbered lists only for sequential procedures
-
-4. TECHNICAL DETAILS:
-- Prioritize measurable and observable characteristics
-- Include specific measurements when visible
-- Document patterns and extent of damage precisely
-- Note spatial relationships and orientations
-- Reference specific media when making observations
-
-5. SAFETY AND COMPLIANCE:
-- Always highlight immediate safety concerns
-- Include relevant safety procedures for repairs
-- Note potential code violations or compliance issues
-- Document security implications
-
-6. COMMUNICATION STANDARDS:
-- Use industry-standard terminology
-- Maintain objective, fact-based descriptions
-- Exclude subjective assessments
-- Omit speculative content
-
-7. FOCUS AREAS:
-- Structural elements
-- Mechanical systems
-- Electrical components
-- Plumbing systems
-- Environmental conditions
-- Safety hazards
-- Security vulnerabilities
-
-FORMAT ALL OBSERVATIONS USING THE PRESCRIBED TEMPLATE STRUCTURE IN THE USER PROMPT."""
-
-
-def process_media_files(
-    uploaded_files, work_order_info=None, retry_count=0, max_retries=5
+def get_pipeline_job(
+    uploaded_files,
+    work_order_number,
+    preprocess_mode,
+    auto_analyze,
+    segment_seconds=0,
 ):
-    """Process both video and image files for household issue analysis with retry logic"""
-
-    # Build context from work order if available
-    work_order_context = ""
-    if work_order_info and work_order_info.get("success"):
-        client_desc = work_order_info.get("client_description", "")
-        trades = work_order_info.get("trades", [])
-        work_order_num = work_order_info.get("work_order_number", "")
-
-        work_order_context = f"""
-WORK ORDER CONTEXT:
-- Work Order Number: {work_order_num}
-- Client Description: {client_desc}
-- Relevant Trades: {', '.join(trades[:10])}{'...' if len(trades) > 10 else ''}
-"""
-
-    USER_PROMPT = f"""Analyze the provided video(s) and/or image(s) to identify any household issues such as broken/leaking faucets, cracked doors, damp walls, damaged tiles, electrical issues, structural problems, etc. 
-
-{work_order_context}
-
-If multiple files are provided, correlate information across all media to provide a comprehensive assessment. When work order context is provided, validate your findings against the client description and focus on trades relevant to the identified issues.
-
-IMPORTANT: For technical measurements, only provide estimates when you can identify clear scale references in the media (such as standard doors ~80", electrical outlets ~4.5", floor tiles, fixtures, etc.). State your reference method and confidence level. Avoid speculative measurements without visual reference points.
-
-For the General Description section, use terminology that US service providers, contractors, and maintenance professionals would recognize on work orders and service tickets. Examples:
-- "Leaking faucet cartridge needs replacement" (not just "water leak")
-- "HVAC ductwork has loose joints requiring sealing" (not just "air loss")  
-- "Drywall patch and paint needed for wall damage" (not just "wall repair")
-- "Tile grout requires cleaning and resealing" (not just "tile maintenance")
-- "Electrical outlet replacement required" (not just "electrical issue")
-- "Roof shingle replacement needed for weather damage" (not just "roof damage")
-- "Caulk and weatherstrip door frame" (not just "door seal repair")
-- "Snake drain line to clear blockage" (not just "drainage problem")
-- "Replace wax ring and reseat toilet" (not just "toilet issue")
-
-Generate a structured technical report using the following format:
-
-WORK ORDER VALIDATION:
-[If work order context provided, assess alignment between visual findings and client description]
-
-ISSUE TYPE:
-[Single line description of the primary issue(s) identified]
-
-GENERAL DESCRIPTION:
-[Explanation of the issue using common terminology familiar to US service providers, contractors, and maintenance professionals. Use industry-standard language that would appear on work orders, service tickets, or contractor estimates.]
-
-LOCATION:
-[Specific location details based on visual evidence from videos/images]
-
-DETAILED ASSESSMENT:
-[Thorough description of the damage/issue based on analysis of all provided media]
-
-PHYSICAL CHARACTERISTICS:
-- [Bullet points describing measurable/observable features from videos and images]
-- [Include dimensions, patterns, extent of damage where visible]
-- [Note any progression or variation visible across different media]
-
-TECHNICAL MEASUREMENTS:
-- [Estimated dimensions where scale references are available (e.g., relative to standard fixtures, doors, tiles)]
-- [Area measurements for damage extent (approximate square footage/meters)]
-- [Linear measurements for cracks, gaps, or affected spans]
-- [Volume estimates for water damage, mold growth, or material loss]
-- [Depth assessments for cracks, holes, or deterioration]
-- [Angle measurements for structural misalignment or settling]
-- [Count of affected units (tiles, panels, fixtures, etc.)]
-- [Spacing measurements between structural elements]
-- [Height/clearance measurements where safety is concerned]
-- [Only include measurements that can be reasonably estimated from visual evidence with clear reference points]
-
-TECHNICAL IMPLICATIONS:
-- [List of structural/functional impacts]
-- [Safety concerns]
-- [Security implications]
-- [Environmental effects]
-
-RECOMMENDED TRADES:
-[List specific trades from the available trades list that are most relevant to the identified issues]
-
-REPAIR REQUIREMENTS:
-1. [Prioritized list of necessary repairs]
-2. [Include safety measures required]
-3. [Special considerations for repair work]
-
-DOCUMENTATION NOTES:
-- [Additional relevant observations from video/image analysis]
-- [Areas needing further inspection]
-- [Correlation between different media if multiple files provided]
-- [Alignment or discrepancies with client description if provided]
-"""
-
-    SYSTEM_PROMPT = f"""You are a professional property inspection assistant specializing in technical documentation. Your role is to analyze video and image content showing household issues and produce structured technical reports. You will receive one or more media files (videos and/or images) and must analyze all provided content comprehensively.
-
-When work order information is provided, use it to enhance your analysis by:
-- Validating visual findings against client descriptions
-- Focusing on trades most relevant to identified issues
-- Providing context-aware recommendations
-
-Follow these key principles:
-
-1. MULTI-MEDIA ANALYSIS:
-- Analyze all provided videos and images thoroughly
-- Correlate information across different media types
-- Use static images for detailed visual assessment
-- Use video content for understanding motion, flow, or progressive damage
-- Synthesize findings from all sources into a unified report
-
-2. WORK ORDER INTEGRATION:
-- When available, reference client description to validate findings
-- Prioritize trades relevant to identified issues
-- Note any discrepancies between reported and observed issues
-
-3. DOCUMENTATION STYLE:
-- Maintain strictly professional and technical language
-- Never use conversational phrases or first-person language
-- Exclude greetings, introductions, and concluding remarks
-- Avoid hedging words like "seems," "appears," or "might"
-
-4. REPORT STRUCTURE:
-- Use consistent hierarchical formatting
-- Present information in clearly defined sections
-- Employ bullet points for discrete observations
-- Use numbered lists only for sequential procedures
-
-5. TECHNICAL DETAILS:
-- Prioritize measurable and observable characteristics
-- Include specific measurements when visible with clear reference points
-- Document patterns and extent of damage precisely
-- Note spatial relationships and orientations
-- Reference specific media when making observations
-- Provide technical measurements using scale references (doors ~80", standard tiles, fixtures)
-- Estimate dimensions, areas, and volumes only when reasonable references are visible
-- Include quantitative assessments: counts, linear measurements, affected areas
-- Use standard units (feet/inches for US, meters/cm for metric)
-- Clearly state estimation methods and reference points used
-
-6. SAFETY AND COMPLIANCE:
-- Always highlight immediate safety concerns
-- Include relevant safety procedures for repairs
-- Note potential code violations or compliance issues
-- Document security implications
-
-7. COMMUNICATION STANDARDS:
-- Use industry-standard terminology
-- Maintain objective, fact-based descriptions
-- Exclude subjective assessments
-- Omit speculative content
-- For General Description section: Use common US service provider language (HVAC, plumbing, electrical, flooring, roofing, etc.)
-- Include terminology from work orders, service tickets, and contractor estimates
-- Use trade-specific language familiar to maintenance professionals and contractors
-
-8. FOCUS AREAS:
-- Structural elements
-- Mechanical systems
-- Electrical components
-- Plumbing systems
-- Environmental conditions
-- Safety hazards
-- Security vulnerabilities
-
-FORMAT ALL OBSERVATIONS USING THE PRESCRIBED TEMPLATE STRUCTURE IN THE USER PROMPT.{BACKUP_SYSTEM_PROMPT}"""
-
-    # Prepare content parts for all uploaded files
-    content_parts = []
-    for uploaded_file in uploaded_files:
-        content_parts.append(
-            types.Part.from_uri(
-                file_uri=uploaded_file.uri, mime_type=uploaded_file.mime_type
-            )
+    """Return the queued job for the files on screen, submitting it if needed"""
+    if "pipeline_job_id" not in st.session_state:
+        # A refreshed page picks its job back up from the URL
+        st.session_state.pipeline_job_id = st.query_params.get("job")
+        st.session_state.pipeline_job_restored = True
+    job = PipelineJob.load(job_queue, st.session_state.pipeline_job_id)
+    if not uploaded_files:
+        return job if st.session_state.get("pipeline_job_restored") else None
+
+    key = job_key(uploaded_files, preprocess_mode, segment_seconds)
+    if job is None or job.key != key:
+        if job is not None:
+            job.cancel()
+        clear_analysis_result()
+        # The job's timeline starts with saving its files
+        trace = Trace()
+        with st.spinner("Saving files..."), activate(trace):
+            spill_dir = get_spill_dir()
+            file_paths = [spill_dir.spill(f) for f in uploaded_files]
+        job_id = submit_job(
+            job_queue,
+            spill_dir,
+            file_paths,
+            key,
+            work_order_number=work_order_number,
+            preprocess_mode=preprocess_mode,
+            auto_analyze=auto_analyze,
+            trace=trace,
+            segment_seconds=segment_seconds,
         )
-
-    try:
-        with st.spinner("Analyzing media files..."):
-            response = client.models.generate_content(
-                model=model_name,
-                contents=[
-                    types.Content(
-                        role="user",
-                        parts=content_parts,
-                    ),
-                    USER_PROMPT,
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction=SYSTEM_PROMPT,
-                    temperature=0.0,
-                ),
-            )
-            # Check if response has valid content
-        if not response.text or response.text.strip() == "":
-            # Handle empty response case - retry with main model first
-            if retry_count < max_retries:
-                st.warning(
-                    f"⚠️ {model_name} returned empty response (attempt {retry_count + 1}/{max_retries + 1}). Retrying..."
-                )
-                st.write(f"Debug: Response object: {type(response)}")
-                st.write(
-                    f"Debug: Response candidates: {len(response.candidates) if hasattr(response, 'candidates') else 'None'}"
-                )
-                if hasattr(response, "candidates") and response.candidates:
-                    candidate = response.candidates[0]
-                    st.write(
-                        f"Debug: Finish reason: {candidate.finish_reason if hasattr(candidate, 'finish_reason') else 'None'}"
-                    )
-                    st.write(
-                        f"Debug: Content parts: {candidate.content.parts if hasattr(candidate, 'content') and candidate.content else 'None'}"
-                    )
-
-                st.info(
-                    f"🔄 Retrying with {model_name} in {(retry_count + 1) * 2} seconds..."
-                )
-                time.sleep((retry_count + 1) * 2)  # Exponential backoff
-                return process_media_files(
-                    uploaded_files, work_order_info, retry_count + 1, max_retries
-                )
-            else:
-                # After max retries with main model, try fallback model
-                st.warning(
-                    f"⚠️ {model_name} failed after {max_retries + 1} attempts. Trying fallback model ({fallback_model})..."
-                )
-
-                # Try with fallback model using the same detailed prompt
-                fallback_response = client.models.generate_content(
-                    model=fallback_model,
-                    contents=[
-                        types.Content(
-                            role="user",
-                            parts=content_parts,
-                        ),
-                        USER_PROMPT,
-                    ],
-                    config=types.GenerateContentConfig(
-                        system_instruction=SYSTEM_PROMPT,
-                        temperature=0.0,
-                    ),
-                )
-
-                if fallback_response.text and fallback_response.text.strip():
-                    st.info(
-                        f"✅ Analysis completed using fallback model ({fallback_model})"
-                    )
-                    return fallback_response.text
-                else:
-                    raise ValueError(
-                        f"Both {model_name} and {fallback_model} returned empty responses after {max_retries + 1} attempts. This may indicate content policy restrictions or file processing issues."
-                    )
-
-        return response.text
-
-    except Exception as e:
-        error_message = str(e)
-
-        # Check if it's a retryable error (500, rate limit, etc.)
-        if any(
-            code in error_message
-            for code in ["500", "503", "429", "INTERNAL", "RATE_LIMIT"]
-        ):
-            if retry_count < max_retries:
-                st.warning(
-                    f"⚠️ API error with {model_name} (attempt {retry_count + 1}/{max_retries + 1}): {error_message}"
-                )
-                st.info(
-                    f"🔄 Retrying with {model_name} in {(retry_count + 1) * 2} seconds..."
-                )
-                time.sleep((retry_count + 1) * 2)  # Exponential backoff
-                return process_media_files(
-                    uploaded_files, work_order_info, retry_count + 1, max_retries
-                )
-            else:
-                # Try fallback model as last resort for server errors
-                st.warning("🔄 Trying fallback model for server error...")
-                try:
-                    response = client.models.generate_content(
-                        model=fallback_model,
-                        contents=[
-                            types.Content(
-                                role="user",
-                                parts=content_parts,
-                            ),
-                            USER_PROMPT,
-                        ],
-                        config=types.GenerateContentConfig(
-                            system_instruction=SYSTEM_PROMPT,
-                            temperature=0.0,
-                        ),
-                    )
-
-                    if response.text and response.text.strip():
-                        st.info(
-                            f"✅ Analysis completed using fallback model ({fallback_model})"
-                        )
-                        return response.text
-                    else:
-                        raise ValueError(
-                            f"Fallback model ({fallback_model}) also returned empty response."
-                        )
-
-                except Exception as fallback_error:
-                    st.error(
-                        f"❌ Analysis failed with both models. Please try again later."
-                    )
-                    st.info(
-                        "💡 This appears to be a widespread issue with Google's AI service:"
-                    )
-                    st.info("• Wait 10-15 minutes and try again")
-                    st.info(
-                        "• Check if your files are too large or in unsupported format"
-                    )
-                    st.info("• Try with fewer files at once")
-                    st.info("• Contact support if the issue persists")
-                    raise fallback_error
-        else:
-            # Non-retryable error
-            st.error(f"❌ Analysis error: {error_message}")
-            raise e
+        st.session_state.pipeline_job_id = job_id
+        st.session_state.pipeline_job_restored = False
+        st.query_params["job"] = job_id
+        job = PipelineJob.load(job_queue, job_id)
+    elif job.stage not in ("analyzing", "done", "cancelled"):
+        job.set_work_order(work_order_number)
+        if auto_analyze and not job.analysis_requested and job.stage != "failed":
+            job.request_analysis(work_order_number=work_order_number)
+    return job
+
+
+def forget_pipeline_job():
+    """Drop the session's job so the files on screen are submitted again"""
+    st.session_state.pipeline_job_id = None
+    st.session_state.pipeline_job_restored = False
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+
+def sync_analysis_result(job):
+    """Copy a finished job's report to the session state read by the results column"""
+    if job is None or job.result is None:
+        return
+    result = job.result
+    st.session_state.analysis_result = result["text"]
+    st.session_state.analysis_report = result.get("report")
+    st.session_state.analysis_attempts = result["events"]
+    st.session_state.analysis_timing = {
+        "model": result["model"],
+        "cached": result["cached"],
+        "time_to_first_token": result["time_to_first_token"],
+        "total_latency": result["latency"],
+    }
+    st.session_state.analysis_timeline = job.timeline
 
 
-def save_uploaded_file(uploaded_file):
-    """Save uploaded file to temp directory"""
-    try:
-        with open(os.path.join("temp", uploaded_file.name), "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return os.path.join("temp", uploaded_file.name)
-    except:
-        st.error("Error saving file")
-        return None
+def clear_analysis_result():
+    """Forget the report of a previous job"""
+    for key in (
+        "analysis_result",
+        "analysis_report",
+        "analysis_attempts",
+        "analysis_timing",
+        "analysis_timeline",
+    ):
+        if key in st.session_state:
+            del st.session_state[key]
+
+
+def show_quota_queue():
+    """Show how many requests wait for API quota, if this process sends them"""
+    # With JOB_WORKERS=0 analyses run in worker.py, whose limiter this is not
+    queued = limiter.queue_depth() if JOB_WORKERS else 0
+    if queued:
+        st.caption(f"⏱️ {queued} request(s) waiting for API quota")
+
+
+@st.fragment(run_every=1)
+def show_pipeline_status():
+    """Show the queued job's progress, refreshed every second"""
+    job = PipelineJob.load(job_queue, st.session_state.get("pipeline_job_id"))
+    if job is None:
+        return
+
+    if job.stage in STAGE_LABELS:
+        st.write(STAGE_LABELS[job.stage])
+    file_states = dict(job.file_states)
+    if job.stage in PREPARING_STAGES and file_states:
+        ready = sum(state in READY_STATES for state in file_states.values())
+        # Keyframes and segments mean more uploads than the files submitted
+        st.progress(min(1.0, ready / (job.media_count or len(file_states))))
+        for name, state in file_states.items():
+            icon = UPLOAD_STATUS_ICONS.get(state, "•")
+            st.text(f"{icon} {name}: {state.lower()}")
+    if job.stage == "queued":
+        queued = job_queue.counts().get("queued", 0)
+        if queued > 1:
+            st.caption(f"🕒 {queued} job(s) waiting for a worker")
+    if job.stage in PREPARING_STAGES and job.analysis_requested:
+        st.caption("🚀 Analysis will start as soon as the uploads finish")
+    if job.stage == "analyzing":
+        for message in job.messages[-3:]:
+            st.warning(message)
+        show_quota_queue()
+
+    # Rerun the whole page when the job reaches a stage with different controls
+    if job.stage != st.session_state.get("pipeline_stage_shown"):
+        st.session_state.pipeline_stage_shown = job.stage
+        if job.stage in FINISHED_STAGES:
+            st.rerun()
+
+
+@st.fragment(run_every=1)
+def show_live_report():
+    """Show the report while it is being streamed"""
+    job = PipelineJob.load(job_queue, st.session_state.get("pipeline_job_id"))
+    if job is not None and job.stage == "analyzing" and job.partial_text:
+        st.markdown(job.partial_text)
+
+
+def show_analysis_error(job):
+    """Explain a failed analysis and how to get past it"""
+    error_message = job.error
+    st.error(f"❌ Error during analysis: {error_message}")
+    if job.error_kind in ("server", "network", "rate_limit"):
+        st.error(f"❌ Analysis failed with both models. Please try again later.")
+        st.info("💡 This appears to be a widespread issue with Google's AI service:")
+        st.info("• Wait 10-15 minutes and try again")
+        st.info("• Check if your files are too large or in unsupported format")
+        st.info("• Try with fewer files at once")
+        st.info("• Contact support if the issue persists")
+
+    # Provide specific guidance based on error type
+    if "empty response" in error_message.lower():
+        st.info("🤖 **AI Model Response Issue:**")
+        st.info("• The AI model processed your request but returned no content")
+        st.info("• This may be due to content policy restrictions")
+        st.info("• Try with different/smaller video files")
+        st.info("• Ensure video content is appropriate for analysis")
+        st.info("• Check if video files are corrupted or unreadable")
+    elif any(code in error_message for code in ["500", "503", "INTERNAL"]):
+        st.info("🔧 **Server Error Solutions:**")
+        st.info("• This is a temporary Google AI server issue")
+        st.info("• Wait 2-3 minutes and try 'Analyze Files' again")
+        st.info("• Your files are still uploaded - no need to re-upload")
+    elif "429" in error_message or "RATE_LIMIT" in error_message:
+        st.info("⏱️ **Rate Limit Solutions:**")
+        st.info("• Too many requests - wait 5-10 minutes")
+        st.info("• Try analyzing fewer files at once")
+    else:
+        st.info("💡 **General Solutions:**")
+        st.info("• Check your internet connection")
+        st.info("• Ensure files are not corrupted")
+        st.info("• Try with smaller file sizes")
+        st.info("• Click 'Analyze Files' again (files remain uploaded)")
 
 
 def cleanup_files():
     """Clean up all uploaded files and reset session state"""
     try:
         # Delete local temp files
-        temp_dir = "temp"
-        if os.path.exists(temp_dir):
-            for filename in os.listdir(temp_dir):
-                file_path = os.path.join(temp_dir, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    st.write(f"🗑️ Deleted local file: {filename}")
+        for filename in get_spill_dir().clear():
+            st.write(f"🗑️ Deleted local file: {filename}")
 
         # Delete files from Google AI
-        if (
-            hasattr(st.session_state, "uploaded_files")
-            and st.session_state.uploaded_files
-        ):
-            for uploaded_file in st.session_state.uploaded_files:
+        job = PipelineJob.load(job_queue, st.session_state.get("pipeline_job_id"))
+        if job is not None:
+            job.cancel()
+            remote_files = job.remote_files()
+            # Forgotten first, so no other session reuses them while they go
+            remote_file_index.evict_names(remote_files)
+            for name in remote_files:
                 try:
-                    client.files.delete(name=uploaded_file.name)
-                    st.write(f"🗑️ Deleted from Google AI: {uploaded_file.name}")
+                    client.files.delete(name=name)
+                    st.write(f"🗑️ Deleted from Google AI: {name}")
                 except Exception as e:
-                    st.warning(
-                        f"Could not delete {uploaded_file.name} from Google AI: {str(e)}"
-                    )
+                    st.warning(f"Could not delete {name} from Google AI: {str(e)}")
+            # Files of a job restored after a page refresh live in an older session dir
+            if job.work_dir != get_spill_dir().path:
+                shutil.rmtree(job.work_dir, ignore_errors=True)
 
         # Clear session state
-        if hasattr(st.session_state, "uploaded_files"):
-            del st.session_state.uploaded_files
-        if hasattr(st.session_state, "analysis_result"):
-            del st.session_state.analysis_result
-        if hasattr(st.session_state, "files_ready_for_analysis"):
-            del st.session_state.files_ready_for_analysis
+        forget_pipeline_job()
+        clear_analysis_result()
 
         # Clear file uploader widgets by updating their keys
         if "file_uploader_key" not in st.session_state:
@@ -563,6 +349,57 @@ def show_cleanup_button():
             st.rerun()  # Refresh the app to show empty file uploaders
 
 
+def show_search_page():
+    """Search the reports of earlier analyses"""
+    st.markdown(
+        '<div class="section-header"><h3>🔎 Search Reports</h3></div>',
+        unsafe_allow_html=True,
+    )
+    col_query, col_trade, col_days, col_wo = st.columns([3, 2, 1, 1])
+    query = col_query.text_input("Search", placeholder="e.g. ceiling water stain")
+    trades = report_store.trade_counts()
+    trade = col_trade.selectbox(
+        "Recommended trade",
+        [""] + list(trades),
+        format_func=lambda t: f"{t} ({trades[t]})" if t else "Any",
+    )
+    days = col_days.number_input("Last N days", min_value=0, value=0, help="0: all")
+    work_order = col_wo.text_input("Work order")
+
+    started = time.monotonic()
+    results = report_store.search(
+        query,
+        trade=trade or None,
+        since=time.time() - days * 24 * 60 * 60 if days else None,
+        work_order=work_order or None,
+        limit=50,
+    )
+    elapsed = (time.monotonic() - started) * 1000
+    st.caption(
+        f"{len(results)} of {report_store.count()} stored report(s), "
+        f"found in {elapsed:.1f} ms"
+    )
+
+    for result in results:
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(result["created_at"]))
+        title = result["issue_type"] or "Free-form report"
+        with st.expander(f"{created} · {result['work_order'] or '-'} · {title}"):
+            st.caption(
+                f"Entity: {result['entity'] or '-'} · Model: {result['model']} · "
+                f"Latency: {result['latency'] or 0:.1f}s · Media: "
+                + ", ".join(digest[:12] for digest in result["media_hashes"])
+            )
+            text = report_store.get(result["id"])["text"]
+            st.markdown(text)
+            st.download_button(
+                label="💾 Download Report",
+                data=text,
+                file_name=f"inspection_report_{result['work_order'] or result['id']}.txt",
+                mime="text/plain",
+                key=f"download_report_{result['id']}",
+            )
+
+
 def display_media_files(file_paths):
     """Display uploaded media files in the UI"""
     for file_path in file_paths:
@@ -578,6 +415,9 @@ def display_media_files(file_paths):
 
 
 def main():
+    start_workers()
+    start_metrics()
+
     # Custom CSS for better styling
     st.markdown(
         """
@@ -621,6 +461,11 @@ def main():
         unsafe_allow_html=True,
     )
 
+    page = st.sidebar.radio("Page", ["🔧 Analyze Media", "🔎 Search Reports"])
+    if page == "🔎 Search Reports":
+        show_search_page()
+        return
+
     # Work Order Section
     st.markdown(
         '<div class="section-header"><h3>📋 Work Order Information</h3></div>',
@@ -635,11 +480,15 @@ def main():
         )
         fetch_button = st.button("🔍 Fetch Work Order", type="secondary")
 
+    work_order_number = work_order_number.strip()
     work_order_info = None
-    if fetch_button and work_order_number:
-        with st.spinner("Fetching work order information..."):
-            work_order_info = fetch_work_order_info(work_order_number)
-            st.session_state.work_order_info = work_order_info
+    if work_order_number:
+        # Looked up while the user picks files; Fetch waits for it (or retries it)
+        lookup = prefetch_work_order(work_order_number, refresh=fetch_button)
+        if fetch_button or lookup.done():
+            with st.spinner("Fetching work order information..."):
+                work_order_info = lookup.result()
+                st.session_state.work_order_info = work_order_info
 
     # Display work order info if available
     if hasattr(
@@ -672,6 +521,14 @@ def main():
     # Create main analysis columns
     col1, col2 = st.columns([1, 1])
 
+    with col2:
+        st.markdown(
+            '<div class="section-header"><h3>📊 Analysis Results</h3></div>',
+            unsafe_allow_html=True,
+        )
+        # Filled with partial text while a streamed analysis is running
+        show_live_report()
+
     with col1:
         st.markdown(
             '<div class="section-header"><h3>📁 Media Upload & Analysis</h3></div>',
@@ -710,182 +567,156 @@ def main():
         if uploaded_images:
             all_uploaded_files.extend(uploaded_images)
 
+        preprocess_mode = "none"
+        segment_seconds = 0
+        auto_analyze = False
         if all_uploaded_files:
-            # Create temp directory if it doesn't exist
-            os.makedirs("temp", exist_ok=True)
-
-            # Save all files and get their paths
-            file_paths = []
-            for uploaded_file in all_uploaded_files:
-                file_path = save_uploaded_file(uploaded_file)
-                if file_path:
-                    file_paths.append(file_path)
-
-            if file_paths:
-                # Show current status
-                files_uploaded = (
-                    hasattr(st.session_state, "uploaded_files")
-                    and st.session_state.uploaded_files
-                    and len(st.session_state.uploaded_files) == len(file_paths)
-                )
-
-                if files_uploaded:
-                    st.success(
-                        f"✅ {len(file_paths)} file(s) uploaded and ready for analysis"
-                    )
-                else:
-                    st.success(f"✅ {len(file_paths)} file(s) ready for upload")
-
-                with st.expander(f"👁️ Preview Files ({len(file_paths)})"):
-                    display_media_files(file_paths)
+            preprocess_mode = st.selectbox(
+                "🎞️ Video preprocessing",
+                list(PREPROCESS_MODES),
+                format_func=lambda mode: f"{mode}: {PREPROCESS_MODES[mode]}",
+                disabled=not ffmpeg_available(),
+                help=(
+                    "Shrink videos locally before upload"
+                    if ffmpeg_available()
+                    else "Install ffmpeg to enable local preprocessing"
+                ),
+            )
+            if st.checkbox(
+                f"✂️ Analyze long videos in {SEGMENT_SECONDS // 60}-minute parts",
+                value=False,
+                disabled=not ffmpeg_available(),
+                help=(
+                    "Split long walkthroughs locally, analyze the parts in parallel "
+                    "and merge them into one report with timestamps"
+                    if ffmpeg_available()
+                    else "Install ffmpeg to enable splitting long videos"
+                ),
+            ):
+                segment_seconds = SEGMENT_SECONDS
+            auto_analyze = st.checkbox(
+                "Analyze automatically as soon as the files are uploaded",
+                value=False,
+            )
 
+        # Upload and readiness polling start right away on the job queue's workers
+        job = get_pipeline_job(
+            all_uploaded_files,
+            work_order_number,
+            preprocess_mode,
+            auto_analyze,
+            segment_seconds,
+        )
+        if job is not None:
+            st.session_state.pipeline_stage_shown = job.stage
+
+            if job.file_paths:
+                with st.expander(f"👁️ Preview Files ({len(job.file_paths)})"):
+                    display_media_files(job.file_paths)
+
+            show_pipeline_status()
+
+            if job.stage == "failed" and job.failed_stage != "analyzing":
+                st.error(f"❌ Error uploading files: {job.error}")
+                if all_uploaded_files and st.button(
+                    "🔁 Retry Upload", use_container_width=True
+                ):
+                    forget_pipeline_job()
+                    st.rerun()
+            elif job.stage in ("ready", "failed") or (
+                job.stage in PREPARING_STAGES and not job.analysis_requested
+            ):
                 # Enhanced analyze button
                 analyze_button_text = "🚀 Analyze All Media"
                 if hasattr(
                     st.session_state, "work_order_info"
                 ) and st.session_state.work_order_info.get("success"):
                     analyze_button_text += " with Work Order Context"
-
-                # Check if files are already uploaded and ready for analysis
-                files_uploaded = (
-                    hasattr(st.session_state, "uploaded_files")
-                    and st.session_state.uploaded_files
-                    and len(st.session_state.uploaded_files) == len(file_paths)
-                )
-
-                # Show different buttons based on upload status
-                if not files_uploaded:
-                    # Step 1: Upload files
-                    if st.button(
-                        "📤 Upload Files to AI",
-                        type="primary",
-                        use_container_width=True,
-                    ):
-                        try:
-                            uploaded_files = []
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
-
-                            for i, file_path in enumerate(file_paths):
-                                status_text.text(
-                                    f"Uploading {os.path.basename(file_path)}..."
-                                )
-                                uploaded_file = upload_file(file_path)
-                                uploaded_files.append(uploaded_file)
-                                progress_bar.progress((i + 1) / len(file_paths))
-
-                            st.session_state.uploaded_files = uploaded_files
-                            st.session_state.files_ready_for_analysis = True
-
-                            status_text.empty()
-                            progress_bar.empty()
-                            st.success(
-                                f"✅ {len(uploaded_files)} files uploaded successfully!"
-                            )
-                            st.info(
-                                "👆 Now click 'Analyze Files' to generate your report."
-                            )
-                            st.rerun()
-
-                        except Exception as e:
-                            st.error(f"❌ Error uploading files: {str(e)}")
-                            # Clear any partial uploads
-                            if hasattr(st.session_state, "uploaded_files"):
-                                del st.session_state.uploaded_files
-                else:
-                    # Step 2: Analyze uploaded files
-                    st.success(
-                        f"✅ {len(st.session_state.uploaded_files)} files ready for analysis"
+                if job.stage in PREPARING_STAGES:
+                    analyze_button_text += " When Ready"
+
+                if job.prepared:
+                    show_quota_queue()
+                    cache_stats = result_cache.stats()
+                    st.caption(
+                        f"Result cache: {cache_stats['hits']} hits, "
+                        f"{cache_stats['misses']} misses, "
+                        f"{cache_stats['entries']} stored reports"
                     )
-
-                    if st.button(
-                        f"🚀 {analyze_button_text}",
-                        type="primary",
-                        use_container_width=True,
-                    ):
-                        try:
-                            status_text = st.empty()
-                            status_text.text(
-                                f"🔍 Analyzing files using {model_name}..."
-                            )
-
-                            # Get work order info if available
-                            work_order_context = None
-                            if hasattr(st.session_state, "work_order_info"):
-                                work_order_context = st.session_state.work_order_info
-
-                            # Process all files together
-                            analysis_result = process_media_files(
-                                st.session_state.uploaded_files, work_order_context
+                    inline_count = list(job.file_states.values()).count("INLINE")
+                    if inline_count:
+                        st.caption(
+                            f"🖼️ {inline_count} image(s) compacted and sent inline "
+                            "with the request instead of uploaded"
+                        )
+                    preprocessed = job.preprocess_summary
+                    if preprocessed:
+                        st.caption(
+                            "🎞️ Preprocessing saved "
+                            f"{preprocessed['bytes_saved'] / 1024 / 1024:.1f} MB of "
+                            f"{preprocessed['bytes_in'] / 1024 / 1024:.1f} MB "
+                            f"in {preprocessed['seconds']:.1f}s"
+                        )
+                    if job.poll_counts:
+                        st.caption(
+                            "Readiness checks per file: "
+                            + ", ".join(
+                                f"{name} ({polls})"
+                                for name, polls in job.poll_counts.items()
                             )
+                        )
 
-                            st.session_state.analysis_result = analysis_result
-
-                            status_text.empty()
-                            st.success(
-                                f"🎉 Analysis completed for {len(st.session_state.uploaded_files)} files!"
-                            )
-                            st.info(
-                                "👉 Check the 'Analysis Results' section on the right to view your report!"
-                            )
+                hedge_requests = st.checkbox(
+                    f"Race {HEDGE_MODEL} if {model_name} is slower than usual",
+                    value=False,
+                )
+                structured_report = st.checkbox(
+                    "Structured report (typed JSON, rendered as text)",
+                    value=False,
+                    help="The model fills in a fixed report schema; the fields are "
+                    "indexed for search and dashboards",
+                )
+                reuse_report = st.checkbox(
+                    "Reuse an earlier report of the same media",
+                    value=True,
+                    help="Skip the analysis when these files were analyzed before "
+                    "for the same work order",
+                )
+                stream_report = st.checkbox(
+                    "Show the report while it is being generated",
+                    value=True,
+                    disabled=hedge_requests or structured_report,
+                )
 
-                        except Exception as e:
-                            error_message = str(e)
-                            st.error(f"❌ Error during analysis: {error_message}")
-
-                            # Provide specific guidance based on error type
-                            if "empty response" in error_message.lower():
-                                st.info("🤖 **AI Model Response Issue:**")
-                                st.info(
-                                    "• The AI model processed your request but returned no content"
-                                )
-                                st.info(
-                                    "• This may be due to content policy restrictions"
-                                )
-                                st.info("• Try with different/smaller video files")
-                                st.info(
-                                    "• Ensure video content is appropriate for analysis"
-                                )
-                                st.info(
-                                    "• Check if video files are corrupted or unreadable"
-                                )
-                            elif any(
-                                code in error_message
-                                for code in ["500", "503", "INTERNAL"]
-                            ):
-                                st.info("🔧 **Server Error Solutions:**")
-                                st.info("• This is a temporary Google AI server issue")
-                                st.info(
-                                    "• Wait 2-3 minutes and try 'Analyze Files' again"
-                                )
-                                st.info(
-                                    "• Your files are still uploaded - no need to re-upload"
-                                )
-                            elif (
-                                "429" in error_message or "RATE_LIMIT" in error_message
-                            ):
-                                st.info("⏱️ **Rate Limit Solutions:**")
-                                st.info("• Too many requests - wait 5-10 minutes")
-                                st.info("• Try analyzing fewer files at once")
-                            else:
-                                st.info("💡 **General Solutions:**")
-                                st.info("• Check your internet connection")
-                                st.info("• Ensure files are not corrupted")
-                                st.info("• Try with smaller file sizes")
-                                st.info(
-                                    "• Click 'Analyze Files' again (files remain uploaded)"
-                                )
+                if job.stage == "failed":
+                    show_analysis_error(job)
+
+                if st.button(
+                    f"🚀 {analyze_button_text}",
+                    type="primary",
+                    use_container_width=True,
+                ):
+                    job.request_analysis(
+                        hedge=hedge_requests,
+                        stream=stream_report,
+                        work_order_number=work_order_number,
+                        structured=structured_report,
+                        reuse_report=reuse_report,
+                    )
+                    st.rerun()
+            elif job.stage == "done":
+                sync_analysis_result(job)
+                for level, message in result_notices(job.result):
+                    getattr(st, level)(message)
+                st.info(
+                    "👉 Check the 'Analysis Results' section on the right to view your report!"
+                )
         else:
             st.info(
                 "📤 Please upload at least one video or image file to begin analysis."
             )
 
     with col2:
-        st.markdown(
-            '<div class="section-header"><h3>📊 Analysis Results</h3></div>',
-            unsafe_allow_html=True,
-        )
-
         if (
             hasattr(st.session_state, "analysis_result")
             and st.session_state.analysis_result
@@ -893,7 +724,48 @@ def main():
             # Display results in a nice container
             with st.container():
                 st.markdown("### 📋 Technical Inspection Report")
+                timing = st.session_state.get("analysis_timing")
+                if timing and timing.get("cached"):
+                    st.caption(f"⚡ Served from the result cache ({timing['model']})")
+                elif timing:
+                    first_token = timing.get("time_to_first_token")
+                    st.caption(
+                        f"⏱️ {timing['model']}: "
+                        + (
+                            f"first text after {first_token:.1f}s, "
+                            if first_token
+                            else ""
+                        )
+                        + f"total {timing['total_latency']:.1f}s"
+                    )
+                attempts = st.session_state.get("analysis_attempts")
+                if attempts and len(attempts) > 1:
+                    with st.expander(f"🔁 Attempts ({len(attempts)})"):
+                        for event in attempts:
+                            st.write(
+                                f"{event.model} #{event.attempt + 1}: {event.outcome} "
+                                f"after {event.duration:.1f}s"
+                                + (f" - {event.error}" if event.error else "")
+                            )
+                timeline = st.session_state.get("analysis_timeline")
+                if timeline:
+                    with st.expander(f"🕒 Timeline ({len(timeline)} steps)"):
+                        st.caption(
+                            "Seconds after the files were saved; bytes, retries, "
+                            "model and tokens per step"
+                        )
+                        st.dataframe(timeline, hide_index=True)
                 st.markdown(st.session_state.analysis_result)
+                report = st.session_state.get("analysis_report")
+                if report:
+                    with st.expander("🧾 Structured report"):
+                        st.json(report)
+                        st.download_button(
+                            label="💾 Download JSON",
+                            data=json.dumps(report, indent=2),
+                            file_name=f"inspection_report_{work_order_number or 'analysis'}.json",
+                            mime="application/json",
+                        )
 
                 # Add download button for the report
                 report_filename = f"inspection_report_{work_order_number if work_order_number else 'analysis'}.txt"
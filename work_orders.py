@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tracing import span
+
+WORK_ORDER_URL = (
+    "https://proposal-backend-uat.onengine.io/commserve/confirm-work-order-number"
+)
+CACHE_TTL = 15 * 60  # seconds a validated work order is served from memory
+NEGATIVE_TTL = 60  # seconds an "invalid" answer is remembered
+MAX_CACHED = 1024
+POOL_SIZE = 8  # pooled connections, also the parallelism of bulk lookups
+
+
+def build_session(retries=3, backoff_factor=0.5, pool_size=POOL_SIZE):
+    """Create a session with retry logic and a connection pool of ``pool_size``"""
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST"],
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class WorkOrderClient:
+    """Work-order lookups over one pooled session, with an LRU+TTL cache.
+
+    Valid work orders are cached for ``ttl`` seconds and "invalid" answers for
+    ``negative_ttl`` seconds; lookups that failed (network or server errors)
+    are never cached. At most ``max_entries`` numbers are kept, the least
+    recently used being dropped first. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        url=WORK_ORDER_URL,
+        ttl=CACHE_TTL,
+        negative_ttl=NEGATIVE_TTL,
+        max_entries=MAX_CACHED,
+        pool_size=POOL_SIZE,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.pool_size = pool_size
+        self.session = build_session(pool_size=pool_size)
+        self._cache = OrderedDict()  # number -> (expires_at, info)
+        self._lock = threading.Lock()
+
+    def get(self, work_order_number):
+        """Return the work order info dict (see fetch_work_order_info)"""
+        number = str(work_order_number).strip()
+        with span("work_order_lookup", work_order=number) as attrs:
+            cached = self._cached(number)
+            if cached is not None:
+                attrs["outcome"] = "cached"
+                return cached
+
+            info = self._fetch(number, attrs)
+            if info["success"]:
+                self._store(number, info, self.ttl)
+            elif info.get("invalid"):
+                self._store(number, info, self.negative_ttl)
+                attrs["outcome"] = "invalid"
+            else:
+                attrs["outcome"] = "error"
+            return dict(info)
+
+    def get_many(self, work_order_numbers):
+        """Look up many work orders at once; returns {number: info}"""
+        numbers = list(dict.fromkeys(str(n).strip() for n in work_order_numbers))
+        if not numbers:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(numbers))) as ex:
+            return dict(zip(numbers, ex.map(self.get, numbers)))
+
+    def invalidate(self, work_order_number=None):
+        """Forget one cached work order, or all of them"""
+        with self._lock:
+            if work_order_number is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(str(work_order_number).strip(), None)
+
+    def _cached(self, number):
+        with self._lock:
+            entry = self._cache.get(number)
+            if entry is None:
+                return None
+            expires_at, info = entry
+            if expires_at <= time.monotonic():
+                del self._cache[number]
+                return None
+            self._cache.move_to_end(number)
+            return dict(info)
+
+    def _store(self, number, info, ttl):
+        with self._lock:
+            self._cache[number] = (time.monotonic() + ttl, info)
+            self._cache.move_to_end(number)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _fetch(self, number, attrs):
+        try:
+            response = self.session.get(self.url, params={"query": number}, timeout=10)
+            # Attempts the adapter's Retry made before this answer
+            retries = getattr(response.raw, "retries", None)
+            attrs["retries"] = len(retries.history) if retries else 0
+            response.raise_for_status()
+            data = response.json()
+
+            if data.get("valid"):
+                return {
+                    "success": True,
+                    "work_order_number": data.get("work_order_number"),
+                    "client_description": data.get("client_description"),
+                    "entity_name": data.get("entity_name"),
+                    "trades": data.get("trades", []),
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": "Invalid work order number",
+                    "invalid": True,
+                }
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+
+# Shared by the Streamlit app and the batch tools
+work_order_client = WorkOrderClient()
+
+
+def fetch_work_order_info(work_order_number):
+    """Fetch work order information from the API"""
+    return work_order_client.get(work_order_number)
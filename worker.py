@@ -0,0 +1,61 @@
+"""Run pipeline jobs submitted by the Streamlit app in a separate process.
+
+The app queues uploads and analyses in ``.cache/jobs.sqlite3`` and, unless
+started with ``JOB_WORKERS=0``, works on them itself. Extra worker processes
+on the same machine share the queue, so analyses keep running while the app
+restarts and more of them can run at once:
+
+    JOB_WORKERS=0 streamlit run video_processing.py
+    python worker.py --workers 4
+"""
+
+import argparse
+import os
+
+from google import genai
+
+from file_cache import RemoteFileIndex
+from job_queue import JOB_WORKERS, JobQueue, WorkerPool
+from pipeline import PipelineRunner
+from report_store import ReportStore
+from result_cache import ResultCache
+from tracing import METRICS_PORT, start_metrics_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(JOB_WORKERS, 1),
+        help="jobs this process runs at once",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="serve Prometheus metrics on this port (0: none)",
+    )
+    args = parser.parse_args()
+
+    queue = JobQueue()
+    runner = PipelineRunner(
+        genai.Client(api_key=os.environ["GOOGLE_API_KEY"]),
+        queue,
+        remote_index=RemoteFileIndex(),
+        result_cache=ResultCache(),
+        report_store=ReportStore(),
+    )
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+        print(f"📈 Metrics at http://localhost:{args.metrics_port}/metrics")
+    pool = WorkerPool(queue, runner, concurrency=args.workers).start()
+    print(f"👷 {args.workers} worker(s) waiting for jobs in {queue.path}")
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        print("⏹️ Stopping; jobs in progress are picked up again after a restart")
+
+
+if __name__ == "__main__":
+    main()
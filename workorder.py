@@ -1,10 +1,14 @@
-import requests
-import os
+import argparse
+import asyncio
 import base64
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+import hashlib
+import os
+
+import httpx
+
+from crawl_checkpoint import DONE_STATUSES, CrawlCheckpoint
+from file_cache import file_digest
 
-global found_count
 # Config
 API_TEMPLATE = "https://backend.blackstonemechanical.com/blackstone-new-backend/api/WorkOrders/GetFiles/{}"
 API_HEADERS = {
@@ -15,100 +19,372 @@ API_HEADERS = {
 WORKORDER_FILE = "/Users/vastu/Downloads/workorders.txt"
 SAVE_DIR = "downloaded_files"
 MAX_WITH_FILES = 20
-MAX_THREADS = 10  # number of parallel requests
+MAX_METADATA_REQUESTS = 10  # parallel GetFiles calls
+MAX_DOWNLOADS = 4  # parallel file downloads, kept apart from the metadata calls
+METADATA_TIMEOUT = httpx.Timeout(30, connect=10)
+DOWNLOAD_TIMEOUT = httpx.Timeout(20)
+DOWNLOAD_ATTEMPTS = 3  # per file and run, each resuming where the last stopped
+BASE64_CHUNK_SIZE = 4 * 1024 * 1024  # inline characters decoded at a time
 
-# Ensure save directory exists
-os.makedirs(SAVE_DIR, exist_ok=True)
 
-# Shared state for thread safety
-found_count = 0
-processed_count = 9300
-lock = Lock()
+def extract_files(data):
+    """Return the file entries of a GetFiles response (empty when there are none)"""
+    if isinstance(data, dict):
+        return data.get("data") or data.get("files") or []
+    if isinstance(data, list):
+        return data
+    return []
+
 
+async def get_files_for_workorder(client, workorder):
+    """Fetch files for a work order; return (workorder, files_list or None, error).
 
-def get_files_for_workorder(workorder):
-    """Fetch files for a work order; return (workorder, files_list or None)."""
+    ``error`` is set whenever the answer is not a JSON list of files (network
+    error, any HTTP status but 200, an empty or non-JSON body), so the work
+    order is recorded as failed and retried on the next run. Only a JSON
+    answer without files means the work order has none.
+    """
     url = API_TEMPLATE.format(workorder)
     try:
-        resp = requests.post(url, headers=API_HEADERS)
+        resp = await client.post(url, headers=API_HEADERS, timeout=METADATA_TIMEOUT)
 
         # Debug: print raw content (truncate for readability)
         raw_preview = resp.content[:200]  # first 200 bytes
         print(f"🔍 {workorder} → HTTP {resp.status_code}, Raw: {raw_preview!r}")
 
-        if resp.status_code != 200 or not resp.content.strip():
-            return workorder, None
-        if "application/json" in resp.headers.get("Content-Type", "").lower():
-            return workorder, resp.json()
-        return workorder, None
+        if resp.status_code != 200:
+            # 401/403/408 and gateway errors are often transient too
+            return workorder, None, f"HTTP {resp.status_code}"
+        if not resp.content.strip():
+            return workorder, None, "empty response"
+        if "application/json" not in resp.headers.get("Content-Type", "").lower():
+            return workorder, None, "non-JSON response"
+        return workorder, resp.json(), None
     except Exception as e:
         print(f"❌ Error fetching {workorder}: {e}")
-        return workorder, None
+        return workorder, None, str(e) or type(e).__name__
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class IncompleteDownload(IOError):
+    """The transfer ended before the announced number of bytes arrived"""
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _expected_size(response, offset):
+    """Total size of the file announced by the server, if it can be trusted"""
+    if response.status_code == 206:
+        # Content-Range: bytes <first>-<last>/<total or *>
+        first, _, total = (
+            response.headers.get("Content-Range", "").partition(" ")[2].partition("/")
+        )
+        if first.split("-")[0] != str(offset):
+            raise IncompleteDownload(f"server resumed at {first!r}, not {offset}")
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    # With a Content-Encoding the length counts compressed bytes, not ours
+    if length and length.isdigit() and not response.headers.get("Content-Encoding"):
+        return int(length)
+    return None
+
+
+async def download_file(client, url, path, expected_sha256=None):
+    """Download ``url`` to ``path`` through a resumable ``.part`` file.
+
+    Interrupted transfers are retried up to DOWNLOAD_ATTEMPTS times, each
+    continuing from the bytes already in the ``.part`` file, which is also
+    kept on disk for the next run. Returns ``(size, sha256 hex digest)``.
+    """
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            return await _download_part(client, url, path, expected_sha256)
+        except (httpx.TransportError, IncompleteDownload) as e:
+            if attempt + 1 == DOWNLOAD_ATTEMPTS:
+                raise
+            print(f"↩️ {os.path.basename(path)}: {e}, resuming")
+            await asyncio.sleep(2**attempt)
+
+
+async def _download_part(client, url, path, expected_sha256=None):
+    """One attempt: resume with HTTP Range, then verify and move into place.
+
+    The ETag or Last-Modified value of the first response is kept next to the
+    ``.part`` file and sent as If-Range, so a file that changed on the server
+    is downloaded again from the start instead of being spliced together.
+    The size is checked against Content-Length or Content-Range, and the
+    content against Content-MD5 (when sent for a full download) and
+    ``expected_sha256``; a file failing either check is discarded.
+    """
+    part_path = f"{path}.part"
+    validator_path = f"{part_path}.validator"
+    offset = _file_size(part_path)
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if os.path.exists(validator_path):
+            with open(validator_path) as f:
+                headers["If-Range"] = f.read()
+
+    async with client.stream(
+        "GET", url, headers=headers, timeout=DOWNLOAD_TIMEOUT
+    ) as r:
+        if r.status_code == 416:
+            # The partial file is no prefix of what the server has now
+            _remove(part_path)
+            raise IncompleteDownload("partial download no longer matches")
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0  # no range support, or the file changed: start over
+        expected_size = _expected_size(r, offset)
+        if offset:
+            print(f"↩️ {os.path.basename(path)}: resuming at {offset} bytes")
+        else:
+            validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+            if validator:
+                with open(validator_path, "w") as f:
+                    f.write(validator)
+            else:
+                _remove(validator_path)
+        content_md5 = r.headers.get("Content-MD5") if not offset else None
+        md5 = hashlib.md5() if content_md5 else None
+        with open(part_path, "ab" if offset else "wb") as out:
+            async for chunk in r.aiter_bytes():
+                out.write(chunk)
+                if md5:
+                    md5.update(chunk)
+
+    size = _file_size(part_path)
+    if expected_size is not None and size != expected_size:
+        if size > expected_size:
+            _remove(part_path)
+        raise IncompleteDownload(f"got {size} of {expected_size} bytes")
+    if md5 and base64.b64encode(md5.digest()).decode() != content_md5:
+        _remove(part_path)
+        raise ValueError("Content-MD5 does not match the downloaded bytes")
+    digest = file_digest(part_path)
+    if expected_sha256 and digest != expected_sha256:
+        _remove(part_path)
+        raise ValueError(f"SHA-256 {digest} does not match {expected_sha256}")
+    os.replace(part_path, path)
+    _remove(validator_path)
+    return size, digest
 
 
-def save_files(workorder, files):
-    """Save files locally from API response."""
+def write_base64(encoded, path):
+    """Decode inline base64 content to ``path`` a slice at a time.
+
+    Returns ``(size, sha256 hex digest)`` of the saved file.
+    """
+    tmp_path = f"{path}.tmp"
+    size = 0
+    digest = hashlib.sha256()
+
+    def write(data):
+        nonlocal size
+        out.write(data)
+        size += len(data)
+        digest.update(data)
+
+    try:
+        with open(tmp_path, "wb") as out:
+            carry = ""
+            for start in range(0, len(encoded), BASE64_CHUNK_SIZE):
+                # Line breaks would shift the 4-character groups between slices
+                chunk = carry + "".join(
+                    encoded[start : start + BASE64_CHUNK_SIZE].split()
+                )
+                usable = len(chunk) - len(chunk) % 4
+                write(base64.b64decode(chunk[:usable]))
+                carry = chunk[usable:]
+            if carry:
+                write(base64.b64decode(carry + "=" * (-len(carry) % 4)))
+        os.replace(tmp_path, path)
+        return size, digest.hexdigest()
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+async def save_files(client, workorder, files, downloads, checkpoint):
+    """Save files locally from API response, ``downloads`` bounding parallel transfers.
+
+    Files the checkpoint already has on disk are skipped. Returns one error
+    message per file that could not be saved.
+    """
+    errors = []
     for idx, f in enumerate(files):
+        if checkpoint.saved_file(workorder, idx, SAVE_DIR):
+            continue
         if "FileUrl" in f:
-            try:
-                r = requests.get(f["FileUrl"], timeout=20)
-                r.raise_for_status()
-                ext = os.path.splitext(f["FileUrl"])[1] or ".bin"
-                filename = f"{workorder}_{idx}{ext}"
-                with open(os.path.join(SAVE_DIR, filename), "wb") as out:
-                    out.write(r.content)
-            except:
-                pass
+            ext = os.path.splitext(f["FileUrl"])[1] or ".bin"
         elif "FileContent" in f:
-            try:
-                content = base64.b64decode(f["FileContent"])
-                filename = f"{workorder}_{idx}.bin"
-                with open(os.path.join(SAVE_DIR, filename), "wb") as out:
-                    out.write(content)
-            except:
-                pass
+            ext = ".bin"
+        else:
+            continue
+        filename = f"{workorder}_{idx}{ext}"
+        try:
+            if "FileUrl" in f:
+                async with downloads:
+                    size, sha256 = await download_file(
+                        client, f["FileUrl"], os.path.join(SAVE_DIR, filename)
+                    )
+            else:
+                size, sha256 = write_base64(
+                    f["FileContent"], os.path.join(SAVE_DIR, filename)
+                )
+        except Exception as e:
+            errors.append(f"{filename}: {str(e) or type(e).__name__}")
+            print(f"❌ {errors[-1]}")
+            continue
+        checkpoint.record_file(workorder, idx, filename, size, sha256)
+    return errors
 
 
-def process_workorder(workorder):
-    """Thread worker: fetch and save files if found."""
-    global found_count, processed_count
-    wo, data = get_files_for_workorder(workorder)
+class Crawler:
+    """Walk a list of work orders until ``max_with_files`` of them had files.
 
-    # Determine if files exist
-    if isinstance(data, dict):
-        files = data.get("data") or data.get("files") or []
-    elif isinstance(data, list):
-        files = data
-    else:
-        files = []
-
-    with lock:
-        processed_count += 1
-        if files:
-            found_count += 1
-            print(
-                f"✅ {wo}: {len(files)} files found "
-                f"(Found: {found_count}/{MAX_WITH_FILES}, Processed: {processed_count})"
-            )
-        else:
+    ``metadata_requests`` workers take work orders from a shared iterator, so
+    nothing is queued ahead of time and stopping is a matter of cancelling
+    the workers. Files of a work order that counts towards the target are
+    downloaded in their own task, limited to ``max_downloads`` at a time, so
+    slow videos never hold up the metadata calls. One HTTP client with a
+    keep-alive connection pool serves every request.
+
+    Every outcome is written to ``checkpoint``: work orders it marks as done
+    are skipped and those saved earlier count towards the target, so a rerun
+    picks up where the last one stopped and only retries failures.
+    """
+
+    def __init__(
+        self,
+        client,
+        checkpoint,
+        max_with_files=MAX_WITH_FILES,
+        metadata_requests=MAX_METADATA_REQUESTS,
+        max_downloads=MAX_DOWNLOADS,
+    ):
+        self.client = client
+        self.checkpoint = checkpoint
+        self.max_with_files = max_with_files
+        self.metadata_requests = metadata_requests
+        self.downloads = asyncio.Semaphore(max_downloads)
+        counts = checkpoint.counts()
+        self.found_count = counts.get("saved", 0)
+        self.processed_count = sum(counts.get(status, 0) for status in DONE_STATUSES)
+        self.target_reached = asyncio.Event()
+        self.download_tasks = set()
+
+    async def run(self, workorders):
+        """Process ``workorders`` in order until the target is reached or they run out"""
+        if self.found_count >= self.max_with_files:
+            return
+        finished = self.checkpoint.finished()
+        pending = iter([wo for wo in workorders if wo not in finished])
+        workers = asyncio.gather(
+            *(self._worker(pending) for _ in range(self.metadata_requests))
+        )
+        target = asyncio.create_task(self.target_reached.wait())
+        try:
+            await asyncio.wait([target, workers], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Abandon in-flight metadata calls; their connections return to the pool
+            target.cancel()
+            workers.cancel()
+            await asyncio.gather(target, workers, return_exceptions=True)
+            if self.download_tasks:
+                print(f"⏳ Waiting for {len(self.download_tasks)} download(s)...")
+                await asyncio.gather(*self.download_tasks, return_exceptions=True)
+
+    async def _worker(self, pending):
+        for workorder in pending:
+            await self.process_workorder(workorder)
+
+    async def process_workorder(self, workorder):
+        """Fetch one work order and start downloading its files if found."""
+        wo, data, error = await get_files_for_workorder(self.client, workorder)
+        files = extract_files(data)
+        if self.target_reached.is_set():
+            return
+
+        if error:
+            self.checkpoint.record_workorder(wo, "failed", reason=error)
+            return
+
+        self.processed_count += 1
+        if not files:
+            self.checkpoint.record_workorder(wo, "no_files")
             print(
                 f"❌ {wo}: no files "
-                f"(Found: {found_count}/{MAX_WITH_FILES}, Processed: {processed_count})"
+                f"(Found: {self.found_count}/{self.max_with_files}, "
+                f"Processed: {self.processed_count})"
+            )
+            return
+
+        self.found_count += 1
+        print(
+            f"✅ {wo}: {len(files)} files found "
+            f"(Found: {self.found_count}/{self.max_with_files}, "
+            f"Processed: {self.processed_count})"
+        )
+        task = asyncio.create_task(self.save_workorder(wo, files))
+        self.download_tasks.add(task)
+        task.add_done_callback(self.download_tasks.discard)
+        if self.found_count >= self.max_with_files:
+            self.target_reached.set()
+
+    async def save_workorder(self, workorder, files):
+        """Download a work order's files and record whether all of them were saved"""
+        errors = await save_files(
+            self.client, workorder, files, self.downloads, self.checkpoint
+        )
+        if errors:
+            print(f"⚠️ {workorder}: {len(errors)} file(s) failed: {errors[0]}")
+            self.checkpoint.record_workorder(
+                workorder, "failed", len(files), reason="; ".join(errors)
             )
+        else:
+            self.checkpoint.record_workorder(workorder, "saved", len(files))
+
 
-    if files:
-        save_files(wo, files)
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Download media for work orders listed one per line in a file"
+    )
+    parser.add_argument("--workorders", default=WORKORDER_FILE)
+    parser.add_argument("--max-with-files", type=int, default=MAX_WITH_FILES)
+    args = parser.parse_args()
 
+    # Ensure save directory exists
+    os.makedirs(SAVE_DIR, exist_ok=True)
 
-with open(WORKORDER_FILE) as f:
-    workorders = [line.strip() for line in f if line.strip()]
+    with open(args.workorders) as f:
+        workorders = [line.strip() for line in f if line.strip()]
 
-workorders = workorders[9300:]
+    checkpoint = CrawlCheckpoint()
+    limits = httpx.Limits(
+        max_connections=MAX_METADATA_REQUESTS + MAX_DOWNLOADS,
+        max_keepalive_connections=MAX_METADATA_REQUESTS + MAX_DOWNLOADS,
+    )
+    async with httpx.AsyncClient(limits=limits, follow_redirects=True) as client:
+        crawler = Crawler(client, checkpoint, max_with_files=args.max_with_files)
+        await crawler.run(workorders)
+    print(
+        f"🏁 Found {crawler.found_count} work orders with files "
+        f"(Processed: {crawler.processed_count}, by status: {checkpoint.counts()})"
+    )
 
-with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-    futures = {executor.submit(process_workorder, wo): wo for wo in workorders}
 
-    for future in as_completed(futures):
-        with lock:
-            if found_count >= MAX_WITH_FILES:
-                break
+if __name__ == "__main__":
+    asyncio.run(main())